@@ -0,0 +1,144 @@
+import sys
+sys.path.insert(1, '..')
+
+import logging
+import numpy as np
+import networkx as nx
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from analysis.network_analysis import get_adjacency_matrix
+
+DEFAULT_BATCH_SIZE = 256  # sources processed together in one vectorized BFS
+
+
+def _get_dependencies(adjacency, sources):
+    """Counts Brandes dependencies of all nodes on a batch of sources (unweighted shortest paths).
+
+    BFS runs level by level for all sources of the batch at once: one sparse product per level
+    counts shortest paths forwards, another one accumulates dependencies backwards.
+
+    Parameters
+    ------------
+        adjacency: scipy.sparse.csr_matrix
+            Adjacency matrix (n*n), non-zero means an edge
+        sources: np.ndarray
+            Source node positions
+    Return
+    -----------
+        dependencies : np.ndarray
+            Array of shape (len(sources), n), dependency of every node on every source
+    """
+    n = adjacency.shape[0]
+    batch = np.arange(len(sources))
+    sigma = np.zeros((len(sources), n))
+    sigma[batch, sources] = 1
+    visited = sigma > 0
+    levels = [visited.copy()]
+    frontier = sigma.copy()
+    while True:
+        paths = np.asarray((adjacency.T @ frontier.T).T)  # shortest paths counts through the frontier
+        level = (paths > 0) & ~visited
+        if not level.any():
+            break
+        sigma[level] = paths[level]
+        visited |= level
+        levels += level,
+        frontier = np.where(level, paths, 0)
+    dependencies = np.zeros((len(sources), n))
+    for depth in range(len(levels) - 1, 0, -1):
+        coefficients = np.where(levels[depth], (1 + dependencies) / np.where(sigma > 0, sigma, 1), 0)
+        successors = np.asarray((adjacency @ coefficients.T).T)
+        dependencies += np.where(levels[depth - 1], sigma * successors, 0)
+    dependencies[batch, sources] = 0
+    return dependencies
+
+def _accumulate_dependencies(adjacency, sources, batch_size=DEFAULT_BATCH_SIZE):
+    """Returns sums and sums of squares of dependencies on sources (used as a process pool task)"""
+    n = adjacency.shape[0]
+    total = np.zeros(n)
+    total_squared = np.zeros(n)
+    for start in range(0, len(sources), batch_size):
+        dependencies = _get_dependencies(adjacency, sources[start:start + batch_size])
+        total += dependencies.sum(axis=0)
+        total_squared += (dependencies ** 2).sum(axis=0)
+    return total, total_squared
+
+def betweenness_centrality(G: nx.Graph, sample_size: int = None, normalized: bool = True, seed: int = None, n_jobs: int = 1, batch_size: int = DEFAULT_BATCH_SIZE, return_error: bool = False):
+    """A function to measure (unweighted) betweenness centrality, exactly or by pivot sampling,
+    sharding source nodes across a process pool.
+
+    Exact values are the same as nx.betweenness_centrality(G, normalized=normalized).
+
+    Parameters
+    ------------
+        G: networkx.Graph or networkx.DiGraph
+            Network graph
+        sample_size: int or None
+            Number of pivots (source nodes) to sample for the approximate mode, None for exact betweenness.
+            Default: None
+        normalized: bool
+            Whether to normalize by the number of node pairs, as in networkx. Default: True
+        seed: int or None
+            Random seed for pivot sampling
+        n_jobs: int
+            Number of worker processes, 1 for running in the current process. Default: 1
+        batch_size: int
+            Number of sources in one vectorized BFS, limits memory to batch_size * n * (graph diameter). Default: 256
+        return_error: bool
+            Whether to return standard errors of the estimates (zero in the exact mode). Default: False
+    Return
+    -----------
+        betweenness : dict
+            Betweenness centrality of every node
+        error : dict
+            Standard error of the betweenness estimate of every node (only if return_error is True)
+    """
+    nodes = pd.Index(list(G.nodes()))
+    n = len(nodes)
+    adjacency = get_adjacency_matrix(G, nodes, weight=None)
+
+    if sample_size is None or sample_size >= n:
+        sources = np.arange(n)
+    else:
+        sources = np.sort(np.random.default_rng(seed).choice(n, size=sample_size, replace=False))
+
+    if n_jobs == 1 or len(sources) <= 1:
+        total, total_squared = _accumulate_dependencies(adjacency, sources, batch_size)
+    else:
+        shards = [shard for shard in np.array_split(sources, n_jobs) if len(shard) > 0]
+        total = np.zeros(n)
+        total_squared = np.zeros(n)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            for shard_total, shard_total_squared in executor.map(_accumulate_dependencies, [adjacency] * len(shards), shards, [batch_size] * len(shards)):
+                total += shard_total
+                total_squared += shard_total_squared
+
+    # every node depends on n - 1 possible sources (itself excluded), samples_count of them were sampled
+    is_source = np.zeros(n, dtype=bool)
+    is_source[sources] = True
+    samples_count = len(sources) - is_source
+    mean = np.divide(total, samples_count, out=np.zeros(n), where=samples_count > 0)
+    betweenness = mean * (n - 1)
+    if len(sources) < n:
+        # standard error of the mean for sampling without replacement from n - 1 sources
+        variance = np.divide(total_squared - samples_count * mean ** 2, samples_count - 1, out=np.zeros(n), where=samples_count > 1)
+        finite_population = np.clip(1 - samples_count / (n - 1), 0, 1) if n > 1 else np.zeros(n)
+        error = (n - 1) * np.sqrt(np.clip(variance, 0, None) / np.maximum(samples_count, 1) * finite_population)
+        error[samples_count == 0] = np.nan
+    else:
+        error = np.zeros(n)
+
+    if normalized:
+        scale = 1 / ((n - 1) * (n - 2)) if n > 2 else 1
+    else:
+        scale = 1 if G.is_directed() else 0.5  # undirected pairs are counted twice
+    betweenness *= scale
+    error *= scale
+    if len(sources) < n:
+        logging.info(f"Approximate betweenness with {len(sources)} pivots of {n} nodes, max standard error {np.nanmax(error) if n > 0 else 0:.4f}")
+
+    betweenness = dict(zip(nodes, betweenness))
+    if return_error:
+        return betweenness, dict(zip(nodes, error))
+    return betweenness
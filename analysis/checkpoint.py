@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHECKPOINT_DIR = '../data/checkpoints'
+CELL_COLUMNS = {
+    'year': np.int16,
+    'community_id': np.int32,
+    'country': np.int32,
+    'is_hegemon': bool,
+    'local_centrality': np.float64,
+    'hierarchy_score': np.float64,
+    'community_resolution': np.float64,
+}
+
+
+def get_sweep_key(df_triple: pd.DataFrame, countries_all, params: dict):
+    """Returns a hash identifying a sweep by its input data and parameters
+
+    Parameters
+    ------------
+        df_triple: pd.DataFrame
+            DataFrame with dyadic data (year*country*country) the networks are built from
+        countries_all: iterable
+            All countries involved (country codes in checkpoints refer to their sorted index)
+        params: dict
+            Sweep parameters, values should be JSON-serializable (others are converted to strings)
+    Return
+    -----------
+        key : str
+            Hex digest, same inputs and parameters give the same key
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(df_triple, index=True).to_numpy().tobytes())
+    digest.update(json.dumps(sorted(countries_all)).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
+
+
+class SweepCheckpoint():
+    """
+    Durable store of sweep results, one Parquet file per (year, resolution) cell.
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+        Directory of the sweep, checkpoint_dir/key
+    params : dict
+        Sweep parameters (saved to params.json for reference)
+
+    Files are written to a temporary name and moved into place with os.replace,
+    so an interrupted run never leaves a partially written cell behind.
+    """
+    def __init__(self, checkpoint_dir: str, key: str, params: dict = None):
+        self.path = os.path.join(checkpoint_dir, key)
+        self.params = params
+        os.makedirs(self.path, exist_ok=True)
+        if params is not None:
+            def write_params(path):
+                with open(path, 'w') as f:
+                    json.dump(params, f, sort_keys=True, default=str, indent=1)
+            self._write_atomic(os.path.join(self.path, 'params.json'), write_params)
+
+    def __repr__(self):
+        repr = f'SweepCheckpoint at {self.path}'
+        return repr
+
+    @staticmethod
+    def _write_atomic(path, write):
+        temp_path = f'{path}.tmp{os.getpid()}'
+        write(temp_path)
+        os.replace(temp_path, path)
+
+    def _get_cell_path(self, year, resolution):
+        return os.path.join(self.path, f'{year}_{resolution}.parquet')
+
+    def load(self, year, resolution):
+        """Returns the saved table of the cell, None if the cell was not computed yet (or cannot be read)"""
+        path = self._get_cell_path(year, resolution)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_parquet(path)
+        except Exception as e:
+            logging.warning(f"Cannot read checkpoint {path} ({e}), recomputing")
+            return None
+
+    def save(self, year, resolution, table: pd.DataFrame):
+        """Saves the table of a computed cell (see analysis.community.analyse_local_community with return_format='table')"""
+        table = table.astype(CELL_COLUMNS)[list(CELL_COLUMNS)].reset_index(drop=True)
+        self._write_atomic(self._get_cell_path(year, resolution), lambda path: table.to_parquet(path, index=False))
+        logging.debug(f"Saved checkpoint for {year}, res={resolution}")
@@ -2,10 +2,15 @@ import sys
 sys.path.insert(1, '..')
 
 import pandas as pd
+import numpy as np
 import networkx as nx
 import logging
 
 from analysis.network_analysis import countCentrality, get_network_from_year_df
+from analysis.reaching import global_reaching_centralities
+from analysis.sweep import CommunitySweep, SWEEP_COLUMNS, PARTITION_COLUMNS
+from analysis.checkpoint import SweepCheckpoint, get_sweep_key
+from utils.utils import get_country_index
 
 class Community():
     """
@@ -17,6 +22,10 @@ class Community():
     ----------
     members : list
         List of countries which are members of the community.
+    member_codes : np.ndarray
+        Integer codes of the members in country_index
+    country_index : pd.Index
+        Fixed index of countries the member codes refer to
     hierarchy_score : float
         Hierarchy score (presumable using Global Reaching Centrality - https://doi.org/10.1371/journal.pone.0033799)
     resolution : float
@@ -27,8 +36,12 @@ class Community():
         Year the community was observed in
 
     """
-    def __init__(self, members: list(), hierarchy_score: float(), resolution: float(), hegemons: list(), year: int):
-        self.members = members
+    def __init__(self, members, hierarchy_score: float(), resolution: float(), hegemons: list(), year: int, country_index: pd.Index = None):
+        if country_index is None:  # members are passed as a list of country names
+            country_index = pd.Index(members)
+            members = np.arange(len(country_index))
+        self.country_index = country_index
+        self.member_codes = np.asarray(members)
         self.hierarchy_score = hierarchy_score
         self.resolution = resolution
         self.hegemons = hegemons
@@ -37,13 +50,20 @@ class Community():
     def __repr__(self):
         repr = f'{self.year} Community at resolution {self.resolution} of {self.population} with {self.hegemons} as hegemon (hierarchy score = {self.hierarchy_score}).\nThe members are {self.members}'
         return repr
+
+    @property
+    def members(self):
+        """
+        Returns the list of countries which are members of the community.
+        """
+        return self.country_index[self.member_codes].to_list()
         
     @property
     def population(self):
         """
         Returns the number of states in the community.
         """
-        return len(self.members)
+        return len(self.member_codes)
 
 class Hegemon():
     """
@@ -78,8 +98,61 @@ class Hegemon():
         repr = f'{self.name} ({self.centrality:.3f})'
         return repr
 
-def analyse_local_community(network, df_triple, countries_all, year, centrality_threshold, centrality_type, community_detection='louvian', resolution=None, max_size=None, hierarchy_threshold=0):
-    """Analyses a single local community using louvian heuristic"""
+def get_community_labels(communities, country_index):
+    """Encodes a partition as an integer label array over a fixed country index
+
+    Parameters
+    ------------
+        communities: iterable
+            Iterable of sets of countries (as returned by networkx community detection algorithms)
+        country_index: pd.Index
+            Fixed index of countries (see utils.utils.get_country_index)
+
+    Return
+    -----------
+        labels: np.ndarray
+            Community number for each country in country_index, -1 for countries outside of any community.
+            For overlapping communities (k_clique) the last community a country is found in is kept.
+    """
+    labels = np.full(len(country_index), -1, dtype=np.int32)
+    for i, cluster in enumerate(communities):
+        codes = country_index.get_indexer(list(cluster))
+        labels[codes[codes >= 0]] = i
+    return labels
+
+def get_community_members(labels, community_count=None):
+    """Splits an integer label array into arrays of member codes
+
+    Parameters
+    ------------
+        labels: np.ndarray
+            Community number for each country, -1 for countries outside of any community
+        community_count: int or None
+            Number of communities, default is max label + 1
+
+    Return
+    -----------
+        populations: np.ndarray
+            Number of members in each community
+        members: list
+            List of np.ndarray with member codes of each community (sorted by code)
+    """
+    assigned = labels >= 0
+    if community_count is None:
+        community_count = labels.max() + 1 if assigned.any() else 0
+    populations = np.bincount(labels[assigned], minlength=community_count)
+    order = np.argsort(labels, kind='stable')
+    order = order[assigned[order]]  # -1 labels come first after sorting
+    members = np.split(order, np.cumsum(populations)[:-1]) if community_count > 0 else []
+    return populations, members
+
+def analyse_local_community(network, df_triple, countries_all, year, centrality_threshold, centrality_type, community_detection='louvian', resolution=None, max_size=None, hierarchy_threshold=0, hierarchy_weight=None, return_format='objects'):
+    """Analyses a single local community using louvian heuristic
+
+    hierarchy_weight (None or 'weight') chooses unweighted or weighted Global Reaching Centrality for hierarchy scores.
+    return_format is 'objects' for a list of Community or 'table' for a DataFrame of members (see analysis.sweep.CommunitySweep)"""
+    if return_format not in ('objects', 'table'):
+        raise NotImplementedError(return_format)
     logging.debug(f"Resolution is {resolution}, year is {year}")
     unirected_g = nx.Graph(network) # Using undirected graph for the purposes of community detection
 
@@ -95,33 +168,27 @@ def analyse_local_community(network, df_triple, countries_all, year, centrality_
         communities_generator = nx.community.k_clique_communities(unirected_g, k = 5)  # k is the size of a smallest clique
     else:
         raise NotImplementedError(community_detection)
-    communities = dict()
-
-    for j, country in enumerate(countries_all):
-        for i, cluster in enumerate(communities_generator):
-            if country in cluster:
-                communities[country] = i
-
-    community_df = pd.DataFrame(communities.items(), columns = ['Country', 'Community'])
-    # counting population of clusters
-    cluster_count = community_df.groupby('Community').count().to_dict()['Country']
-    community_df['Community pop'] = community_df.apply(lambda x: cluster_count[x['Community']], axis=1)
-    community_df = community_df.set_index('Country')
-    # measuring centrality
-    centrality_all = countCentrality(network, countries_all, centrality_type)
-    res_df = pd.concat([community_df, centrality_all], axis=1)
+    communities = list(communities_generator)  # k_clique returns a generator, which can only be consumed once
+
+    country_index = get_country_index(countries_all)
+    labels = get_community_labels(communities, country_index)
+    populations, members = get_community_members(labels, len(communities))
+    # hierarchy scores for all communities at once (digraph only)
+    hierarchy_scores = global_reaching_centralities(network, labels, country_index, weight=hierarchy_weight, community_count=len(communities))
     # exclude 1-pop clusters from analysis
-    res_df = res_df[res_df['Community pop'] > 1]
+    community_ids = np.flatnonzero(populations > 1)
     # counting within-comminity centrality
-    community_count = len(res_df['Community'].unique())
+    community_count = len(community_ids)
     community_members = list()
     community_infos = list()
-    for i, community in enumerate(res_df['Community'].unique()):
-        comm_members = list(res_df[res_df['Community'] == community].index)
+    community_tables = list()
+    for community_id in community_ids:
+        member_codes = members[community_id]
+        comm_members = country_index[member_codes].to_list()
         comm_network = get_network_from_year_df(df_triple, comm_members, year, ego_indexname = 'ego', alter_indexname = 'alter', forceString=False) # remove forceString if error
-        fin_df = countCentrality(comm_network, comm_members, centrality_type, 'local').sort_values('local_centrality', ascending=False)
+        fin_df = countCentrality(comm_network, comm_members, centrality_type, 'local').sort_values('local_centrality', ascending=False, kind='stable')
         community_members += len(comm_members),
-        hierarchy_score = nx.global_reaching_centrality(comm_network) #digraph only
+        hierarchy_score = hierarchy_scores[community_id]
         #print(fin_df)
         hegemons=None
         
@@ -143,7 +210,19 @@ def analyse_local_community(network, df_triple, countries_all, year, centrality_
             if len(hegemons_names) == 0: hegemons = None
             #hegemon_list[year] += (hegemons, len(comm_members)),
         #print(resolution/10)
-        community_info = Community(comm_members, hierarchy_score, resolution/10, hegemons, year)
+        if return_format == 'table':
+            hegemons_names = [hegemon.name for hegemon in hegemons or []]
+            community_tables += pd.DataFrame({
+                'year': year,
+                'community_id': len(community_tables),
+                'country': member_codes,
+                'is_hegemon': np.isin(comm_members, hegemons_names),
+                'local_centrality': fin_df.loc[comm_members, 'local_centrality'].to_numpy(),
+                'hierarchy_score': hierarchy_score,
+                'community_resolution': resolution/10 if resolution is not None else np.nan,
+            }),
+            continue
+        community_info = Community(member_codes, hierarchy_score, resolution/10 if resolution is not None else None, hegemons, year, country_index=country_index)
         community_infos += community_info,
     #community_infos[f'{i} - {resolution/10}'] = community_info
     logging.debug(f"Число сообществ: {community_count}")
@@ -154,13 +233,38 @@ def analyse_local_community(network, df_triple, countries_all, year, centrality_
     #community_counts += [community_count]
     #community_members_all += (sum(community_members)/len(community_members),)
     #hegemon_counts += [len(hegemon_list[year])]
+    if return_format == 'table':
+        return pd.concat(community_tables) if community_tables else pd.DataFrame(columns=['year', 'community_id', 'country', 'is_hegemon', 'local_centrality', 'hierarchy_score', 'community_resolution'])
     return community_infos
         
 
-def detect_local_communities(networks, df_triple, countries_all, year_start, year_end, resolution_range, centrality_threshold, centrality_type='out-degree', community_detection='louvian', hierarchy_threshold=0):
-    """Analyses multiple local communities"""
+def detect_local_communities(networks, df_triple, countries_all, year_start, year_end, resolution_range, centrality_threshold, centrality_type='out-degree', community_detection='louvian', hierarchy_threshold=0, hierarchy_weight=None, return_format='sweep', checkpoint_dir=None):
+    """Analyses multiple local communities
+
+    return_format is 'sweep' for a columnar analysis.sweep.CommunitySweep (sweep[year][resolution] gives a list of community views)
+    or 'dict' for a dict[year][resolution] -> list[Community].
+    If checkpoint_dir is set, every (year, resolution) result is saved there as soon as it is computed (see analysis.checkpoint),
+    and re-running with the same df_triple, countries and parameters loads completed results instead of recomputing them
+    (networks are assumed to be built from df_triple). Checkpoints require return_format='sweep'.
+    df_triple can be a data_handling.sparsetriple.SparseTriple (its nonzero values are used)."""
+    if not isinstance(df_triple, pd.DataFrame):
+        df_triple = df_triple.to_frame()
+    if return_format not in ('sweep', 'dict'):
+        raise NotImplementedError(return_format)
+    if checkpoint_dir is not None and return_format != 'sweep':
+        raise ValueError("checkpoints are only supported with return_format='sweep'")
+    table_format = 'table' if return_format == 'sweep' else 'objects'
+    checkpoint = None
+    if checkpoint_dir is not None:
+        params = {'centrality_threshold': centrality_threshold, 'centrality_type': centrality_type, 'community_detection': community_detection,
+                  'hierarchy_threshold': hierarchy_threshold, 'hierarchy_weight': hierarchy_weight}
+        checkpoint = SweepCheckpoint(checkpoint_dir, get_sweep_key(df_triple, countries_all, params), params)
+        logging.info(f"Using {checkpoint}")
+    sweeps_resolution = (community_detection == 'louvian') or (community_detection == 'greedy_modularity')
+    resolutions = resolution_range if sweeps_resolution else [0]
     #hegemon_list = dict()
     community_infos = dict()
+    community_tables = list()
     for year in range(year_start, year_end + 1):
         #hegemon_list[year] = []
         #optimization_coefs = []
@@ -168,14 +272,24 @@ def detect_local_communities(networks, df_triple, countries_all, year_start, yea
         #community_members_all = []
         #hegemon_counts = []
         community_infos[year] = dict()
-        if (community_detection == 'louvian') or (community_detection == 'greedy_modularity'):
-            for resolution in resolution_range:
-                community_infos[year][resolution] = analyse_local_community(networks[year], 
-                                                                            df_triple, countries_all, year,
-                                                                            centrality_threshold=centrality_threshold, 
-                                                                            centrality_type=centrality_type, community_detection=community_detection,
-                                                                            resolution=resolution, hierarchy_threshold=hierarchy_threshold
-                                                                           )
-        else:
-            community_infos[year][0] = analyse_local_community(networks[year], df_triple, countries_all, year, centrality_threshold, centrality_type, community_detection, max_size=100000)
-    return community_infos
\ No newline at end of file
+        for resolution in resolutions:
+            table = checkpoint.load(year, resolution) if checkpoint is not None else None
+            if table is None:
+                table = analyse_local_community(networks[year], df_triple, countries_all, year,
+                                                centrality_threshold=centrality_threshold,
+                                                centrality_type=centrality_type, community_detection=community_detection,
+                                                hierarchy_weight=hierarchy_weight, return_format=table_format,
+                                                **({'resolution': resolution, 'hierarchy_threshold': hierarchy_threshold} if sweeps_resolution else {'max_size': 100000})
+                                               )
+                if checkpoint is not None: checkpoint.save(year, resolution, table)
+            else:
+                logging.debug(f"Loaded checkpoint for {year}, res={resolution}")
+            community_infos[year][resolution] = table
+        if return_format == 'sweep':
+            for resolution, table in community_infos.pop(year).items():
+                community_tables += table.assign(resolution=resolution),
+    if return_format == 'sweep':
+        sweep_table = pd.concat(community_tables) if community_tables else pd.DataFrame(columns=list(SWEEP_COLUMNS))
+        partitions = pd.DataFrame([(year, resolution) for year in range(year_start, year_end + 1) for resolution in resolutions], columns=PARTITION_COLUMNS)
+        return CommunitySweep(sweep_table, get_country_index(countries_all), partitions)
+    return community_infos
@@ -1,24 +1,46 @@
 import logging
-from matplotlib import pyplot as plt
+import numpy as np
+import pandas as pd
 
 import sys
 sys.path.append("..")
 
-from utils.utils import get_empty_country_df
+from utils.utils import get_empty_country_df, get_country_index
+from analysis.sweep import CommunitySweep
 
 def get_hegemony_scores(communities, resolution_range, year_start, year_end, countries_all, comm_name='weapon_trade'):
-    """Counts hegemony"""
-    df = get_empty_country_df(range(year_start, year_end+1), countries_all, ['year','ego', 'alter'])
-    df[comm_name] = 0
+    """Counts hegemony
+
+    communities is a CommunitySweep (scores are merged in a vectorized way) or a dict[year][resolution] -> list[Community]"""
+    years = range(year_start, year_end+1)
+    country_index = get_country_index(countries_all)
+    df = get_empty_country_df(years, countries_all, ['year','ego', 'alter'])
+    if isinstance(communities, CommunitySweep):
+        scores_df = communities.hegemony_scores(resolution_range, country_index=country_index, comm_name=comm_name)
+        df[comm_name] = scores_df[comm_name].reindex(df.index, fill_value=0)
+        return df
+    # year * hegemon * client scores over a fixed country index
+    scores = np.zeros((len(years), len(country_index), len(country_index)))
     #resolution_range = list(map(lambda x: x/10, list(range(1, 20))))
-    for year in range(year_start, year_end + 1):
+    for y, year in enumerate(years):
         for resolution in resolution_range:
             logging.debug(f"counting hegemony for {year}, res={resolution}, there are {len(communities[year][resolution])} communities")
             for community in communities[year][resolution]:
                 if community.hegemons is None: continue
+                member_codes = country_index.get_indexer(community.country_index[community.member_codes])
+                member_codes = member_codes[member_codes >= 0]
                 for hegemon in community.hegemons:
-                    for client in hegemon.clientele:
-                        df.loc[(year, hegemon.name, client), comm_name] += hegemon.strength
+                    hegemon_code = country_index.get_loc(hegemon.name)
+                    clients = member_codes[member_codes != hegemon_code]
+                    scores[y, hegemon_code, clients] += hegemon.strength
+    year_pos, ego_pos, alter_pos = np.nonzero(scores)
+    scores_df = pd.DataFrame({
+        'year': np.asarray(years)[year_pos],
+        'ego': country_index[ego_pos],
+        'alter': country_index[alter_pos],
+        comm_name: scores[year_pos, ego_pos, alter_pos]
+    }).set_index(['year', 'ego', 'alter'])
+    df[comm_name] = scores_df[comm_name].reindex(df.index, fill_value=0)
     return df
 
 def get_hegemony_top(hegemony_df, comm_name, one_year_threshold=5, all_time_threshold=100): #, MIN_CLIENTS_FOR_GRAPH = 5, )
@@ -26,8 +48,8 @@ def get_hegemony_top(hegemony_df, comm_name, one_year_threshold=5, all_time_thre
     
     Arguments
     ---------
-        hegemony_df : pd.DataFrame
-            hegemony scores in a year*ego*alter = value_name DataFrame
+        hegemony_df : pd.DataFrame or CommunitySweep
+            hegemony scores in a year*ego*alter = value_name DataFrame, or a community sweep to count the scores from (all resolutions)
         comm_name : str
             name of the value (community) in hegemony_df
         one_year_threshold : int
@@ -40,7 +62,8 @@ def get_hegemony_top(hegemony_df, comm_name, one_year_threshold=5, all_time_thre
         hegemony_df_n_year_top : pd.DataFrame
             DataFrame of hegemon counts hegemon by year
     """
-
+    if isinstance(hegemony_df, CommunitySweep):
+        hegemony_df = hegemony_df.hegemony_scores(comm_name=comm_name)
     hegemony_df_t = hegemony_df[hegemony_df[comm_name]>one_year_threshold]
     # считаем клиентов
     hegemony_df_n = hegemony_df_t.reset_index().groupby(['year','ego']).count()
@@ -55,7 +78,7 @@ def get_hegemony_top(hegemony_df, comm_name, one_year_threshold=5, all_time_thre
     return hegemony_df_n_year_top
 
 def visualize_hegemony(hegemony_df_n_year_top, title, savefile=None):
-    
+    from matplotlib import pyplot as plt
     hegemons = list(hegemony_df_n_year_top.index)
     
     figsize_x = 15
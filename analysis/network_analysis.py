@@ -1,11 +1,10 @@
 import networkx as nx
 import pandas as pd
+import numpy as np
 import logging
-from pyvis.network import Network
-import pyvis
-import pyreadr
+from scipy import sparse
 
-def countCentrality(G: nx.Graph, country_list: list, centrality_type: str, prefix: str = ""):
+def countCentrality(G: nx.Graph, country_list: list, centrality_type: str, prefix: str = "", n_jobs: int = 1, sample_size: int = None, seed: int = None):
     """A function to measure centrality in a network
     
     Parameters
@@ -18,10 +17,17 @@ def countCentrality(G: nx.Graph, country_list: list, centrality_type: str, prefi
             Method of centrality measurement (currently supports out-degree centrality and betweenness centrality)
         prefix: str
             Prefix to put in centrality, rank and status column names in the returned df. Default: empty string.
+        n_jobs: int
+            Number of worker processes for betweenness centrality (see analysis.betweenness). Default: 1
+        sample_size: int or None
+            Number of pivots to sample for approximate betweenness centrality, None for exact values. Default: None
+        seed: int or None
+            Random seed for pivot sampling
     Return
     -----------
         centrality_df : pd.DataFrame()
             DataFrame containing information about centrality, rank and status of all nodes in the network. 
+            For approximate betweenness it also has a centrality_error column (standard error of the estimate).
     
     """
     if centrality_type == 'out-degree':
@@ -35,7 +41,8 @@ def countCentrality(G: nx.Graph, country_list: list, centrality_type: str, prefi
             out_strength = sum(G[node][neighbor]['weight'] for neighbor in G.successors(node))
             centrality[node] = out_strength
     elif centrality_type == 'betweenness':
-        centrality = nx.betweenness_centrality(G)#, weight='value')
+        from analysis.betweenness import betweenness_centrality
+        centrality, centrality_error = betweenness_centrality(G, sample_size=sample_size, seed=seed, n_jobs=n_jobs, return_error=True)#, weight='value')
     elif centrality_type == 'laplacian':
         centrality = nx.laplacian_centrality(G, weight='value')
     elif centrality_type == 'pagerank':
@@ -50,8 +57,10 @@ def countCentrality(G: nx.Graph, country_list: list, centrality_type: str, prefi
         prefix = prefix + "_"
     for country in country_list:
         centrality_df.loc[country, f'{prefix}centrality'] = centrality[country]
-    centrality_df[f'{prefix}rank'] = centrality_df.rank(ascending=False)
+    centrality_df[f'{prefix}rank'] = centrality_df[f'{prefix}centrality'].rank(ascending=False)
     centrality_df[f'{prefix}status'] = len(country_list) / centrality_df[f'{prefix}rank']
+    if centrality_type == 'betweenness' and sample_size is not None:
+        centrality_df[f'{prefix}centrality_error'] = [centrality_error[country] for country in country_list]
     return centrality_df
 
 def get_networks(df_triple, countries_all, year_start, year_end, isDigraph=True, forceString=False, removeLessThanZero=True):
@@ -61,6 +70,8 @@ def get_networks(df_triple, countries_all, year_start, year_end, isDigraph=True,
     ------------
         df_triple: pd.DataFrame()
             DataFrame containing information about dyadic relations (year*country*country). Index level names should be year, alter, ego 
+            Compact triples (categorical countries, int16 years, float32 values, see utils.utils.to_compact_triple) are supported
+            or a data_handling.sparsetriple.SparseTriple (its nonzero values are used, zeroes are not edges anyway)
         countries_all: set
             Set of all countries involved
         year_start: int
@@ -76,10 +87,12 @@ def get_networks(df_triple, countries_all, year_start, year_end, isDigraph=True,
             Dictionary of networkx objects for each year
     """
     logging.info(f"Getting global networks for {year_start} - {year_end}")    
+    if not isinstance(df_triple, pd.DataFrame):
+        df_triple = df_triple.to_frame()
     networks = dict()
     for year in range(year_start, year_end + 1): # dont remember why +1
         logging.debug(f"Getting networks for {year}")
-        networks[year] = get_network_from_year_df(df_triple.copy(),countries_all, year, forceString=forceString, isDigraph=isDigraph, removeLessThanZero=removeLessThanZero)  # remove forceString if error    
+        networks[year] = get_network_from_year_df(df_triple, countries_all, year, forceString=forceString, isDigraph=isDigraph, removeLessThanZero=removeLessThanZero)  # remove forceString if error    
     logging.info("Done getting networks")
     return networks
 
@@ -142,10 +155,60 @@ def get_network_from_year_df(df_triple: pd.DataFrame(), countries: list(), year:
     network.add_weighted_edges_from(year_tuples)
     return network
 
-def plotWithPyvis(G, notebook_plotting=True, improve_view=True, heading="", show_buttons=False, directed=True):
+def get_adjacency_matrix(G: nx.Graph, country_index: pd.Index, weight: str = 'weight'):
+    """A function to get a sparse (CSR) adjacency matrix of a graph over a fixed country index
+
+    Parameters
+    ------------
+        G: networkx.Graph or networkx.DiGraph
+            Network graph
+        country_index: pd.Index
+            Fixed index of countries, defines row and column order (see utils.utils.get_country_index)
+        weight: str or None
+            Edge attribute to use as matrix values, if None every edge has value 1.
+            Default: 'weight'
+    Return
+    -----------
+        adjacency : scipy.sparse.csr_matrix
+            Matrix of shape (len(country_index), len(country_index)), edges with nodes outside of country_index are dropped.
+            Undirected graphs produce a symmetric matrix.
+    """
+    edges = list(G.edges(data=weight, default=1)) if weight is not None else [(u, v, 1) for u, v in G.edges()]
+    if len(edges) > 0:
+        egos, alters, values = zip(*edges)
+    else:
+        egos, alters, values = [], [], []
+    rows = country_index.get_indexer(list(egos))
+    cols = country_index.get_indexer(list(alters))
+    values = np.asarray(values, dtype=float)
+    known = (rows >= 0) & (cols >= 0)
+    rows, cols, values = rows[known], cols[known], values[known]
+    if not G.is_directed():
+        loops = rows == cols
+        rows, cols, values = np.concatenate([rows, cols[~loops]]), np.concatenate([cols, rows[~loops]]), np.concatenate([values, values[~loops]])
+    n = len(country_index)
+    return sparse.csr_matrix((values, (rows, cols)), shape=(n, n))
+
+def plotWithPyvis(G,notebook_plotting=True, improve_view=True, heading="", show_buttons=False, directed=True, export_path=None, top_k=None, weight_quantile=None, layout_cache=None):
+    """Plots a network with pyvis
+
+    If export_path is set, writes a lightweight vis.js HTML instead (see analysis.network_export.export_network):
+    edges pruned with top_k / weight_quantile, layout precomputed once (cached in layout_cache) and physics disabled.
+    With export_path, G can also be a dict of networks by year (see get_networks), exported to one page with a year slider
+    (see analysis.network_export.export_networks).
+    Returns the pyvis Network or the export path"""
+    if export_path is not None:
+        from analysis.network_export import export_network, export_networks
+        if isinstance(G, dict):
+            return export_networks(G, export_path, heading=heading, top_k=top_k, weight_quantile=weight_quantile, layout_cache=layout_cache)
+        return export_network(G, export_path, heading=heading, top_k=top_k, weight_quantile=weight_quantile, layout_cache=layout_cache)
+    if top_k is not None or weight_quantile is not None:
+        from analysis.network_export import prune_edges
+        G = prune_edges(G, top_k=top_k, weight_quantile=weight_quantile)
 
     #labels = make_label_dict(labels)
     
+    from pyvis.network import Network
     net = Network(notebook=notebook_plotting, height='800px', width='1300px', heading=heading, directed=directed)
     net.from_nx(G)
     net.inherit_edge_colors = False
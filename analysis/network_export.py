@@ -0,0 +1,314 @@
+import os
+import json
+import html
+import logging
+import numpy as np
+import pandas as pd
+import networkx as nx
+from string import Template
+
+VIS_NETWORK_JS = "https://cdnjs.cloudflare.com/ajax/libs/vis-network/9.1.2/dist/vis-network.min.js"
+LAYOUT_SCALE = 1000  # vis.js canvas units
+WEIGHT_DIGITS = 4  # rounding of edge weights in the exported JSON
+
+HTML_TEMPLATE = Template("""<html>
+    <head>
+        <meta charset="utf-8">
+        <script src="$vis_js"></script>
+        <style type="text/css">
+             #mynetwork {
+                 width: $width;
+                 height: $height;
+                 background-color: #ffffff;
+                 border: 1px solid lightgray;
+                 position: relative;
+                 float: left;
+             }
+        </style>
+    </head>
+    <body>
+        <center>
+          <h1>$heading</h1>
+        </center>
+        $controls
+        <div id="mynetwork"></div>
+        <script type="text/javascript">
+            var data = $data;
+            var options = $options;
+            var nodes = new vis.DataSet(data.nodes);
+            var edges = new vis.DataSet(data.edges);
+            var network = new vis.Network(document.getElementById('mynetwork'), {nodes: nodes, edges: edges}, options);
+            $script
+        </script>
+    </body>
+</html>
+""")
+
+
+def get_edge_df(G: nx.Graph, weight: str = 'weight'):
+    """Returns edges of a graph as a DataFrame with ego, alter and weight columns"""
+    edges = list(G.edges(data=weight, default=1))
+    return pd.DataFrame(edges, columns=['ego', 'alter', 'weight'])
+
+def prune_edges(G: nx.Graph, top_k: int = None, weight_quantile: float = None, weight: str = 'weight'):
+    """A function to thin out a dense weighted network for visualisation
+
+    Parameters
+    ------------
+        G: networkx.Graph or networkx.DiGraph
+            Network graph
+        top_k: int or None
+            Keep only the top_k strongest edges of every node (outgoing edges for a DiGraph,
+            an undirected edge is kept if it is in the top of either node). Default: None (no limit)
+        weight_quantile: float or None
+            Keep only edges with weight not less than this quantile of all edge weights (0 - 1). Default: None (no limit)
+        weight: str
+            Edge attribute with the weight. Default: 'weight'
+    Return
+    -----------
+        pruned : networkx.Graph or networkx.DiGraph
+            Graph of the same type with all nodes and the kept edges
+    """
+    edge_df = get_edge_df(G, weight)
+    keep = np.ones(len(edge_df), dtype=bool)
+    if weight_quantile is not None and len(edge_df) > 0:
+        keep &= (edge_df['weight'] >= edge_df['weight'].quantile(weight_quantile)).to_numpy()
+    if top_k is not None:
+        ends = edge_df[['ego', 'weight']].rename(columns={'ego': 'node'})
+        if not G.is_directed():  # an undirected edge belongs to both of its nodes
+            ends = pd.concat([ends, edge_df[['alter', 'weight']].rename(columns={'alter': 'node'})])
+        rank = ends.groupby('node')['weight'].rank(method='first', ascending=False).to_numpy()
+        top = np.zeros(len(edge_df), dtype=bool)
+        np.logical_or.at(top, np.tile(np.arange(len(edge_df)), len(ends) // max(len(edge_df), 1)), rank <= top_k)
+        keep &= top
+    pruned = G.__class__()
+    pruned.add_nodes_from(G.nodes(data=True))
+    pruned.add_weighted_edges_from(edge_df[keep].itertuples(index=False, name=None), weight=weight)
+    logging.debug(f"Pruned edges: {keep.sum()} of {len(edge_df)} kept")
+    return pruned
+
+def get_layout(G: nx.Graph, weight: str = 'weight', seed: int = 100, cache_path: str = None):
+    """Computes (or loads from cache) spring layout positions of the nodes
+
+    Parameters
+    ------------
+        G: networkx.Graph or networkx.DiGraph
+            Network graph
+        weight: str or None
+            Edge attribute used as spring strength. Default: 'weight'
+        seed: int
+            Random seed of the layout. Default: 100
+        cache_path: str or None
+            JSON file to store positions in. Cached positions are reused, nodes missing in the cache are placed
+            around the fixed cached ones and added to the cache. Default: None (no caching)
+    Return
+    -----------
+        positions : dict
+            Node -> (x, y) in vis.js canvas units
+    """
+    cached = dict()
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = {node: tuple(position) for node, position in json.load(f).items()}
+    missing = [node for node in G.nodes() if node not in cached]
+    if len(missing) == 0:
+        return _scale_positions({node: cached[node] for node in G.nodes()})
+
+    logging.info(f"Computing layout for {len(missing)} nodes")
+    fixed = [node for node in G.nodes() if node in cached]
+    if len(fixed) > 0:
+        layout = nx.spring_layout(G, weight=weight, seed=seed, pos={node: np.asarray(cached[node]) for node in fixed}, fixed=fixed)
+    else:
+        layout = nx.spring_layout(G, weight=weight, seed=seed)
+    # the cache keeps unit-scale coordinates, so that the layout can be extended later
+    cached.update({node: (float(x), float(y)) for node, (x, y) in layout.items()})
+    if cache_path is not None:
+        with open(cache_path, 'w') as f:
+            json.dump(cached, f)
+    return _scale_positions({node: cached[node] for node in G.nodes()})
+
+def _scale_positions(positions):
+    return {node: (round(x * LAYOUT_SCALE, 1), round(y * LAYOUT_SCALE, 1)) for node, (x, y) in positions.items()}
+
+def get_vis_options(directed: bool = True):
+    """Returns vis.js options for a precomputed layout (physics disabled)"""
+    return {
+        'nodes': {'font': {'size': 21}, 'shape': 'dot', 'size': 10},
+        'edges': {'color': {'opacity': 0.25}, 'smooth': False, 'arrows': {'to': {'enabled': directed, 'scaleFactor': 0.5}}},
+        'physics': {'enabled': False},
+        'interaction': {'hideEdgesOnDrag': True},
+    }
+
+def get_vis_nodes(nodes, positions):
+    """Returns vis.js node records, node ids are positions in nodes"""
+    return [{'id': i, 'label': str(node), 'x': positions[node][0], 'y': positions[node][1]} for i, node in enumerate(nodes)]
+
+def get_vis_edges(edge_df: pd.DataFrame, node_ids: pd.Index):
+    """Returns vis.js edge records, edge ids are 'ego_id-alter_id' to be stable across graphs"""
+    egos = node_ids.get_indexer(edge_df['ego'])
+    alters = node_ids.get_indexer(edge_df['alter'])
+    values = edge_df['weight'].round(WEIGHT_DIGITS)
+    return [{'id': f'{ego}-{alter}', 'from': int(ego), 'to': int(alter), 'value': float(value)} for ego, alter, value in zip(egos, alters, values)]
+
+def _to_script_json(value, **kwargs):
+    """JSON to embed into a script element"""
+    return json.dumps(value, **kwargs).replace('</', '<\\/')
+
+def render_html(path: str, data: dict, options: dict, heading: str = "", controls: str = "", script: str = "", width: str = '1300px', height: str = '800px'):
+    """Writes a standalone vis.js HTML page with embedded network data
+
+    heading is plain text (escaped), width and height are escaped attributes, controls and script are trusted HTML and JavaScript.
+    '</' in the embedded JSON is escaped so that labels cannot close the script element"""
+    page = HTML_TEMPLATE.substitute(vis_js=html.escape(VIS_NETWORK_JS), width=html.escape(width), height=html.escape(height), heading=html.escape(heading), controls=controls,
+                                    data=_to_script_json(data, separators=(',', ':')), options=_to_script_json(options), script=script)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(page)
+    logging.info(f"Saved network to {path} ({len(page) / 1024:.0f} KB)")
+    return path
+
+def export_network(G: nx.Graph, path: str, heading: str = "", top_k: int = None, weight_quantile: float = None, weight: str = 'weight', layout_cache: str = None, seed: int = 100, width: str = '1300px', height: str = '800px'):
+    """A function to export a network to a lightweight vis.js HTML page: pruned edges, precomputed layout and no live physics
+
+    Parameters
+    ------------
+        G: networkx.Graph or networkx.DiGraph
+            Network graph
+        path: str
+            Path of the HTML file
+        heading: str
+            Page heading
+        top_k: int or None
+            Keep only the top_k strongest edges of every node (see prune_edges)
+        weight_quantile: float or None
+            Keep only edges with weight not less than this quantile (see prune_edges)
+        weight: str
+            Edge attribute with the weight. Default: 'weight'
+        layout_cache: str or None
+            JSON file to cache node positions in (see get_layout)
+        seed: int
+            Random seed of the layout. Default: 100
+    Return
+    -----------
+        path : str
+            Path of the HTML file
+    """
+    if top_k is not None or weight_quantile is not None:
+        G = prune_edges(G, top_k=top_k, weight_quantile=weight_quantile, weight=weight)
+    positions = get_layout(G, weight=weight, seed=seed, cache_path=layout_cache)
+    nodes = pd.Index(list(G.nodes()))
+    data = {'nodes': get_vis_nodes(nodes, positions), 'edges': get_vis_edges(get_edge_df(G, weight), nodes)}
+    return render_html(path, data, get_vis_options(G.is_directed()), heading=heading, width=width, height=height)
+
+YEAR_SLIDER_CONTROLS = Template("""<div style="width: $width; padding: 10px 0;">
+            <input type="range" id="year_slider" min="0" max="$max_index" value="0" step="1" style="width: 80%;">
+            <b id="year_label">$first_year</b>
+        </div>""")
+
+# deltas[i] turns year i into year i + 1, going back replays the deltas from the first year
+YEAR_SLIDER_SCRIPT = """var current = 0;
+            function applyDelta(delta) {
+                edges.remove(delta.remove);
+                edges.add(delta.add);
+                edges.update(delta.update.map(function (edge) { return {id: edge[0], value: edge[1]}; }));
+                nodes.update(delta.show.map(function (id) { return {id: id, hidden: false}; }));
+                nodes.update(delta.hide.map(function (id) { return {id: id, hidden: true}; }));
+            }
+            function showYear(index) {
+                if (index < current) {
+                    edges.clear();
+                    edges.add(data.edges);
+                    nodes.update(data.nodes.map(function (node) { return {id: node.id, hidden: node.hidden}; }));
+                    current = 0;
+                }
+                while (current < index) { applyDelta(data.deltas[current]); current++; }
+                document.getElementById('year_label').innerText = data.years[current];
+            }
+            document.getElementById('year_slider').oninput = function () { showYear(parseInt(this.value)); };"""
+
+
+def get_year_deltas(year_edges: list, year_nodes: list):
+    """Returns changes between consecutive years
+
+    Parameters
+    ------------
+        year_edges: list
+            List of dicts edge id -> vis.js edge record for each year
+        year_nodes: list
+            List of sets of node ids present in each year
+    Return
+    -----------
+        deltas : list
+            For each pair of consecutive years: added edge records, removed edge ids, [edge id, new value] pairs of updated edges,
+            node ids to show and to hide
+    """
+    deltas = []
+    for (edges_before, edges_after), (nodes_before, nodes_after) in zip(zip(year_edges[:-1], year_edges[1:]), zip(year_nodes[:-1], year_nodes[1:])):
+        kept = edges_before.keys() & edges_after.keys()
+        deltas += {
+            'add': [edges_after[edge_id] for edge_id in edges_after.keys() - kept],
+            'remove': sorted(edges_before.keys() - kept),
+            'update': [[edge_id, edges_after[edge_id]['value']] for edge_id in kept if edges_after[edge_id]['value'] != edges_before[edge_id]['value']],
+            'show': sorted(nodes_after - nodes_before),
+            'hide': sorted(nodes_before - nodes_after),
+        },
+    return deltas
+
+def export_networks(networks: dict, path: str, heading: str = "", top_k: int = None, weight_quantile: float = None, weight: str = 'weight', layout_cache: str = None, seed: int = 100, width: str = '1300px', height: str = '800px'):
+    """A function to export networks of several years to a single vis.js HTML page with a year slider
+
+    One layout is computed for the union of all years (and cached in layout_cache), so nodes keep their positions.
+    Only the first year is stored in full, other years are stored as edge and node changes from the previous year.
+
+    Parameters
+    ------------
+        networks: dict
+            Dictionary of networkx objects for each year (see analysis.network_analysis.get_networks)
+        path: str
+            Path of the HTML file
+        heading: str
+            Page heading
+        top_k: int or None
+            Keep only the top_k strongest edges of every node in each year (see prune_edges)
+        weight_quantile: float or None
+            Keep only edges with weight not less than this quantile in each year (see prune_edges)
+        weight: str
+            Edge attribute with the weight. Default: 'weight'
+        layout_cache: str or None
+            JSON file to cache node positions in (see get_layout)
+        seed: int
+            Random seed of the layout. Default: 100
+    Return
+    -----------
+        path : str
+            Path of the HTML file
+    """
+    if len(networks) == 0:
+        raise ValueError("no networks to export")
+    years = sorted(networks)
+    graphs = [networks[year] for year in years]
+    if top_k is not None or weight_quantile is not None:
+        graphs = [prune_edges(G, top_k=top_k, weight_quantile=weight_quantile, weight=weight) for G in graphs]
+    edge_dfs = [get_edge_df(G, weight) for G in graphs]
+
+    # layout of all years together, edge weights summed over years
+    union = graphs[0].__class__()
+    for G in graphs:
+        union.add_nodes_from(G.nodes())
+    union_edges = pd.concat(edge_dfs).groupby(['ego', 'alter'])['weight'].sum()
+    union.add_weighted_edges_from(((ego, alter, value) for (ego, alter), value in union_edges.items()), weight=weight)
+    positions = get_layout(union, weight=weight, seed=seed, cache_path=layout_cache)
+
+    node_ids = pd.Index(list(union.nodes()))
+    year_edges = [{edge['id']: edge for edge in get_vis_edges(edge_df, node_ids)} for edge_df in edge_dfs]
+    year_nodes = [set(node_ids.get_indexer(list(G.nodes())).tolist()) for G in graphs]
+    vis_nodes = get_vis_nodes(node_ids, positions)
+    for node in vis_nodes:
+        node['hidden'] = node['id'] not in year_nodes[0]
+    data = {
+        'years': [str(year) for year in years],
+        'nodes': vis_nodes,
+        'edges': list(year_edges[0].values()),
+        'deltas': get_year_deltas(year_edges, year_nodes),
+    }
+    controls = YEAR_SLIDER_CONTROLS.substitute(width=html.escape(width), max_index=len(years) - 1, first_year=html.escape(str(years[0])))
+    return render_html(path, data, get_vis_options(graphs[0].is_directed()), heading=heading, controls=controls, script=YEAR_SLIDER_SCRIPT, width=width, height=height)
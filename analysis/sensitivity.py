@@ -0,0 +1,239 @@
+import sys
+sys.path.append("..")
+
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+
+from analysis.status_index import SUBSYSTEM_WEIGHTS, get_composite_index, rank_by_year
+
+SECURITY_WEIGHTS = {'interventions': 0.13, 'sipri': 0.12, 'deployments': 0.145}
+ECONOMY_WEIGHTS = {'fdi': 0.5, 'trade': 0.5, 'hitech': 0.2, 'energy': 0.3}
+HUMAN_WEIGHTS = {'migrant': 0.16, 'refugee': 0.17, 'humanun': 0.155, 'oda': 0.198}
+INDICATOR_WEIGHTS = {'security': SECURITY_WEIGHTS, 'economy': ECONOMY_WEIGHTS, 'human': HUMAN_WEIGHTS}
+
+
+def get_indicator_strengths(indicator_dfs: dict, year_start: int, year_end: int, scale_to_mean: tuple = ('economy',), country_index: pd.Index = None):
+    """Out-strength (out-degree-weighted centrality) of every country by indicator and year
+
+    The out-degree-weighted centrality of a subsystem (a weighted sum of indicator triples, see analyse_system) is linear in the indicator weights,
+    so it is the same weighted sum of the indicator strengths (for nonnegative values, self loops are removed as remove_self_loops does).
+
+    Parameters
+    ------------
+        indicator_dfs: dict
+            Subsystem -> indicator -> preprocessed year*alter*ego table with the value column
+        year_start: int
+            First year
+        year_end: int
+            Last year
+        scale_to_mean: tuple
+            Subsystems whose indicators are divided by their mean value before weighting (as merge_sphere does). Default: ('economy',)
+        country_index: pd.Index or None
+            Countries of the arrays, all egos of the tables if None
+    Return
+    -----------
+        indicators : list
+            (subsystem, indicator) of the first axis
+        years : np.ndarray
+            Years of the second axis
+        country_index : pd.Index
+            Countries of the third axis
+        strengths : np.ndarray
+            Array [indicator, year, country]
+        present : np.ndarray
+            Boolean array [indicator, year, country], whether the country is an ego of the indicator in the year
+    """
+    indicators, tables = [], []
+    for subsystem, dfs in indicator_dfs.items():
+        for indicator, df_triple in dfs.items():
+            df = df_triple.reset_index() if 'year' not in df_triple.columns else df_triple
+            values = df['value'].fillna(0).to_numpy(dtype=float)
+            if subsystem in scale_to_mean:
+                values = values / values.mean()
+            df = pd.DataFrame({'year': df['year'].to_numpy(dtype=int), 'alter': df['alter'].to_numpy(dtype=object), 'ego': df['ego'].to_numpy(dtype=object), 'value': values})
+            df = df[(df['year'] >= year_start) & (df['year'] <= year_end) & (df['ego'] != df['alter'])]
+            indicators += (subsystem, indicator),
+            tables += df,
+    if country_index is None:
+        country_index = pd.Index(sorted(set().union(*[set(df['ego']) for df in tables])), name='country')
+    years = np.arange(year_start, year_end + 1)
+    strengths = np.zeros((len(indicators), len(years), len(country_index)))
+    present = np.zeros(strengths.shape, dtype=bool)
+    for i, df in enumerate(tables):
+        egos = country_index.get_indexer(df['ego'])
+        known = egos >= 0
+        cells = (df['year'].to_numpy()[known] - year_start) * len(country_index) + egos[known]
+        values = df['value'].to_numpy()[known]
+        strengths[i] = np.bincount(cells, weights=np.where(values > 0, values, 0), minlength=strengths[i].size).reshape(strengths[i].shape)
+        present[i].flat[cells] = True
+    return indicators, years, country_index, strengths, present
+
+def sample_weights(weights: np.ndarray, n_draws: int, concentration: float = 100.0, rng: np.random.Generator = None):
+    """Samples weight vectors around weights from a Dirichlet distribution
+
+    The expected draw is weights, concentration sets the spread (the larger, the closer draws are to weights).
+    Draws keep the sum of weights. Returns an array [draw, weight]"""
+    rng = np.random.default_rng() if rng is None else rng
+    total = weights.sum()
+    return rng.dirichlet(concentration * weights / total, size=n_draws) * total
+
+
+class WeightSensitivity():
+    """
+    Monte Carlo sensitivity of the composite status ranks to subsystem and indicator weights.
+
+    ...
+
+    Attributes
+    ----------
+    indicators : list
+        (subsystem, indicator) of the strengths
+    subsystems : list
+        Subsystems of the indicators
+    years : np.ndarray
+        Years of the ranks
+    country_index : pd.Index
+        Countries of the ranks
+    strengths : np.ndarray
+        Indicator strengths [indicator, year, country] (see get_indicator_strengths)
+    present : np.ndarray
+        Boolean array [subsystem, year, country], whether the country is in the subsystem in the year
+    base_ranks : np.ndarray
+        Ranks [year, country] with the base weights (NaN for unranked countries), set by run
+    ranks : np.ndarray
+        Ranks [draw, year, country] with sampled weights, set by run
+    subsystem_draws : np.ndarray
+        Sampled subsystem weights [draw, subsystem], set by run
+    indicator_draws : np.ndarray
+        Sampled indicator weights [draw, indicator], set by run
+
+    Indicator strengths are counted once, every batch of sampled weights is combined into subsystem centralities
+    and the composite index with einsum (see analysis.status_index.get_composite_index) and ranked by year at once,
+    instead of re-running merge_sphere and analyse_system for every draw.
+    """
+    def __init__(self, indicator_dfs: dict, year_start: int, year_end: int, scale_to_mean: tuple = ('economy',)):
+        self.indicators, self.years, self.country_index, self.strengths, indicator_present = get_indicator_strengths(indicator_dfs, year_start, year_end, scale_to_mean=scale_to_mean)
+        self.subsystems = list(dict.fromkeys(subsystem for subsystem, _ in self.indicators))
+        self._membership = np.array([[subsystem == indicator_subsystem for indicator_subsystem, _ in self.indicators] for subsystem in self.subsystems], dtype=float)
+        self.present = np.einsum('si,iyc->syc', self._membership, indicator_present.astype(float)) > 0
+        self.base_ranks = None
+        self.ranks = None
+        self.subsystem_draws = None
+        self.indicator_draws = None
+
+    def __repr__(self):
+        repr = f'WeightSensitivity of {len(self.indicators)} indicators in {self.subsystems}, {len(self.years)} years, {len(self.country_index)} countries'
+        if self.ranks is not None:
+            repr += f', {len(self.ranks)} draws'
+        return repr
+
+    def _get_ranks(self, subsystem_weights, indicator_weights, mean, rank_method):
+        """Ranks [..., year, country] for weights [..., subsystem] and [..., indicator]"""
+        centralities = np.einsum('...i,si,iyc->...syc', indicator_weights, self._membership, self.strengths)
+        centralities = np.where(self.present, centralities, np.nan)
+        return rank_by_year(get_composite_index(centralities, subsystem_weights, mean=mean), method=rank_method)
+
+    def run(self, n_draws: int = 1000, subsystem_weights: dict = SUBSYSTEM_WEIGHTS, indicator_weights: dict = INDICATOR_WEIGHTS, concentration: float = 100.0,
+            vary_subsystems: bool = True, vary_indicators: bool = True, mean: str = 'geometric', rank_method: str = 'min', batch_size: int = 100, seed: int = None):
+        """Samples weights and ranks countries with every draw
+
+        Parameters
+        ------------
+            n_draws: int
+                Number of sampled weight vectors. Default: 1000
+            subsystem_weights: dict
+                Subsystem -> base weight, matched by name. Default: SUBSYSTEM_WEIGHTS
+            indicator_weights: dict
+                Subsystem -> indicator -> base weight, matched by name. Default: INDICATOR_WEIGHTS
+            concentration: float
+                Dirichlet concentration of the draws around the base weights (see sample_weights). Default: 100
+            vary_subsystems: bool
+                Whether to sample subsystem weights (base weights are used otherwise). Default: True
+            vary_indicators: bool
+                Whether to sample indicator weights, separately in every subsystem. Default: True
+            mean: str
+                'geometric' or 'arithmetic' mean of subsystems. Default: 'geometric'
+            rank_method: str
+                Method of ranks with equal values (see analysis.status_index.rank_by_year). Default: 'min'
+            batch_size: int
+                Number of draws combined at once (memory is batch_size * subsystems * years * countries floats). Default: 100
+            seed: int or None
+                Random seed
+        Return
+        -----------
+            self : WeightSensitivity
+        """
+        rng = np.random.default_rng(seed)
+        base_subsystem = np.array([subsystem_weights[subsystem] for subsystem in self.subsystems], dtype=float)
+        base_indicator = np.array([indicator_weights[subsystem][indicator] for subsystem, indicator in self.indicators], dtype=float)
+        self.base_ranks = self._get_ranks(base_subsystem, base_indicator, mean, rank_method)
+
+        self.subsystem_draws = sample_weights(base_subsystem, n_draws, concentration, rng) if vary_subsystems else np.tile(base_subsystem, (n_draws, 1))
+        self.indicator_draws = np.tile(base_indicator, (n_draws, 1))
+        if vary_indicators:
+            for s in range(len(self.subsystems)):
+                positions = np.nonzero(self._membership[s])[0]
+                self.indicator_draws[:, positions] = sample_weights(base_indicator[positions], n_draws, concentration, rng)
+
+        self.ranks = np.full((n_draws,) + self.base_ranks.shape, np.nan, dtype=np.float32)
+        for start in range(0, n_draws, batch_size):
+            batch = slice(start, start + batch_size)
+            self.ranks[batch] = self._get_ranks(self.subsystem_draws[batch], self.indicator_draws[batch], mean, rank_method)
+        logging.info(f"Ranked {n_draws} weight draws over {len(self.years)} years")
+        return self
+
+    def get_rank_distribution(self, quantiles: tuple = (0.05, 0.5, 0.95)):
+        """Returns the distribution of ranks over draws, indexed by ego and year
+
+        Columns: base_rank (rank with the base weights), mean_rank, std_rank, min_rank, max_rank, the quantiles (q5, q50, q95 by default)
+        and same_rank (share of draws with the base rank)"""
+        ranked = ~np.isnan(self.base_ranks)
+        year_pos, country_pos = np.nonzero(ranked)
+        ranks = self.ranks[:, year_pos, country_pos]
+        with np.errstate(invalid='ignore'):
+            rank_df = pd.DataFrame({
+                'ego': self.country_index[country_pos],
+                'year': self.years[year_pos],
+                'base_rank': self.base_ranks[year_pos, country_pos],
+                'mean_rank': np.nanmean(ranks, axis=0),
+                'std_rank': np.nanstd(ranks, axis=0),
+                'min_rank': np.nanmin(ranks, axis=0),
+                'max_rank': np.nanmax(ranks, axis=0),
+                **{f'q{round(q * 100)}': values for q, values in zip(quantiles, np.nanquantile(ranks, quantiles, axis=0))},
+                'same_rank': (ranks == self.base_ranks[year_pos, country_pos]).mean(axis=0),
+            })
+        return rank_df.sort_values(['ego', 'year']).set_index(['ego', 'year'])
+
+    def get_rank_stability(self, years=None):
+        """Returns rank stability of every country over the years (all years if None), sorted by the mean base rank
+
+        Columns: base_rank (mean base rank), mean_abs_shift (mean absolute difference of sampled and base ranks),
+        std_rank (mean over years of the standard deviation over draws), max_shift (largest absolute difference)
+        and same_rank (share of draws and years with the base rank)"""
+        year_positions = slice(None) if years is None else np.asarray(years, dtype=int) - self.years[0]
+        base_ranks, ranks = self.base_ranks[year_positions], self.ranks[:, year_positions]
+        shifts = np.abs(ranks - base_ranks)
+        ranked = ~np.isnan(base_ranks).all(axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN slices of countries outside of some years
+            stability_df = pd.DataFrame({
+                'base_rank': np.nanmean(base_ranks, axis=0),
+                'mean_abs_shift': np.nanmean(shifts, axis=(0, 1)),
+                'std_rank': np.nanmean(np.nanstd(ranks, axis=0), axis=0),
+                'max_shift': np.nanmax(shifts, axis=(0, 1)),
+                'same_rank': np.nanmean(np.where(np.isnan(shifts), np.nan, shifts == 0), axis=(0, 1)),
+            }, index=self.country_index.rename('ego'))
+        return stability_df[ranked].sort_values('base_rank')
+
+    def get_rank_frequencies(self, year: int, max_rank: int = None):
+        """Returns shares of draws by rank of every country in a year (countries by rows, ranks by columns)"""
+        ranks = self.ranks[:, year - self.years[0]]
+        ranked = ~np.isnan(self.base_ranks[year - self.years[0]])
+        max_rank = int(np.nanmax(ranks)) if max_rank is None else max_rank
+        counts = np.zeros((len(self.country_index), max_rank))
+        draw_pos, country_pos = np.nonzero(~np.isnan(ranks) & (ranks <= max_rank))
+        np.add.at(counts, (country_pos, ranks[draw_pos, country_pos].astype(int) - 1), 1)
+        frequencies_df = pd.DataFrame(counts / len(ranks), index=self.country_index.rename('ego'), columns=pd.RangeIndex(1, max_rank + 1, name='rank'))
+        return frequencies_df[ranked]
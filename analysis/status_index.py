@@ -0,0 +1,135 @@
+import logging
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+SUBSYSTEM_WEIGHTS = {  # BY IHES 2022
+    'human': 1.79 / (1.79+2.4+3.2),
+    'economy': 2.4 / (1.79+2.4+3.2),
+    'security': 3.2 / (1.79+2.4+3.2),
+}
+
+
+def get_centrality_array(analysis: pd.DataFrame, subsystems: list = None, value: str = 'centrality', country_index: pd.Index = None):
+    """Returns centralities of analyse_system (one row per subsystem, year and ego) as an array [subsystem, year, country]
+
+    Parameters
+    ------------
+        analysis: pd.DataFrame
+            Table with subsystem, year, ego and value columns
+        subsystems: list or None
+            Subsystems of the array (in this order), all subsystems of the table if None
+        value: str
+            Value column. Default: 'centrality'
+        country_index: pd.Index or None
+            Countries of the array, all egos of the table if None (see utils.utils.get_country_index)
+    Return
+    -----------
+        subsystems : list
+            Subsystems along the first axis
+        years : np.ndarray
+            Years along the second axis
+        country_index : pd.Index
+            Countries along the third axis
+        centralities : np.ndarray
+            Array [subsystem, year, country], NaN where a country has no value in a subsystem
+    """
+    if subsystems is None:
+        subsystems = list(pd.unique(analysis['subsystem']))
+    if country_index is None:
+        country_index = pd.Index(sorted(set(analysis['ego'])), name='country')
+    years = np.arange(int(analysis['year'].min()), int(analysis['year'].max()) + 1)
+    subsystem_codes = pd.Index(subsystems).get_indexer(analysis['subsystem'])
+    country_codes = country_index.get_indexer(analysis['ego'])
+    known = (subsystem_codes >= 0) & (country_codes >= 0)
+    centralities = np.full((len(subsystems), len(years), len(country_index)), np.nan)
+    centralities[subsystem_codes[known], analysis['year'].to_numpy(dtype=int)[known] - years[0], country_codes[known]] = analysis[value].to_numpy(dtype=float)[known]
+    return subsystems, years, country_index, centralities
+
+def get_weight_vector(weights: dict, subsystems: list):
+    """Returns weights of subsystems (in the order of subsystems), matched by subsystem name
+
+    Raises KeyError if a subsystem has no weight, weights of other subsystems are ignored"""
+    missing = [subsystem for subsystem in subsystems if subsystem not in weights]
+    if len(missing) > 0:
+        raise KeyError(f"No weights for subsystems {missing}")
+    ignored = set(weights) - set(subsystems)
+    if len(ignored) > 0:
+        logging.warning(f"Ignoring weights of subsystems {ignored} which are not in the data")
+    return np.array([weights[subsystem] for subsystem in subsystems], dtype=float)
+
+def get_composite_index(centralities: np.ndarray, weights: np.ndarray, mean: str = 'geometric'):
+    """Weighted mean of centralities over subsystems
+
+    Parameters
+    ------------
+        centralities: np.ndarray
+            Array [subsystem, year, country] or a batch [..., subsystem, year, country], NaN values are skipped
+            (weights are renormalized over the subsystems with values)
+        weights: np.ndarray
+            Weights [subsystem], or a batch of weight vectors [..., subsystem] evaluated at once
+        mean: str
+            'geometric' (prod(x ** w) ** (1 / sum(w)), zero if a weighted value is zero) or 'arithmetic' (sum(x * w) / sum(w))
+    Return
+    -----------
+        index : np.ndarray
+            Array [..., year, country], NaN for countries without values in a year
+    """
+    present = ~np.isnan(centralities)
+    weight_sum = np.einsum('...s,...syc->...yc', weights, present.astype(float))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if mean == 'geometric':
+            zeros = present & (centralities <= 0)
+            logs = np.log(np.where(present & ~zeros, centralities, 1.0))
+            index = np.exp(np.einsum('...s,...syc->...yc', weights, logs) / weight_sum)
+            index = np.where(np.einsum('...s,...syc->...yc', weights, zeros.astype(float)) > 0, 0.0, index)
+        elif mean == 'arithmetic':
+            index = np.einsum('...s,...syc->...yc', weights, np.where(present, centralities, 0.0)) / weight_sum
+        else:
+            raise NotImplementedError(mean)
+    return np.where(weight_sum > 0, index, np.nan)
+
+def rank_by_year(index: np.ndarray, method: str = 'min', ascending: bool = False):
+    """Ranks countries in every year (along the last axis), as pd.Series.rank of every year
+
+    method is a pd.Series.rank method ('min', 'max', 'average', 'dense' or 'first'), NaN values are not ranked"""
+    method = 'ordinal' if method == 'first' else method
+    return rankdata(index if ascending else -index, method=method, axis=-1, nan_policy='omit')
+
+def get_status_combined(analysis: pd.DataFrame, weights: dict = SUBSYSTEM_WEIGHTS, mean: str = 'geometric', rank_method: str = 'min', value: str = 'centrality'):
+    """Composite status index of countries across subsystems
+
+    Centralities of analyse_system are laid out as an array [subsystem, year, country] (see get_centrality_array),
+    weights are matched to subsystems by name, the weighted mean (see get_composite_index) and per-year ranks are counted in one vectorized call.
+
+    Parameters
+    ------------
+        analysis: pd.DataFrame
+            Table with subsystem, year, ego and value columns (as returned by analyse_system)
+        weights: dict
+            Subsystem -> weight. Default: SUBSYSTEM_WEIGHTS
+        mean: str
+            'geometric' or 'arithmetic'. Default: 'geometric'
+        rank_method: str
+            Method of ranks with equal values ('min', 'max', 'average', 'dense' or 'first'). Default: 'min'
+        value: str
+            Value column. Default: 'centrality'
+    Return
+    -----------
+        status_combined : pd.DataFrame
+            Indexed by ego and year, with centrality columns of every subsystem, their sum (centrality),
+            the composite index (weighted_centrality) and its rank in the year (rank_combined, 1 is the highest)
+    """
+    subsystems, years, country_index, centralities = get_centrality_array(analysis, value=value)
+    index = get_composite_index(centralities, get_weight_vector(weights, subsystems), mean=mean)
+    ranks = rank_by_year(index, method=rank_method)
+    year_pos, country_pos = np.nonzero(~np.isnan(index))
+    status_combined = pd.DataFrame({
+        'ego': country_index[country_pos],
+        'year': years[year_pos],
+        **{subsystem: centralities[s, year_pos, country_pos] for s, subsystem in enumerate(subsystems)},
+        value: np.nansum(centralities[:, year_pos, country_pos], axis=0),
+        'weighted_centrality': index[year_pos, country_pos],
+        'rank_combined': ranks[year_pos, country_pos],
+    })
+    return status_combined.sort_values(['ego', 'year']).set_index(['ego', 'year'])
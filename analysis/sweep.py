@@ -0,0 +1,274 @@
+import numpy as np
+import pandas as pd
+
+SWEEP_COLUMNS = {
+    'year': np.int16,
+    'resolution': np.float64,
+    'community_id': np.int32,
+    'country': np.int32,
+    'is_hegemon': bool,
+    'local_centrality': np.float64,
+    'hierarchy_score': np.float64,
+    'community_resolution': np.float64,
+}
+PARTITION_COLUMNS = ['year', 'resolution']
+
+
+class CommunitySweep():
+    """
+    Columnar result of a community detection sweep over years and resolutions.
+
+    ...
+
+    Attributes
+    ----------
+    table : pd.DataFrame
+        One row per community member with columns year, resolution (sweep key), community_id, country (integer code in country_index),
+        is_hegemon, local_centrality, hierarchy_score and community_resolution (resolution of the Community, NaN if None)
+    country_index : pd.Index
+        Fixed index of countries the country codes refer to (see utils.utils.get_country_index)
+    partitions : pd.DataFrame
+        Swept (year, resolution) keys, including partitions without communities (which have no rows in table)
+
+    sweep[year][resolution] returns a list of CommunityView objects, which behave like Community objects
+    of the dict[year][resolution] -> list[Community] result.
+    """
+    def __init__(self, table: pd.DataFrame, country_index: pd.Index, partitions: pd.DataFrame = None):
+        self.table = table.astype(SWEEP_COLUMNS)[list(SWEEP_COLUMNS)].reset_index(drop=True)
+        self.country_index = country_index
+        table_partitions = self.table[PARTITION_COLUMNS].drop_duplicates().sort_values(PARTITION_COLUMNS)
+        if partitions is not None:
+            table_partitions = pd.concat([partitions.astype({column: SWEEP_COLUMNS[column] for column in PARTITION_COLUMNS})[PARTITION_COLUMNS], table_partitions]).drop_duplicates()
+        self.partitions = table_partitions.reset_index(drop=True)
+        self._positions = None
+
+    def __repr__(self):
+        repr = f'CommunitySweep of {len(self.years)} years, {len(self.partitions)} partitions, {len(self.table)} memberships'
+        return repr
+
+    @classmethod
+    def from_communities(cls, community_infos: dict, country_index: pd.Index):
+        """Builds a sweep from a dict[year][resolution] -> list[Community] (the legacy result format)"""
+        tables, partitions = [], []
+        for year in community_infos:
+            for resolution in community_infos[year]:
+                partitions += (year, resolution),
+                for community_id, community in enumerate(community_infos[year][resolution]):
+                    members = community.members
+                    hegemons = {hegemon.name: hegemon.centrality for hegemon in community.hegemons or []}
+                    tables += pd.DataFrame({
+                        'year': year,
+                        'resolution': resolution,
+                        'community_id': community_id,
+                        'country': country_index.get_indexer(members),
+                        'is_hegemon': [member in hegemons for member in members],
+                        'local_centrality': [hegemons.get(member, np.nan) for member in members],
+                        'hierarchy_score': community.hierarchy_score,
+                        'community_resolution': community.resolution if community.resolution is not None else np.nan,
+                    }),
+        return cls(pd.concat(tables) if tables else pd.DataFrame(columns=list(SWEEP_COLUMNS)), country_index,
+                   pd.DataFrame(partitions, columns=PARTITION_COLUMNS))
+
+    @classmethod
+    def concat(cls, sweeps: list):
+        """Concatenates sweeps sharing the same country index"""
+        country_index = sweeps[0].country_index
+        for sweep in sweeps[1:]:
+            if not sweep.country_index.equals(country_index):
+                raise ValueError("cannot concatenate sweeps with different country indexes")
+        return cls(pd.concat([sweep.table for sweep in sweeps]), country_index, pd.concat([sweep.partitions for sweep in sweeps]))
+
+    def to_parquet(self, path):
+        """Saves the sweep to a Parquet file, countries are stored as a categorical column keeping the country index
+        and partitions in the file metadata"""
+        table = self.table.copy()
+        table['country'] = pd.Categorical.from_codes(table['country'], categories=self.country_index)
+        table.attrs['partitions'] = {column: self.partitions[column].tolist() for column in PARTITION_COLUMNS}
+        table.to_parquet(path, index=False)
+
+    @classmethod
+    def read_parquet(cls, path):
+        """Loads a sweep saved with to_parquet"""
+        table = pd.read_parquet(path)
+        country = table['country'].astype('category')
+        table['country'] = country.cat.codes
+        partitions = pd.DataFrame(table.attrs['partitions']) if 'partitions' in table.attrs else None
+        return cls(table, pd.Index(country.cat.categories, name='country'), partitions)
+
+    @property
+    def years(self):
+        return sorted(self.partitions['year'].unique().tolist())
+
+    def _get_positions(self):
+        # row positions of every (year, resolution) partition, sorted by community_id (empty for partitions without communities)
+        if self._positions is None:
+            self._positions = dict()
+            for year, resolution in self.partitions.itertuples(index=False):
+                self._positions.setdefault(int(year), dict())[resolution] = np.empty(0, dtype=np.int64)
+            order = np.lexsort((self.table['community_id'].to_numpy(), self.table['resolution'].to_numpy(), self.table['year'].to_numpy()))
+            keys = self.table[['year', 'resolution']].to_numpy()[order]
+            if len(order) > 0:
+                starts = np.flatnonzero(np.concatenate([[True], (keys[1:] != keys[:-1]).any(axis=1)]))
+                for start, rows in zip(starts, np.split(order, starts[1:])):
+                    year, resolution = keys[start]
+                    self._positions.setdefault(int(year), dict())[resolution] = rows
+        return self._positions
+
+    def __getitem__(self, year):
+        positions = self._get_positions()[year]
+        return {resolution: self._get_communities(rows) for resolution, rows in positions.items()}
+
+    def __iter__(self):
+        return iter(self._get_positions())
+
+    def __contains__(self, year):
+        return year in self._get_positions()
+
+    def __len__(self):
+        return len(self._get_positions())
+
+    def keys(self):
+        return self._get_positions().keys()
+
+    def items(self):
+        return ((year, self[year]) for year in self)
+
+    def _get_communities(self, rows):
+        if len(rows) == 0:
+            return []
+        community_ids = self.table['community_id'].to_numpy()[rows]
+        starts = np.flatnonzero(np.concatenate([[True], community_ids[1:] != community_ids[:-1]]))
+        return [CommunityView(self, community_rows) for community_rows in np.split(rows, starts[1:])]
+
+    def hegemony_scores(self, resolution_range=None, country_index: pd.Index = None, comm_name: str = 'value'):
+        """Counts hegemon -> client scores (sum of hegemon strengths across resolutions)
+
+        Parameters
+        ------------
+            resolution_range: iterable or None
+                Resolutions to use, all if None
+            country_index: pd.Index or None
+                Countries to keep (scores for others are dropped), all countries of the sweep if None
+            comm_name: str
+                Name of the score column
+        Return
+        -----------
+            scores_df: pd.DataFrame
+                Non-zero scores in a year*ego*alter = comm_name DataFrame, ego is the hegemon and alter is the client
+        """
+        table = self.table
+        if resolution_range is not None:
+            table = table[table['resolution'].isin(list(resolution_range))]
+        keys = ['year', 'resolution', 'community_id']
+        hegemons = table[table['is_hegemon']]
+        strength = 1 / hegemons.groupby(keys)['country'].transform('size')
+        hegemons = hegemons[keys + ['country']].assign(strength=strength)
+        pairs = hegemons.merge(table[keys + ['country']], on=keys, suffixes=('_ego', '_alter'))
+        pairs = pairs[pairs['country_ego'] != pairs['country_alter']]
+        ego, alter = pairs['country_ego'].to_numpy(), pairs['country_alter'].to_numpy()
+        if country_index is None:
+            country_index = self.country_index
+        else:
+            ego, alter = [country_index.get_indexer(self.country_index[codes]) for codes in (ego, alter)]
+        known = (ego >= 0) & (alter >= 0)
+        scores_df = pd.DataFrame({
+            'year': pairs['year'].to_numpy()[known].astype(int),
+            'ego': country_index[ego[known]],
+            'alter': country_index[alter[known]],
+            comm_name: pairs['strength'].to_numpy()[known],
+        })
+        return scores_df.groupby(['year', 'ego', 'alter'])[[comm_name]].sum()
+
+
+class CommunityView():
+    """
+    Lightweight read-only Community over the rows of a CommunitySweep
+    (same attributes as analysis.community.Community).
+    """
+    __slots__ = ('_sweep', '_rows')
+
+    def __init__(self, sweep: CommunitySweep, rows: np.ndarray):
+        self._sweep = sweep
+        self._rows = rows
+
+    def __repr__(self):
+        repr = f'{self.year} Community at resolution {self.resolution} of {self.population} with {self.hegemons} as hegemon (hierarchy score = {self.hierarchy_score}).\nThe members are {self.members}'
+        return repr
+
+    def _get(self, column):
+        return self._sweep.table[column].to_numpy()[self._rows]
+
+    @property
+    def country_index(self):
+        return self._sweep.country_index
+
+    @property
+    def member_codes(self):
+        return self._get('country')
+
+    @property
+    def members(self):
+        return self.country_index[self.member_codes].to_list()
+
+    @property
+    def population(self):
+        return len(self._rows)
+
+    @property
+    def year(self):
+        return int(self._get('year')[0])
+
+    @property
+    def hierarchy_score(self):
+        return self._get('hierarchy_score')[0]
+
+    @property
+    def resolution(self):
+        resolution = self._get('community_resolution')[0]
+        return None if np.isnan(resolution) else resolution
+
+    @property
+    def hegemons(self):
+        hegemon_rows = self._rows[self._get('is_hegemon')]
+        if len(hegemon_rows) == 0:
+            return None
+        # same order as in Community: by descending local centrality
+        centrality = self._sweep.table['local_centrality'].to_numpy()[hegemon_rows]
+        hegemon_rows = hegemon_rows[np.argsort(-centrality, kind='stable')]
+        return [HegemonView(self, row) for row in hegemon_rows]
+
+
+class HegemonView():
+    """
+    Lightweight read-only Hegemon over a row of a CommunitySweep
+    (same attributes as analysis.community.Hegemon).
+    """
+    __slots__ = ('_community', '_row')
+
+    def __init__(self, community: CommunityView, row: int):
+        self._community = community
+        self._row = row
+
+    def __repr__(self):
+        repr = f'{self.name} ({self.centrality:.3f})'
+        return repr
+
+    @property
+    def name(self):
+        return self._community.country_index[self._community._sweep.table['country'].iat[self._row]]
+
+    @property
+    def centrality(self):
+        return self._community._sweep.table['local_centrality'].iat[self._row]
+
+    @property
+    def co_hegemons(self):
+        return [hegemon.name for hegemon in self._community.hegemons if hegemon._row != self._row]
+
+    @property
+    def clientele(self):
+        return [member for member in self._community.members if member != self.name]
+
+    @property
+    def strength(self):
+        return 1/(len(self._community.hegemons))
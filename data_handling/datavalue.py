@@ -31,7 +31,7 @@ class DataValue():
             if index_col is None:
                 self.gindex = df.index.get_loc(index) + 1  # Plus 1 as google indexing starts with 1, not 0
             else:
-                self.gindex = df.reset_index().set_index(index_col).index.get_loc(index) + 1  # Plus 1 as google indexing starts with 1, not 0
+                self.gindex = _get_key_index(df, index_col).get_loc(index) + 1  # Plus 1 as google indexing starts with 1, not 0
             logging.debug(f"gindex for {index} is {gindex}")
         else:
             if gindex is None: raise TypeError("Must specify gindex if df is None")
@@ -48,6 +48,47 @@ class DataValue():
         self.value = value
         logging.debug(f"Initialised {self}")
 
+    @classmethod
+    def from_frame(cls, datamart: str, sheet: str, df: pd.DataFrame, changes, index_col=None, return_format='list'):
+        """Builds DataValues of many changes of one sheet at once
+
+        Row and column positions are looked up for all changes together, with the same numbering as in __init__.
+
+        Arguments:
+        datamart (str): name of the table/datamart
+        sheet (str): name of the sheet
+        df (pd.DataFrame): related DataFrame (as read from the sheet)
+        changes (pd.DataFrame or dict): DataFrame with index, column and value columns, or a dict {(index, column): value}
+        index_col: index (primary key) column (used only for row detection). If None, df index is used. Default is None.
+        return_format (str): 'list' for a list of DataValue objects, 'payload' for batch_update ranges
+            of the sheet with adjacent cells merged (see data_handling.gsheet_handler.get_rectangles). Default is 'list'
+
+        Returns:
+        datavalues (list): list of DataValue objects or batch_update ranges [{'range': 'A1:B2', 'values': [[...], [...]]}, ...]
+        """
+        if isinstance(changes, dict):
+            changes = pd.DataFrame([(index, column, value) for (index, column), value in changes.items()], columns=['index', 'column', 'value'])
+        key_index = df.index if index_col is None else _get_key_index(df, index_col)
+        if not key_index.is_unique:
+            raise ValueError(f"index {index_col} of df is not unique, rows cannot be located")
+        gindex = key_index.get_indexer(changes['index'])
+        gcolumn = df.columns.get_indexer(changes['column'])
+        if (gindex < 0).any():
+            raise KeyError(f"rows not found: {list(changes['index'][gindex < 0].unique())}")
+        if (gcolumn < 0).any():
+            raise KeyError(f"columns not found: {list(changes['column'][gcolumn < 0].unique())}")
+        gindex, gcolumn = gindex + 1, gcolumn + 1  # Plus 1 as google indexing starts with 1, not 0
+        logging.debug(f"Located {len(changes)} changes of datamart {datamart}, sheet {sheet}")
+        if return_format == 'list':
+            return [cls(datamart, sheet, index, column, value, gindex=int(row), gcolumn=int(col))
+                    for index, column, value, row, col in zip(changes['index'], changes['column'], changes['value'], gindex, gcolumn)]
+        elif return_format == 'payload':
+            from data_handling.gsheet_handler import get_rectangles, get_range
+            cells = dict(zip(zip(gindex.tolist(), gcolumn.tolist()), changes['value']))
+            return [{'range': get_range(*rectangle), 'values': rectangle[2]} for rectangle in get_rectangles(cells)]
+        else:
+            raise ValueError(f"{return_format} is invalid for return_format, use 'list' or 'payload' instead")
+
     # aliases
     @property
     def table(self):
@@ -70,6 +111,12 @@ class DataValue():
     def __repr__(self):
         return f"DataValue: datamart={self.datamart}, sheet={self.sheet}, row={self.index} ({self.gindex}), column={self.column} ({self.gcolumn}), value={self.value}"
 
+def _get_key_index(df: pd.DataFrame, index_col):
+    """Returns the values of index_col (a column or an index level of df) as an index, positions matching df rows"""
+    if index_col in df.columns:
+        return pd.Index(df[index_col])
+    return df.index.get_level_values(index_col)
+
 def get_datavalue_dict(datavalues):
     """Returns a dict from a list of datavalues
     
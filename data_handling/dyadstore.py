@@ -0,0 +1,182 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+DEFAULT_STORE_DIR = '../data/dyadstore'
+METADATA_FILE = 'store.json'
+
+
+class DyadStore():
+    """
+    On-disk store of preprocessed dyadic sources, one memory-mapped array [year, ego, alter] per source.
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+        Directory of the store
+    country_index : pd.Index
+        Fixed country index shared by all sources (array positions along the ego and alter axes, see utils.utils.get_country_index)
+    sources : dict
+        Source name -> metadata (file, year_start, year_end, dtype, fill_value), saved to store.json
+
+    Arrays are .npy files opened with np.load(mmap_mode='r'), so a source is not read until it is sliced,
+    only the pages of the sliced years and countries are loaded, and processes opening the same source share the pages.
+    Files are written to a temporary name and moved into place with os.replace (see analysis.checkpoint.SweepCheckpoint).
+    """
+    def __init__(self, path: str = DEFAULT_STORE_DIR, country_index=None):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        metadata_path = os.path.join(self.path, METADATA_FILE)
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+            self.country_index = pd.Index(metadata['countries'], name='country')
+            self.sources = metadata['sources']
+            if country_index is not None and not self.country_index.equals(pd.Index(country_index)):
+                raise ValueError(f"Country index differs from the index of the store at {self.path}")
+        else:
+            if country_index is None:
+                raise ValueError(f"No store at {self.path}, country_index is needed to create one")
+            self.country_index = pd.Index(country_index, name='country')
+            self.sources = dict()
+            self._write_metadata()
+
+    def __repr__(self):
+        repr = f'DyadStore at {self.path}: {len(self.country_index)} countries, sources {list(self.sources)}'
+        return repr
+
+    def __contains__(self, name):
+        return name in self.sources
+
+    @staticmethod
+    def _write_atomic(path, write):
+        temp_path = f'{path}.tmp{os.getpid()}'
+        write(temp_path)
+        os.replace(temp_path, path)
+
+    def _write_metadata(self):
+        def write_metadata(path):
+            with open(path, 'w') as f:
+                json.dump({'countries': list(self.country_index), 'sources': self.sources}, f, indent=1)
+        self._write_atomic(os.path.join(self.path, METADATA_FILE), write_metadata)
+
+    def put(self, name: str, df_triple: pd.DataFrame, value: str = 'value', dtype=np.float32, fill_value: float = 0.0):
+        """Saves a source from a year*alter*ego table
+
+        Parameters
+        ------------
+            name: str
+                Source name (also the file name)
+            df_triple: pd.DataFrame
+                Table with year, alter and ego (index levels or columns) and the value column
+            value: str
+                Value column. Default: 'value'
+            dtype: np.dtype
+                Dtype of the array. Default: np.float32
+            fill_value: float
+                Value of dyads missing from df_triple. Default: 0.0
+        """
+        df = df_triple.reset_index() if 'year' not in df_triple.columns else df_triple
+        years = df['year'].astype(int).to_numpy()
+        egos = self.country_index.get_indexer(df['ego'])
+        alters = self.country_index.get_indexer(df['alter'])
+        known = (egos >= 0) & (alters >= 0)
+        if not known.all():
+            unknown = set(df['ego'][egos < 0]) | set(df['alter'][alters < 0])
+            logging.warning(f"Dropping {(~known).sum()} dyads of {name} with countries outside of the store index: {unknown}")
+        if not known.any():
+            raise ValueError(f"No dyads of {name} with countries of the store index to save")
+        year_start, year_end = int(years.min()), int(years.max())
+        file = f'{name}.npy'
+        def write_array(path):
+            array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(year_end - year_start + 1, len(self.country_index), len(self.country_index)))
+            array[:] = fill_value
+            array[years[known] - year_start, egos[known], alters[known]] = df[value].to_numpy()[known]
+            array.flush()
+            del array
+        self._write_atomic(os.path.join(self.path, file), write_array)
+        self.sources[name] = {'file': file, 'year_start': year_start, 'year_end': year_end, 'dtype': np.dtype(dtype).name, 'fill_value': fill_value}
+        self._write_metadata()
+        logging.info(f"Saved {name} ({year_start} - {year_end}) to {self.path}")
+
+    def remove(self, name: str):
+        os.remove(os.path.join(self.path, self.sources.pop(name)['file']))
+        self._write_metadata()
+
+    def open(self, name: str):
+        """Returns the whole array of a source, memory-mapped read-only (nothing is read until it is sliced)"""
+        return np.load(os.path.join(self.path, self.sources[name]['file']), mmap_mode='r')
+
+    def get_years(self, name: str):
+        return range(self.sources[name]['year_start'], self.sources[name]['year_end'] + 1)
+
+    def _get_positions(self, name, years, countries):
+        if years is None:
+            year_positions = slice(None)
+        else:
+            year_start, year_end = self.sources[name]['year_start'], self.sources[name]['year_end']
+            year_array = np.asarray(years, dtype=int)
+            outside = (year_array < year_start) | (year_array > year_end)
+            if outside.any():
+                raise KeyError(f"Years outside of {name} ({year_start} - {year_end}): {sorted(set(year_array[outside].tolist()))}")
+            if isinstance(years, range) and years.step == 1:
+                year_positions = slice(years.start - year_start, years.stop - year_start)
+            else:
+                year_positions = year_array - year_start
+        if countries is None:
+            return year_positions, slice(None)
+        country_positions = self.country_index.get_indexer(countries)
+        if (country_positions < 0).any():
+            raise KeyError(f"Countries outside of the store index: {set(np.asarray(countries)[country_positions < 0])}")
+        return year_positions, country_positions
+
+    def get(self, name: str, years=None, egos=None, alters=None):
+        """Returns a slice [year, ego, alter] of a source
+
+        Parameters
+        ------------
+            name: str
+                Source name
+            years: range, iterable of int or None
+                Years to get, all if None. A range of consecutive years gives a view of the memory-mapped file (no copy)
+            egos: iterable or None
+                Ego countries to get (in this order), all if None
+            alters: iterable or None
+                Alter countries to get (in this order), all if None
+        Return
+        -----------
+            array : np.ndarray
+                Array [year, ego, alter], a read-only view if only years are selected
+        """
+        array = self.open(name)
+        year_positions, ego_positions = self._get_positions(name, years, egos)
+        alter_positions = self._get_positions(name, None, alters)[1]
+        array = array[year_positions]
+        if not isinstance(ego_positions, slice):
+            array = array[:, ego_positions]
+        if not isinstance(alter_positions, slice):
+            array = array[:, :, alter_positions]
+        return array
+
+    def get_frame(self, name: str, years=None, countries=None, nonzero: bool = True):
+        """Returns a source as a year*alter*ego table with the value column (as returned by preprocessing, see analysis.network_analysis.get_networks)
+
+        years and countries select the slice (see get), if nonzero only dyads with nonzero values are returned"""
+        years = self.get_years(name) if years is None else years
+        countries = self.country_index if countries is None else pd.Index(countries)
+        array = self.get(name, years, countries, countries)
+        if nonzero:
+            year_pos, ego_pos, alter_pos = np.nonzero(array)
+        else:
+            year_pos, ego_pos, alter_pos = np.indices(array.shape).reshape(3, -1)
+        df_triple = pd.DataFrame({
+            'year': np.asarray(years)[year_pos],
+            'alter': np.asarray(countries)[alter_pos],
+            'ego': np.asarray(countries)[ego_pos],
+            'value': array[year_pos, ego_pos, alter_pos],
+        })
+        return df_triple.set_index(['year', 'alter', 'ego'])
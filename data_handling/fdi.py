@@ -6,7 +6,7 @@ import sys
 sys.path.append("..")
 
 from utils.utils import get_all_countries, get_empty_country_df, test_df, get_percent_df
-from utils.countryconverter import convert_country_df
+from utils.countryconverter import convert_country_df, convert_country_columns
 
 
 FDI_PATH = "../data/basic_preprocessed/fdi_total.csv"
@@ -72,8 +72,8 @@ def preprocessed_fdi(df, year_start, year_end=2022, rolling_window=5, test_data=
     #removing old data
     df = df[df['year'] >= year_start]
     
-    df = convert_country_df(df, 'Country', standard_to_convert='STATE_en_UN', purge=True)
-    df = convert_country_df(df, 'Partner Country', standard_to_convert='STATE_en_UN', purge=True)
+    df, purge_mask = convert_country_columns(df, ['Country', 'Partner Country'], standard_to_convert='STATE_en_UN')
+    df = df[~purge_mask]
     
     countries_all = get_all_countries()
     df_triple = df.groupby(["year", "Country", "Partner Country"]).sum()
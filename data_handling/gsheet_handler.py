@@ -5,18 +5,83 @@ from gspread.utils import rowcol_to_a1
 from requests import ConnectionError
 
 import pandas as pd
+import numpy as np
 import random
 import logging
 import time
-from functools import wraps
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, lru_cache
 
 from data_handling.datavalue import DataValue, get_datavalue_dict
 
+DEFAULT_CHUNK_CELLS = 10000  # cells in one batch_update request, well below the request size limit of the API
+DEFAULT_CHUNK_ROWS = 1000  # rows in one request of upload_gsheet
+DEFAULT_READ_WORKERS = 4  # threads (and clients) of read_gsheets_concurrent
+DEFAULT_READ_RATE = 60  # read requests per minute, the per-user quota of the Sheets API
+
 def setup_google_client():
     gc = gspread.service_account(filename='../your_service_account.json')
     logging.debug("Google client set up")
     return gc
 
+@lru_cache(maxsize=None)
+def get_google_client():
+    """Returns the Google client, set up on first use (the service account file is read only when a sheet is accessed)"""
+    return setup_google_client()
+
+class RateLimiter():
+    """
+    Thread-safe limit of calls in a sliding window, shared by all threads of a reader.
+
+    ...
+
+    Attributes
+    ----------
+    rate : int
+        Maximal number of calls in a window
+    period : float
+        Window length in seconds
+    """
+    def __init__(self, rate: int = DEFAULT_READ_RATE, period: float = 60):
+        self.rate = rate
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        repr = f'RateLimiter of {self.rate} calls per {self.period} seconds'
+        return repr
+
+    def acquire(self):
+        """Blocks until a call is allowed and registers it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while len(self._calls) > 0 and self._calls[0] <= now - self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.rate:
+                    self._calls.append(now)
+                    return
+                wait = self._calls[0] + self.period - now
+            logging.debug(f"Rate limit reached, waiting {wait:.1f} seconds")
+            time.sleep(wait)
+
+READ_RATE_LIMITER = RateLimiter()  # shared by all concurrent reads of the session
+_thread_clients = threading.local()  # client and opened tables of every reader thread (gspread clients are not thread-safe)
+_prefetched = dict()  # (tablename, sheetname, skiprows, evaluate_formulas, index_col) -> raw df, see prefetch_gsheets
+
+@lru_cache(maxsize=None)
+def get_spreadsheet(tablename: str):
+    """Returns the handle of a google table, opened once per session"""
+    return get_google_client().open(tablename)
+
+@lru_cache(maxsize=None)
+def get_worksheet(tablename: str, sheetname: str):
+    """Returns the handle of a sheet of a google table, looked up once per session"""
+    return get_spreadsheet(tablename).worksheet(sheetname)
+
 
 def retry(exceptions, total_tries=7, initial_wait=4, backoff_factor=2, logger=logging.getLogger(__name__)):
     """
@@ -87,14 +152,15 @@ def read_gsheet(tablename: str, sheetname: str, evaluate_formulas=True, index_co
         df (Pandas.DataFrame): data from Google.Sheets in a DataFrame
     """
     logging.debug(f"reading google table {tablename}, sheet {sheetname}")
-    gtable = gc.open(tablename)  # Note to self: implement cashing some day to avoid additional API calls
-    gsheet = gtable.worksheet(sheetname)
-    df = get_as_dataframe(gsheet, evaluate_formulas=evaluate_formulas, index_col=index_col, skiprows=skiprows)
+    df = _prefetched.pop((tablename, sheetname, skiprows, evaluate_formulas, index_col), None)
+    if df is None:
+        gsheet = get_worksheet(tablename, sheetname)
+        df = get_as_dataframe(gsheet, evaluate_formulas=evaluate_formulas, index_col=index_col, skiprows=skiprows)
     if clear_empty: df = remove_empty(df)
     return df
 
 @retry((APIError, ConnectionError))
-def read_gsheets(tablename: str, sheets: list, evaluate_formulas=True, index_col=None, clear_empty=True, return_format='dict'):
+def read_gsheets(tablename: str, sheets: list, evaluate_formulas=True, index_col=None, clear_empty=True, return_format='dict', max_workers=1):
     """Returns multiple sheets from a google table as a dict of DataFrames
 
     Arguments:
@@ -104,13 +170,12 @@ def read_gsheets(tablename: str, sheets: list, evaluate_formulas=True, index_col
         index_col (str): name of the column to be treated as the index, default is None
         clear_empty (bool): whether to remove empty rows and Unnamd columns, default is True
         return_format : str, format to return values 'dict' or 'list', default is 'dict'
+        max_workers (int): number of sheets read at once (see read_gsheets_concurrent), default is 1
 
     Returns:
         dfs (dict | list) : Dictionary {'sheetname1':df1, 'sheetname2':df2, ...} or list as [df1, df2, ...]
     """
     logging.debug(f"reading google table {tablename}, sheets {sheets}")
-    gtable = gc.open(tablename)
-    
     if return_format == 'dict':
         dfs = {}
     elif return_format == 'list':
@@ -118,8 +183,14 @@ def read_gsheets(tablename: str, sheets: list, evaluate_formulas=True, index_col
     else:
         raise ValueError(f"{return_format} is invalid for return_format, use 'list' or 'dict' instead")
     
+    if max_workers > 1:
+        dfs_read = read_gsheets_concurrent([(tablename, sheetname, 0) for sheetname in sheets], evaluate_formulas=evaluate_formulas, index_col=index_col, clear_empty=clear_empty, max_workers=max_workers)
+        if return_format == 'dict':
+            return {sheetname: dfs_read[(tablename, sheetname)] for sheetname in sheets}
+        return [dfs_read[(tablename, sheetname)] for sheetname in sheets]
+
     for sheetname in sheets:
-        gsheet = gtable.worksheet(sheetname)
+        gsheet = get_worksheet(tablename, sheetname)
         df = get_as_dataframe(gsheet, evaluate_formulas=evaluate_formulas, index_col=index_col)
         if clear_empty: df = remove_empty(df)
         if return_format == 'dict':
@@ -128,10 +199,75 @@ def read_gsheets(tablename: str, sheets: list, evaluate_formulas=True, index_col
             dfs += df,
     return dfs
 
+def _get_thread_worksheet(tablename: str, sheetname: str, rate_limiter: RateLimiter):
+    """Returns a worksheet handle through the client of the current thread, opening each table once per thread"""
+    if not hasattr(_thread_clients, 'client'):
+        _thread_clients.client = setup_google_client()
+        _thread_clients.spreadsheets = dict()
+    if tablename not in _thread_clients.spreadsheets:
+        rate_limiter.acquire()
+        _thread_clients.spreadsheets[tablename] = _thread_clients.client.open(tablename)
+    rate_limiter.acquire()
+    return _thread_clients.spreadsheets[tablename].worksheet(sheetname)
+
+@retry((APIError, ConnectionError))
+def _read_sheet(tablename: str, sheetname: str, skiprows: int, evaluate_formulas: bool, index_col, rate_limiter: RateLimiter):
+    gsheet = _get_thread_worksheet(tablename, sheetname, rate_limiter)
+    rate_limiter.acquire()
+    df = get_as_dataframe(gsheet, evaluate_formulas=evaluate_formulas, index_col=index_col, skiprows=skiprows)
+    logging.debug(f"read google table {tablename}, sheet {sheetname}")
+    return df
+
+def read_gsheets_concurrent(sheets: list, evaluate_formulas=True, index_col=None, clear_empty=True, max_workers=DEFAULT_READ_WORKERS, rate_limiter: RateLimiter = None):
+    """Reads sheets of one or several google tables in parallel
+
+    Every worker thread uses a client of its own, API calls of all threads share one rate limit.
+
+    Arguments:
+        sheets (list): (tablename, sheetname) or (tablename, sheetname, skiprows) tuples, skiprows is 0 if omitted
+        evaluate_formulas (bool): whether to avaluate Google.Sheets formulas when reading gsheet
+        index_col (str): name of the column to be treated as the index, default is None
+        clear_empty (bool): whether to remove empty rows and Unnamd columns, default is True
+        max_workers (int): number of sheets read at once, default is DEFAULT_READ_WORKERS
+        rate_limiter (RateLimiter): shared limit of API calls, READ_RATE_LIMITER if None
+
+    Returns:
+        dfs (dict): {(tablename, sheetname): df}
+    """
+    if rate_limiter is None: rate_limiter = READ_RATE_LIMITER
+    sheets = [tuple(sheet) if len(sheet) == 3 else (*sheet, 0) for sheet in sheets]
+    logging.info(f"reading {len(sheets)} google sheets with {max_workers} threads")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {(tablename, sheetname): executor.submit(_read_sheet, tablename, sheetname, skiprows, evaluate_formulas, index_col, rate_limiter)
+                   for tablename, sheetname, skiprows in sheets}
+        dfs = {key: future.result() for key, future in futures.items()}
+    if clear_empty:
+        dfs = {key: remove_empty(df) for key, df in dfs.items()}
+    return dfs
+
+def prefetch_gsheets(sheets: list, evaluate_formulas=True, index_col=None, max_workers=DEFAULT_READ_WORKERS):
+    """Reads sheets in parallel ahead of time (see read_gsheets_concurrent)
+
+    The next read_gsheet call of a prefetched sheet with the same skiprows, evaluate_formulas and index_col
+    returns the prefetched data instead of calling the API (each prefetched sheet is used once).
+
+    Arguments:
+        sheets (list): (tablename, sheetname) or (tablename, sheetname, skiprows) tuples, skiprows is 0 if omitted
+    """
+    sheets = [tuple(sheet) if len(sheet) == 3 else (*sheet, 0) for sheet in sheets]
+    dfs = read_gsheets_concurrent(sheets, evaluate_formulas=evaluate_formulas, index_col=index_col, clear_empty=False, max_workers=max_workers)
+    for tablename, sheetname, skiprows in sheets:
+        _prefetched[(tablename, sheetname, skiprows, evaluate_formulas, index_col)] = dfs[(tablename, sheetname)]
+
+@retry((APIError, ConnectionError))
+def _batch_update(gsheet, update_list: list):
+    # See batch_update docs - https://docs.gspread.org/en/latest/api/models/worksheet.html#gspread.worksheet.Worksheet.batch_update
+    gsheet.batch_update(update_list)
+
 @retry((APIError, ConnectionError))
 def replace_gsheet(tablename: str, sheetname: str, df: pd.DataFrame, include_index=True):
     """Replaces a google sheet with a Pandas.DataFrame.
-    Efficient (one API call), but risky, as all data is rewritten.
+    Efficient (one API call), but risky, as all data is rewritten. For large frames see upload_gsheet.
 
     Arguments:
         tablename (str): name of the table in Google.Sheets
@@ -143,35 +279,185 @@ def replace_gsheet(tablename: str, sheetname: str, df: pd.DataFrame, include_ind
         df (Pandas.DataFrame): data from Google.Sheets in a DataFrame
     """
     logging.info(f"replacing google table {tablename}, sheet {sheetname} with dataframe of size {df.shape}")
-    gsheet = gc.open(tablename).worksheet(sheetname)
+    gsheet = get_worksheet(tablename, sheetname)
     set_with_dataframe(gsheet, df, include_index=include_index)
 
+def _to_cell(value):
+    if pd.isna(value): return ''
+    if isinstance(value, np.generic): return value.item()
+    if isinstance(value, (int, float, str, bool)): return value
+    return str(value)
 
-@retry((APIError, ConnectionError))
-def update_gsheet(datavalues: list, include_index=True):
-    """Updates a google sheet with a Pandas.DataFrame using multiple datavalues
-    
+def upload_gsheet(tablename: str, sheetname: str, df: pd.DataFrame, include_index=True, chunk_rows=DEFAULT_CHUNK_ROWS, start_row=0):
+    """Writes a large Pandas.DataFrame to a google sheet in chunks of rows, one request per chunk.
+    Every chunk is retried on its own, if the upload still fails it can be resumed from the returned (or logged) start_row.
+
+    Arguments:
+        tablename (str): name of the table in Google.Sheets
+        sheetname (str): name of the sheet in the table
+        df (Pandas.DataFrame) : DataFrame to write, starting with the header in the first row
+        include_index (bool): whether to include df index, default is True
+        chunk_rows (int): number of rows in one request, default is DEFAULT_CHUNK_ROWS
+        start_row (int): number of df rows already written (the header is written with start_row=0), default is 0
+
+    Returns:
+        rows_written (int): number of df rows written, len(df) on success
+    """
+    frame = df.reset_index() if include_index else df
+    logging.info(f"uploading dataframe of size {frame.shape} to google table {tablename}, sheet {sheetname} in chunks of {chunk_rows} rows")
+    gsheet = get_worksheet(tablename, sheetname)
+    if gsheet.row_count < len(frame) + 1: gsheet.add_rows(len(frame) + 1 - gsheet.row_count)
+    if gsheet.col_count < frame.shape[1]: gsheet.add_cols(frame.shape[1] - gsheet.col_count)
+    last_column = rowcol_to_a1(1, frame.shape[1])[:-1]
+    if start_row == 0:
+        _batch_update(gsheet, [{'range': f"A1:{last_column}1", 'values': [[str(column) for column in frame.columns]]}])
+    for chunk_start in range(start_row, len(frame), chunk_rows):
+        chunk = frame.iloc[chunk_start:chunk_start + chunk_rows]
+        values = [[_to_cell(value) for value in row] for row in chunk.itertuples(index=False)]
+        try:
+            _batch_update(gsheet, [{'range': f"A{chunk_start + 2}:{last_column}{chunk_start + len(chunk) + 1}", 'values': values}])
+        except Exception:
+            logging.error(f"Upload to {tablename}, sheet {sheetname} failed, resume with start_row={chunk_start}")
+            raise
+        logging.debug(f"Uploaded rows {chunk_start}-{chunk_start + len(chunk)} of {len(frame)}")
+    return len(frame)
+
+def get_rectangles(cells: dict):
+    """Merges cells into rectangular ranges
+
+    Cells adjacent in a row are merged into runs, runs spanning the same columns in consecutive rows are merged into rectangles.
+
+    Arguments:
+        cells (dict): (row, column) -> value, indices start with 1
+
+    Returns:
+        rectangles (list): (first row, first column, values) tuples, values as a list of rows
+    """
+    runs = list()  # (row, first column, values)
+    for row, column in sorted(cells):
+        if len(runs) > 0 and runs[-1][0] == row and runs[-1][1] + len(runs[-1][2]) == column:
+            runs[-1][2].append(cells[(row, column)])
+        else:
+            runs.append((row, column, [cells[(row, column)]]))
+    open_rectangles = dict()  # (first column, width) -> (first row, values), extended by a run of the same columns in the next row
+    rectangles = list()
+    for row, column, values in runs:
+        key = (column, len(values))
+        if key in open_rectangles:
+            first_row, rows = open_rectangles[key]
+            if first_row + len(rows) == row:
+                rows.append(values)
+                continue
+            rectangles += (first_row, column, rows),
+        open_rectangles[key] = (row, [values])
+    rectangles += [(first_row, column, rows) for (column, _), (first_row, rows) in open_rectangles.items()]
+    return rectangles
+
+def get_range(first_row, first_column, values):
+    """Returns the A1 range of a rectangle (see get_rectangles)"""
+    return f"{rowcol_to_a1(first_row, first_column)}:{rowcol_to_a1(first_row + len(values) - 1, first_column + len(values[0]) - 1)}"
+
+
+class GSheetWriteBuffer():
+    """
+    Write-behind buffer of google sheet updates, collecting DataValues across calls and sending them on flush.
+
+    ...
+
+    Attributes
+    ----------
+    cells : dict
+        (datamart, sheet) -> {(row, column): value} of pending updates, a later value of a cell replaces the earlier one
+    chunk_cells : int
+        Maximal number of cells sent in one batch_update request
+
+    On flush, adjacent cells of a sheet are merged into rectangular ranges (see get_rectangles), the ranges are sent
+    in chunks of chunk_cells cells, one request per chunk. Cells of a sent chunk leave the buffer at once,
+    so a flush interrupted by an error can be repeated to send the rest. Used as a context manager, the buffer is flushed on exit.
+    """
+    def __init__(self, chunk_cells: int = DEFAULT_CHUNK_CELLS):
+        self.cells = dict()
+        self.chunk_cells = chunk_cells
+
+    def __repr__(self):
+        repr = f'GSheetWriteBuffer of {len(self)} cells in {len(self.cells)} sheets'
+        return repr
+
+    def __len__(self):
+        return sum(len(cells) for cells in self.cells.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None: self.flush()
+
+    def add(self, datavalues: list):
+        """Adds updates (DataValue objects) to the buffer"""
+        for datavalue in datavalues:
+            if not isinstance(datavalue, DataValue):
+                raise TypeError("items in datavalues list must be of class DataValue")
+            self.cells.setdefault((datavalue.datamart, datavalue.sheet), dict())[(datavalue.gindex, datavalue.gcolumn)] = datavalue.value
+
+    def get_chunks(self, datamart: str, sheet: str):
+        """Returns pending updates of a sheet as chunks of at most chunk_cells cells, each a list of rectangles (see get_rectangles)
+
+        Rectangles larger than chunk_cells are split by rows"""
+        chunks = list()
+        chunk_size = self.chunk_cells
+        for first_row, first_column, values in get_rectangles(self.cells[(datamart, sheet)]):
+            width = len(values[0])
+            band = max(1, self.chunk_cells // width)
+            for offset in range(0, len(values), band):
+                rows = values[offset:offset + band]
+                if chunk_size + len(rows) * width > self.chunk_cells:
+                    chunks.append(list())
+                    chunk_size = 0
+                chunks[-1].append((first_row + offset, first_column, rows))
+                chunk_size += len(rows) * width
+        return chunks
+
+    def flush(self):
+        """Sends all pending updates
+
+        Returns:
+            n_requests (int): number of batch_update requests sent
+        """
+        n_requests = 0
+        for datamart, sheet in list(self.cells):
+            gsheet = get_worksheet(datamart, sheet)
+            cells = self.cells[(datamart, sheet)]
+            chunks = self.get_chunks(datamart, sheet)
+            logging.info(f"Flushing {len(cells)} cells to datamart {datamart}, sheet {sheet} in {len(chunks)} requests")
+            for chunk in chunks:
+                update_list = [{'range': get_range(*rectangle), 'values': rectangle[2]} for rectangle in chunk]
+                logging.debug(f"Updating datamart {datamart}, sheet {sheet} with ranges {[update['range'] for update in update_list]}")
+                _batch_update(gsheet, update_list)
+                n_requests += 1
+                for first_row, first_column, values in chunk:
+                    for r in range(len(values)):
+                        for c in range(len(values[0])):
+                            del cells[(first_row + r, first_column + c)]
+            del self.cells[(datamart, sheet)]
+        return n_requests
+
+
+def update_gsheet(datavalues: list, include_index=True, buffer: GSheetWriteBuffer = None):
+    """Updates google sheets using multiple datavalues
+    Adjacent cells are merged into rectangular ranges and sent in chunks (see GSheetWriteBuffer).
 
     Arguments:
         datavalues (list): list of DataValue objects
         include_index (bool): whether to include df index when writing to gsheet, default is True
+        buffer (GSheetWriteBuffer): buffer to collect the datavalues in, they are sent on buffer.flush(). If None (default), they are sent at once
     """
     logging.info(f"Updating using batch method, total changes = {len(datavalues)}")
-    batches_dict = get_datavalue_dict(datavalues)
-    
-    for datamart in batches_dict:
-        gtable = gc.open(datamart)
-        for sheet in batches_dict[datamart]:
-            gsheet = gtable.worksheet(sheet)
-            update_list = list()  # list of updates to database
-            for datavalue in batches_dict[datamart][sheet]:
-                update_list += {
-                    'range' : datavalue.a1,
-                    'values' : [[datavalue.value]]
-                },
-            logging.debug(f"Updating datamart {datamart}, sheet {sheet} with values \n{update_list}")
-            # See batch_update docs - https://docs.gspread.org/en/latest/api/models/worksheet.html#gspread.worksheet.Worksheet.batch_update
-            gsheet.batch_update(update_list)
+    if buffer is not None:
+        buffer.add(datavalues)
+        return
+    buffer = GSheetWriteBuffer()
+    buffer.add(datavalues)
+    buffer.flush()
 
 def test():
     print(f"Testing {__file__}")
@@ -185,6 +471,5 @@ def test():
     print("TEST DONE")
 
 
-gc = setup_google_client()
 if __name__ == '__main__':
     test()
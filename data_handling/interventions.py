@@ -6,18 +6,17 @@ from itertools import product, combinations
 import sys
 sys.path.append("..")
 
-from utils.utils import get_all_countries, get_empty_country_df, test_df
-from analysis.network_analysis import get_networks
-from analysis.community import detect_local_communities
-from analysis.hegemony import get_hegemony_scores, get_hegemony_top, visualize_hegemony
-from data_handling import gsheet_handler
-from utils.countryconverter import convert_country_df
+from utils.utils import get_all_countries, get_empty_country_df, get_system_member_mask, test_df
+from utils.countryconverter import convert_country_columns, explode_country_column
+from data_handling.sparsetriple import SparseTriple
 
 
 
 def load_interventions():
     """Loads DoCaNoMI data 1992-2022"""
-
+    from data_handling import gsheet_handler
+    # country ids are needed by preprocess_interventions, both sheets are read in one round
+    gsheet_handler.prefetch_gsheets([('interventions', 'i_main', 1), ('country_data', 'countryids', 0)])
     df_docanomi = gsheet_handler.read_gsheet(tablename='interventions', sheetname='i_main', skiprows=1)
     df_imi = pd.read_excel('../data/raw/interventions/MergedIMIData1947-2005.xls')
     
@@ -26,9 +25,10 @@ def load_interventions():
     df_imi['i_case'] = 1.0
     df_imi['i_burden_s_share'] = 1.0
     df_imi['i_dyad_id'] = 'i0000'
-    df_imi['refsubject_en'] = convert_country_df(df_imi, 'intervener', standard_to_convert='STATE_en_UN', purge=True, numeric_type='cow')['intervener']
-    df_imi['refobject_en'] = convert_country_df(df_imi, 'target', standard_to_convert='STATE_en_UN', purge=True, numeric_type='cow')['target']
-    df_imi.dropna(subset=['refobject_en', 'refsubject_en'], inplace=True)
+    converted, purge_mask = convert_country_columns(df_imi, ['intervener', 'target'], standard_to_convert='STATE_en_UN', numeric_type='cow')
+    df_imi['refsubject_en'] = converted['intervener']
+    df_imi['refobject_en'] = converted['target']
+    df_imi = df_imi[~purge_mask]
     #print(df_imi['refobject_en'].unique())
     #print(df_imi['refsubject_en'].unique())
     df_imi = df_imi[df_imi['i_year_start'] < 1992]
@@ -36,7 +36,7 @@ def load_interventions():
     logging.info("Loaded DoCaNoMI and IMI data 1992-2022")
     return pd.concat([df_docanomi, df_imi])
 
-def preprocess_interventions(df, rolling_window=5, year_start=1992, year_end=2022, neighbourhood_value=0.1, neighbourhood_type='region', test_data=True):
+def preprocess_interventions(df, rolling_window=5, year_start=1992, year_end=2022, neighbourhood_value=0.1, neighbourhood_type='region', test_data=True, sparse=False):
     """Preprocessing DoCaNoMI data:
         - removing non-cases
         - removing cases marked for removal
@@ -51,11 +51,15 @@ def preprocess_interventions(df, rolling_window=5, year_start=1992, year_end=202
             Rolling window to use for smoothing the data
         year_start: int
             Year to start with (needed for correct rolling calculations)
+        sparse: bool
+            Whether to return a SparseTriple of the nonzero values instead of the zero-padded table (see data_handling.sparsetriple),
+            neighbourhood values are only added to dyads of the same region
     Return
     -----------
         tuple(df , triple_df)
             df : pd.DataFramme() - preprocessed df with DoCaNoMI Data,
             triple_df  : pd.DataFramme() - DataFrame containing information about interventions in triple format (year*country*country). 
+                A SparseTriple if sparse
     """
     logging.info("Preprocessing DoCaNoMI+IMI Data")
 
@@ -66,6 +70,7 @@ def preprocess_interventions(df, rolling_window=5, year_start=1992, year_end=202
     YEAR_LABEL = 'year'
     VALUE_LABEL = 'i_case'
 
+    from data_handling import gsheet_handler
     country_df = gsheet_handler.read_gsheet(tablename='country_data', sheetname='countryids', skiprows=0)
     
     # removing non-cases
@@ -89,15 +94,13 @@ def preprocess_interventions(df, rolling_window=5, year_start=1992, year_end=202
     df = df[['year', 'refobject_en', 'refsubject_en', 'i_case', 'i_burden_s_share']]
     
     # splitting up refobjects
-    df['refobject_en'] = df['refobject_en'].apply(lambda x: x.split("; "))
-    df = df.explode('refobject_en')
-    df['refobject_en'] = df['refobject_en'].apply(lambda x: x.strip())
+    df = explode_country_column(df, 'refobject_en', "; ")
 
     #df.replace({'Yugoslavia':'Serbia'}, inplace=True)
     
     #converting to STATE_en_UN (can do Alpha3_Code)
-    df = convert_country_df(df, 'refobject_en', standard_to_convert='STATE_en_UN', purge=True)
-    df = convert_country_df(df, 'refsubject_en', standard_to_convert='STATE_en_UN', purge=True)
+    df, purge_mask = convert_country_columns(df, ['refobject_en', 'refsubject_en'], standard_to_convert='STATE_en_UN')
+    df = df[~purge_mask]
 
     df['i_burden_s_share'] = df['i_burden_s_share'].replace('None', None).fillna(0.1)
     
@@ -115,6 +118,11 @@ def preprocess_interventions(df, rolling_window=5, year_start=1992, year_end=202
     if test_data:
         test_df(df_triple.reset_index(), source_name, year_start=year_start, year_end=year_end, alter_label=ALTER_LABEL, ego_label=EGO_LABEL, year_label=YEAR_LABEL, value_label=VALUE_LABEL)
     
+    if sparse:
+        triple = _get_sparse_interventions(df_triple, country_df, rolling_window, year_start, year_end, neighbourhood_value, neighbourhood_type)
+        logging.info(f"Done preprocessing DoCaNoMI Data: {triple}")
+        return df, triple
+
     empty_df=get_empty_country_df(years=df['year'].unique(), countries_all=countries_all, names=["year", "refsubject_en", "refobject_en"])
     
     # multiplying with neighbourhood matrix
@@ -152,11 +160,34 @@ def preprocess_interventions(df, rolling_window=5, year_start=1992, year_end=202
     return df, df_triple
 
 
+def _get_sparse_interventions(df_triple, country_df, rolling_window, year_start, year_end, neighbourhood_value, neighbourhood_type):
+    """Sparse version of the padding and rolling of preprocess_interventions: the grid is the system membership of year_start for all years,
+    neighbourhood values are added to the dyads of members of the same region"""
+    member_index, member_mask = get_system_member_mask(year_start, year_start)
+    members = (member_index, np.repeat(member_mask, year_end - year_start + 1, axis=0))
+    values = df_triple.rename_axis(['year', 'alter', 'ego']).rename(columns={'i_case': 'value'}).reset_index()
+    if neighbourhood_type == 'region':
+        regions = country_df.dropna(subset=['state_visual']).drop_duplicates('state_visual').set_index('state_visual')['region_lowest_level']
+        member_regions = pd.DataFrame({'country': member_index[member_mask[0]]})
+        member_regions['region'] = member_regions['country'].map(regions)
+        member_regions = member_regions.dropna(subset=['region'])
+        pairs = member_regions.rename(columns={'country': 'alter'}).merge(member_regions.rename(columns={'country': 'ego'}), on='region')
+        pairs = pairs[pairs['alter'] != pairs['ego']]
+        neighbourhood = pairs.loc[pairs.index.repeat(year_end - year_start + 1), ['alter', 'ego']]
+        neighbourhood['year'] = np.tile(np.arange(year_start, year_end + 1), len(pairs))
+        neighbourhood['value'] = neighbourhood_value
+        values = pd.concat([values, neighbourhood], ignore_index=True).groupby(['year', 'alter', 'ego'])['value'].sum().reset_index()
+    triple = SparseTriple.from_frame(values, year_start, year_end, members=members)
+    return triple.rolling_mean(rolling_window).normalize()
+
     
 def interventions_main(year_start=1992, year_end=2022, rolling_window=5, 
                        res_range_start=2, res_range_end=20, one_year_hegemony_threshold=5, 
                        min_clients_for_top=3, centrality_threshold=0.5,
-                       neighbourhood_value=0.1, community_detection='louvian'):
+                       neighbourhood_value=0.1, community_detection='louvian', checkpoint_dir=None):
+    from analysis.network_analysis import get_networks
+    from analysis.community import detect_local_communities
+    from analysis.hegemony import get_hegemony_scores, get_hegemony_top, visualize_hegemony
     comm_name = 'interventions'
     
     df = load_interventions() # Loading the data
@@ -167,7 +198,7 @@ def interventions_main(year_start=1992, year_end=2022, rolling_window=5,
     networks = get_networks(df_triple, countries_all, year_start, year_end)  # getting netowrks
     resolution_range = list(map(lambda x: x/10, list(range(res_range_start, res_range_end))))
     logging.debug(f"Resolution range is {resolution_range}")
-    communities = detect_local_communities(networks, df_triple, countries_all, year_start, year_end, resolution_range, centrality_threshold=centrality_threshold, community_detection=community_detection)
+    communities = detect_local_communities(networks, df_triple, countries_all, year_start, year_end, resolution_range, centrality_threshold=centrality_threshold, community_detection=community_detection, checkpoint_dir=checkpoint_dir)
     hegemony_df = get_hegemony_scores(communities, resolution_range, year_start, year_end, countries_all, comm_name=comm_name)
     all_time_threshold = (year_end - year_start) * min_clients_for_top
     hegemony_top = get_hegemony_top(hegemony_df, comm_name, one_year_threshold=one_year_hegemony_threshold, all_time_threshold=all_time_threshold)
@@ -1,4 +1,3 @@
-import sipri # pip install sipri
 import pandas as pd
 import logging
 from itertools import product, combinations
@@ -7,11 +6,8 @@ import sys
 sys.path.append("..")
 
 from utils.utils import get_all_countries, get_empty_country_df, test_df
-from analysis.network_analysis import get_networks
-from analysis.community import detect_local_communities
-from analysis.hegemony import get_hegemony_scores, get_hegemony_top, visualize_hegemony
-from utils.countryconverter import convert_country_df
-from data_handling import gsheet_handler
+from utils.countryconverter import convert_country_columns
+from data_handling.sparsetriple import SparseTriple
 
 JME_PATH="../data/raw/jme/jmeDataPublic.xlsx"
 DEFAULT_GDP_THRESHOLD = 0.75  # какую долю от альтер должен составлять эго, чтобы тоже получить баллы
@@ -22,7 +18,8 @@ def load_jme():
     logging.info("Loaded Joint Military Exercises data")
     return df
     
-def preprocess_jme(df, year_start, year_end=2022, rolling_window=5, gdp_threshold=DEFAULT_GDP_THRESHOLD, test_data=True, add_directionality=True):
+def preprocess_jme(df, year_start, year_end=2022, rolling_window=5, gdp_threshold=DEFAULT_GDP_THRESHOLD, test_data=True, add_directionality=True, sparse=False):
+    """Preprocesses Joint Military Exercises data, sparse - whether to return a SparseTriple of the nonzero values (see data_handling.sparsetriple)"""
     data_triple = []
 
     source_name = preprocess_jme.__name__.split('_')[1]
@@ -66,11 +63,14 @@ def preprocess_jme(df, year_start, year_end=2022, rolling_window=5, gdp_threshol
     df_triple.reset_index(inplace=True)
     
     #converting to STATE_en_UN (can do Alpha3_Code)
-    df_triple = convert_country_df(df_triple, 'alter', standard_to_convert='STATE_en_UN', purge=True)
-    df_triple = convert_country_df(df_triple, 'ego', standard_to_convert='STATE_en_UN', purge=True)
+    df_triple, purge_mask = convert_country_columns(df_triple, ['alter', 'ego'], standard_to_convert='STATE_en_UN')
+    df_triple = df_triple[~purge_mask]
     
     df_triple.set_index(['year', 'ego', 'alter'], inplace=True)
 
+    if sparse:
+        triple = _get_sparse_jme(df_triple, source_name, year_start, year_end, rolling_window, gdp_threshold, test_data, add_directionality)
+        return df, triple
 
     
     empty_df=get_empty_country_df(years=df_triple.reset_index()['year'].unique(), countries_all=countries_all, names=["year", "alter", "ego"])
@@ -91,10 +91,7 @@ def preprocess_jme(df, year_start, year_end=2022, rolling_window=5, gdp_threshol
     
     # Добавляем направленности с помощью данных ВВП
     if add_directionality:
-        gdp_df = gsheet_handler.read_gsheet(tablename='country_data', sheetname='countryids', skiprows=0).dropna(subset=['state_en_un']).set_index('state_en_un')['gdp2018']
-        gdp_df['German Democratic Republic'] = 1049550000000.0
-        gdp_df['Czechoslovakia'] = 57600000000.0
-        gdp_df['State of Palestine'] = 14498000000.0
+        gdp_df = _get_gdp()
         
         df_triple.reset_index(inplace=True)
         df_triple['ego_gdp2018']=df_triple['ego'].apply(lambda x: gdp_df[x])
@@ -110,17 +107,49 @@ def preprocess_jme(df, year_start, year_end=2022, rolling_window=5, gdp_threshol
     
     return df, df_triple
 
+def _get_gdp():
+    """Returns GDP 2018 by country (STATE_en_UN), for the directionality of preprocess_jme"""
+    from data_handling import gsheet_handler
+    gdp_df = gsheet_handler.read_gsheet(tablename='country_data', sheetname='countryids', skiprows=0).dropna(subset=['state_en_un']).set_index('state_en_un')['gdp2018']
+    gdp_df['German Democratic Republic'] = 1049550000000.0
+    gdp_df['Czechoslovakia'] = 57600000000.0
+    gdp_df['State of Palestine'] = 14498000000.0
+    return gdp_df
+
+def _get_sparse_jme(df_triple, source_name, year_start, year_end, rolling_window, gdp_threshold, test_data, add_directionality):
+    """Sparse version of preprocess_jme after the conversion: values are normalized, 2016 is copied to 2017..year_end,
+    rolled over the membership mask and directionality is applied to the rolled values (the same as before rolling, it removes whole dyads)"""
+    values = df_triple.reset_index()
+    values = values[values['value'] != 0]
+    values['value'] = values['value'] / values['value'].max()
+    if test_data:
+        test_df(values, source_name, year_start=year_start, year_end=year_end)
+    values = pd.concat([values] + [values[values['year']==2016].assign(year=year) for year in range(2017, year_end+1)], ignore_index=True)
+    triple = SparseTriple.from_frame(values)
+    if rolling_window is not None:
+        triple = triple.rolling_mean(rolling_window)
+    if add_directionality:
+        gdp_df = _get_gdp()
+        ego_gdp = triple.country_index[triple.ego_codes].map(gdp_df).to_numpy(dtype=float)
+        alter_gdp = triple.country_index[triple.alter_codes].map(gdp_df).to_numpy(dtype=float)
+        triple = triple.filter_dyads(ego_gdp / alter_gdp > gdp_threshold)
+    return triple
+
 def jme_main(year_start=1992, rolling_window=None, res_range_start=2, res_range_end=20, one_year_hegemony_threshold=5, 
-             min_clients_for_top=3, centrality_threshold=0.45, centrality_type='out-degree'):
+             min_clients_for_top=3, centrality_threshold=0.45, centrality_type='out-degree', checkpoint_dir=None):
+    from analysis.network_analysis import get_networks
+    from analysis.community import detect_local_communities
+    from analysis.hegemony import get_hegemony_scores, get_hegemony_top, visualize_hegemony
     comm_name = 'jme'
     
     df = load_jme()
-    df, df_triple = preprocess_jme(df, year_start, rolling_window)
+    df, df_triple = preprocess_jme(df, year_start, rolling_window=rolling_window)
+    countries_all = get_all_countries(processed_df=df_triple.reset_index(), ego_column='ego', alter_column='alter')  # getting set of all countries
     year_end = df_triple.index.get_level_values('year').max()  # getting last year in df
     networks = get_networks(df_triple, countries_all, year_start, year_end, isDigraph=True, removeLessThanZero=False)  # getting netowrks
     resolution_range = list(map(lambda x: x/10, list(range(res_range_start, res_range_end))))
     logging.debug(f"Resolution range is {resolution_range}")
-    communities = detect_local_communities(networks, df_triple, countries_all, year_start, year_end, resolution_range, centrality_threshold=centrality_threshold, centrality_type=centrality_type)
+    communities = detect_local_communities(networks, df_triple, countries_all, year_start, year_end, resolution_range, centrality_threshold=centrality_threshold, centrality_type=centrality_type, checkpoint_dir=checkpoint_dir)
     hegemony_df = get_hegemony_scores(communities, resolution_range, year_start, year_end, countries_all, comm_name=comm_name)
     all_time_threshold = (year_end - year_start) * min_clients_for_top
     hegemony_top = get_hegemony_top(hegemony_df, comm_name, one_year_threshold=one_year_hegemony_threshold, all_time_threshold=all_time_threshold)
@@ -0,0 +1,313 @@
+import os
+import json
+import shutil
+import time
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+import sys
+sys.path.append("..")
+
+from utils.utils import get_system_members, test_df, to_compact_triple, COMPACT_YEAR_DTYPE
+from utils.countryconverter import convert_country_columns
+
+TRIPLE_LABELS = ['year', 'alter', 'ego']
+
+PREPROCESSING_TIMINGS = dict()  # source name -> seconds by stage of the last preprocess_source run
+
+
+class SourceSpec():
+    """
+    Declarative description of a dyadic source, preprocessed by preprocess_source.
+
+    ...
+
+    Attributes
+    ----------
+    name : str
+        Source name (for test_df, the log and PREPROCESSING_TIMINGS)
+    ego_label : str
+        Ego column of the raw data
+    alter_label : str
+        Alter column of the raw data
+    year_label : str
+        Year column of the raw data
+    value_label : str
+        Value column of the raw data
+    title : str
+        Source title for the log, e.g. 'Trade Data (COMTRADE)'
+    numeric_type : str or None
+        Type of numeric country ids ('cow' or 'iso'), see utils.countryconverter.get_id_dict
+    filter_year_end : bool
+        Whether to drop years after year_end (some sources only drop the years before year_start)
+    drop_zeros : bool
+        Whether to drop dyads with zero sums before padding
+    logarithmic : bool
+        Whether to convert values to log 10 scale before padding
+    rolling_window : int
+        Window of the rolling mean over the years of a dyad
+    normalize : bool
+        Whether to divide values by the maximum
+    interpolate : bool
+        Whether to interpolate missing years of every dyad linearly over year_start..year_end (values at the ends are extended)
+    extrapolate : bool
+        Whether to fill the years from year_start to the first year of every dyad with its first value
+    members_only : bool
+        Whether to keep only the dyads of system members in the result (e.g. to remove years before independence after filling)
+    """
+    def __init__(self, name, ego_label, alter_label, year_label, value_label, title=None, numeric_type=None, filter_year_end=True, drop_zeros=True,
+                 logarithmic=False, rolling_window=5, normalize=True, interpolate=False, extrapolate=False, members_only=False):
+        self.name = name
+        self.ego_label = ego_label
+        self.alter_label = alter_label
+        self.year_label = year_label
+        self.value_label = value_label
+        self.title = title if title is not None else name
+        self.numeric_type = numeric_type
+        self.filter_year_end = filter_year_end
+        self.drop_zeros = drop_zeros
+        self.logarithmic = logarithmic
+        self.rolling_window = rolling_window
+        self.normalize = normalize
+        self.interpolate = interpolate
+        self.extrapolate = extrapolate
+        self.members_only = members_only
+
+    def __repr__(self):
+        repr = f'SourceSpec of {self.name}: {self.year_label}*{self.alter_label}*{self.ego_label} = {self.value_label}'
+        return repr
+
+    def get_params(self):
+        return dict(vars(self))
+
+    def replace(self, **params):
+        """Returns a copy of the spec with some parameters replaced, e.g. spec.replace(rolling_window=10)"""
+        return SourceSpec(**{**self.get_params(), **params})
+
+
+def get_source_key(df: pd.DataFrame, spec: SourceSpec, year_start: int, year_end: int, compact: bool = False, sparse: bool = False):
+    """Returns a hash identifying a preprocessing run by its raw data and parameters (see analysis.checkpoint.get_sweep_key)"""
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(json.dumps([spec.get_params(), year_start, year_end, compact, sparse], sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
+
+def sort_dyads(df_triple: pd.DataFrame):
+    """Sorts a year, alter, ego, value table by alter, ego and year
+
+    Return
+    -----------
+        df_triple : pd.DataFrame
+            Sorted table with a default index
+        dyads : np.ndarray
+            Dyad code of every row (rows of a dyad are consecutive)
+    """
+    alters = pd.factorize(df_triple['alter'], sort=True)[0]
+    egos, ego_index = pd.factorize(df_triple['ego'], sort=True)
+    order = np.lexsort((df_triple['year'].to_numpy(), egos, alters))
+    dyads = alters[order].astype(np.int64) * len(ego_index) + egos[order]
+    return df_triple.iloc[order].reset_index(drop=True), dyads
+
+def get_rolling_mean(values: np.ndarray, dyads: np.ndarray, window: int):
+    """Rolling mean over the consecutive rows of every dyad, the same as groupby(dyad).rolling(window, min_periods=1).mean()
+
+    Rows should be sorted by dyad and year (see sort_dyads). The window is summed as shifted copies of the values,
+    so it takes window vectorized additions whatever the number of dyads."""
+    n = len(values)
+    starts = np.r_[True, dyads[1:] != dyads[:-1]] if n > 0 else np.zeros(0, dtype=bool)
+    positions = np.arange(n) - np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+    total = values.astype(float)
+    for shift in range(1, window):
+        rows = np.nonzero(positions >= shift)[0]
+        total[rows] += values[rows - shift]
+    return total / np.minimum(positions + 1, window)
+
+def _interpolate_years(df_triple, year_start, year_end):
+    """Interpolates every dyad over year_start..year_end linearly, values at the ends are extended"""
+    wide = df_triple.pivot(index=['alter', 'ego'], columns='year', values='value')
+    wide = wide.reindex(columns=range(year_start, year_end+1)).interpolate(axis=1, limit_direction='both')
+    return wide.stack(future_stack=True).rename('value').reset_index()[TRIPLE_LABELS + ['value']]
+
+def _extrapolate_years(df_triple, dyads, year_start):
+    """Fills years from year_start to the first year of every dyad with its first value (rows sorted by sort_dyads)"""
+    firsts = np.nonzero(np.r_[True, dyads[1:] != dyads[:-1]])[0] if len(dyads) > 0 else np.zeros(0, dtype=int)
+    missing = np.maximum(df_triple['year'].to_numpy()[firsts] - year_start, 0)
+    rows = np.repeat(firsts, missing)
+    added = df_triple.iloc[rows].reset_index(drop=True)
+    added['year'] = year_start + np.arange(len(rows)) - np.repeat(np.cumsum(missing) - missing, missing)
+    return pd.concat([added, df_triple], ignore_index=True)
+
+def preprocess_source(df: pd.DataFrame, spec: SourceSpec, year_start: int, year_end: int, test_data: bool = True, cache_dir: str = None, compact: bool = False, sparse: bool = False):
+    """Preprocesses a dyadic source described by spec
+
+    Years are filtered, country ids are converted to STATE_en_UN (rows with unknown ids are dropped), values are summed by year and dyad
+    and tested (see utils.utils.test_df), then the table is padded with zeroes for dyads of system members,
+    averaged with a rolling mean by dyad, interpolated, extrapolated and restricted to system members if the spec says so, and normalized.
+    Seconds spent by stage are logged and kept in PREPROCESSING_TIMINGS.
+
+    Parameters
+    ------------
+        df: pd.DataFrame
+            Raw data with the columns of the spec
+        spec: SourceSpec
+            Source description
+        year_start: int
+            First year
+        year_end: int
+            Last year (data after it is kept if not spec.filter_year_end)
+        test_data: bool
+            Whether to test the data. Default: True
+        cache_dir: str or None
+            Directory of cached results (Parquet files), a run with the same data and parameters is read from it. Default: None (no cache)
+        compact: bool
+            Whether to use compact dtypes from the conversion on: countries as the shared categorical, int16 years and float32 values
+            (see utils.utils.to_compact_triple). Default: False
+        sparse: bool
+            Whether to return a data_handling.sparsetriple.SparseTriple: the table is not padded, only nonzero values are kept
+            and rolled over the membership mask (the same values as the dense table). Not supported with interpolation and extrapolation. Default: False
+    Return
+    -----------
+        df : pd.DataFrame
+            Filtered raw data with converted country ids
+        df_triple : pd.DataFrame or SparseTriple
+            Preprocessed year*alter*ego table with the value column (nonzero values only if sparse)
+    """
+    if sparse and (spec.interpolate or spec.extrapolate):
+        raise NotImplementedError(f"Sparse preprocessing of {spec.name} with interpolation or extrapolation")
+    logging.info(f"Preprocessing {spec.name} data")
+    timings = dict()
+    started = time.perf_counter()
+    def lap(stage):
+        nonlocal started
+        now = time.perf_counter()
+        timings[stage] = now - started
+        started = now
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f'{spec.name}_{get_source_key(df, spec, year_start, year_end, compact, sparse)}')
+        cached = _read_cache(cache_path, sparse)
+        if cached is not None:
+            cached_df, observed, df_triple = cached
+            if test_data:
+                test_df(observed, spec.name, year_start=year_start, year_end=year_end)
+            logging.info(f"Read preprocessed {spec.title} from {cache_path}")
+            return cached_df, df_triple
+
+    years = df[spec.year_label].astype(int)
+    in_years = years >= year_start
+    if spec.filter_year_end:
+        in_years &= years <= year_end
+    df = df[in_years].assign(**{spec.year_label: years[in_years].astype(COMPACT_YEAR_DTYPE) if compact else years[in_years]})
+    df, purge_mask = convert_country_columns(df, [spec.alter_label, spec.ego_label], standard_to_convert='STATE_en_UN', numeric_type=spec.numeric_type, compact=compact)
+    df = df[~purge_mask]
+    country_dtype = df[spec.alter_label].dtype if compact else None
+    lap('convert')
+
+    observed = df.groupby([spec.year_label, spec.alter_label, spec.ego_label], observed=True)[spec.value_label].sum()
+    if spec.drop_zeros:
+        observed = observed[observed != 0]
+    observed = observed.rename_axis(TRIPLE_LABELS).rename('value').reset_index()
+    if test_data:
+        test_df(observed, spec.name, year_start=year_start, year_end=year_end)
+    lap('aggregate')
+
+    df_triple = observed
+    if spec.logarithmic:
+        logging.info(f"Converting {spec.name} to log 10 scale")
+        df_triple = df_triple.assign(value=np.log10(df_triple['value']))
+    if sparse:
+        df_triple = _preprocess_sparse(df_triple, spec, int(df[spec.year_label].min()), int(df[spec.year_label].max()), lap)
+        return _finish_source(df, observed, df_triple, spec, cache_dir, cache_path, timings)
+    # filling an empty year*country*country table with zeroes, dyads of the data which are not system members are kept
+    padding = get_system_members(int(df[spec.year_label].min()), int(df[spec.year_label].max()))[TRIPLE_LABELS].assign(value=0.0)
+    if compact:
+        padding = to_compact_triple(padding, country_dtype=country_dtype)
+    df_triple = pd.concat([df_triple, padding], ignore_index=True).drop_duplicates(TRIPLE_LABELS, keep='first')
+    df_triple, dyads = sort_dyads(df_triple)
+    lap('pad')
+
+    df_triple['value'] = get_rolling_mean(df_triple['value'].to_numpy(dtype=float), dyads, spec.rolling_window)
+    lap('rolling')
+
+    if spec.interpolate:
+        logging.info(f"Interpolating {spec.name} over {year_start} - {year_end}")
+        df_triple = _interpolate_years(df_triple, year_start, year_end)
+    elif spec.extrapolate:
+        logging.info(f"Extrapolating {spec.name} to {year_start}")
+        df_triple = _extrapolate_years(df_triple, dyads, year_start)
+    if spec.members_only:
+        members = get_system_members(int(df_triple['year'].min()), int(df_triple['year'].max()))[TRIPLE_LABELS]
+        if compact:
+            members = to_compact_triple(members, country_dtype=country_dtype)
+        df_triple = members.merge(df_triple, on=TRIPLE_LABELS, how='left').fillna({'value': 0})
+    lap('extend')
+
+    if spec.normalize:
+        df_triple['value'] = df_triple['value'] / df_triple['value'].max()
+    if compact:
+        df_triple = to_compact_triple(df_triple, country_dtype=country_dtype)
+    df_triple = df_triple.set_index(TRIPLE_LABELS)
+    lap('normalize')
+    return _finish_source(df, observed, df_triple, spec, cache_dir, cache_path, timings)
+
+def _preprocess_sparse(df_triple, spec, year_start, year_end, lap):
+    """Sparse stages of preprocess_source: values are kept without padding, rolled over the membership mask of year_start..year_end"""
+    from data_handling.sparsetriple import SparseTriple
+    triple = SparseTriple.from_frame(df_triple, year_start, year_end)
+    lap('pad')
+    triple = triple.rolling_mean(spec.rolling_window)
+    lap('rolling')
+    if spec.members_only:
+        triple = triple.members_only()
+    lap('extend')
+    if spec.normalize:
+        triple = triple.normalize()
+    lap('normalize')
+    return triple
+
+def _read_cache(cache_path, sparse):
+    """Returns (df, observed, df_triple) of a cached preprocess_source run, None if there is no cache (or it cannot be read)"""
+    if not os.path.isdir(cache_path):
+        return None
+    try:
+        df = pd.read_parquet(os.path.join(cache_path, 'df.parquet'))
+        observed = pd.read_parquet(os.path.join(cache_path, 'observed.parquet'))
+        if sparse:
+            from data_handling.sparsetriple import SparseTriple
+            df_triple = SparseTriple.read_parquet(os.path.join(cache_path, 'df_triple'))
+        else:
+            df_triple = pd.read_parquet(os.path.join(cache_path, 'df_triple.parquet'))
+    except Exception as e:
+        logging.warning(f"Cannot read cache {cache_path} ({e}), preprocessing again")
+        return None
+    return df, observed, df_triple
+
+def _write_cache(cache_path, df, observed, df_triple):
+    """Saves a preprocess_source run as a directory of Parquet files (df, observed and df_triple), written to a temporary directory and moved into place"""
+    temp_path = f'{cache_path}.tmp{os.getpid()}'
+    try:
+        os.makedirs(temp_path, exist_ok=True)
+        df.to_parquet(os.path.join(temp_path, 'df.parquet'))
+        observed.to_parquet(os.path.join(temp_path, 'observed.parquet'), index=False)
+        if isinstance(df_triple, pd.DataFrame):
+            df_triple.to_parquet(os.path.join(temp_path, 'df_triple.parquet'))
+        else:
+            df_triple.to_parquet(os.path.join(temp_path, 'df_triple'))
+        os.replace(temp_path, cache_path)
+    except (ValueError, TypeError, OSError) as e:
+        # raw data with mixed-type columns cannot be saved to Parquet, and a concurrent run may have written the cache first
+        logging.warning(f"Cannot write cache {cache_path} ({e})")
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+def _finish_source(df, observed, df_triple, spec, cache_dir, cache_path, timings):
+    """Caches the result of preprocess_source and logs the timings"""
+    if cache_path is not None:
+        _write_cache(cache_path, df, observed, df_triple)
+
+    timings['total'] = sum(timings.values())
+    PREPROCESSING_TIMINGS[spec.name] = timings
+    logging.info(f"Done preprocessing {spec.title} in {timings['total']:.2f} s ({', '.join(f'{stage} {seconds:.2f} s' for stage, seconds in timings.items() if stage != 'total')})")
+    return df, df_triple
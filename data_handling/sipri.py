@@ -1,4 +1,3 @@
-import sipri # pip install sipri
 import pandas as pd
 import logging
 from itertools import product, combinations
@@ -7,17 +6,15 @@ import sys
 sys.path.append("..")
 
 from utils.utils import get_all_countries, get_empty_country_df, get_system_members, test_df, GREAT_POWERS
-from analysis.network_analysis import get_networks
-from analysis.community import detect_local_communities
-from analysis.hegemony import get_hegemony_scores, get_hegemony_top, visualize_hegemony
-from utils.countryconverter import convert_country_df
-from data_handling import gsheet_handler
+from utils.countryconverter import convert_country_columns
+from data_handling.sparsetriple import SparseTriple
 
 
 SIPRI_PATH="../data/raw/arms/sipri_arms_transfer_dyad_backup.csv"
 
 def load_sipri():
     """Loads SIPRI Arms transfer data (last: 2022)"""
+    #import sipri # pip install sipri
     #data = sipri.sipri_data(low_year='1985',high_year='2022',seller='',buyer='',armanent_category='any',buyers_or_sellers='',filetype='csv',include_open_deals='on',sum_deliveries='on')
     #df = pd.read_csv(StringIO(data),keep_default_na=False,na_values=['None'])
     #df.to_csv("sipri_arms_transfer_dyad.csv")
@@ -26,7 +23,7 @@ def load_sipri():
     return df
 
 
-def preprocess_sipri(df, rolling_window=5, year_start=1992, year_end = 2022, country_df=None, test_data=True):
+def preprocess_sipri(df, rolling_window=5, year_start=1992, year_end = 2022, country_df=None, test_data=True, sparse=False):
     """Preprocessing SIPRI Arms Transfer Data:
         - removing rebel groups and international organizations
         - removing unknown recipients and suppliers
@@ -40,11 +37,14 @@ def preprocess_sipri(df, rolling_window=5, year_start=1992, year_end = 2022, cou
             Rolling window to use for smoothing the data
         year_start: int
             Year to start with (needed for correct rolling calculations)
+        sparse: bool
+            Whether to return a SparseTriple of the nonzero values instead of the zero-padded table (see data_handling.sparsetriple)
     Return
     -----------
         tuple(df , triple_df)
             df : pd.DataFramme() - preprocessed df with SIPRI Arms Transfer Data,
             triple_df  : pd.DataFramme() - DataFrame containing information about Arms Transfer in triple format (year*country*country). 
+                A SparseTriple if sparse
     """
     source_name = preprocess_sipri.__name__.split('_')[1]
     
@@ -53,7 +53,9 @@ def preprocess_sipri(df, rolling_window=5, year_start=1992, year_end = 2022, cou
     YEAR_LABEL = 'odat'
     VALUE_LABEL = 'tivorder'
     
-    if country_df is None: country_df = gsheet_handler.read_gsheet(tablename='country_data', sheetname='countryids', skiprows=0)['state_en_un'].dropna()
+    if country_df is None:
+        from data_handling import gsheet_handler
+        country_df = gsheet_handler.read_gsheet(tablename='country_data', sheetname='countryids', skiprows=0)['state_en_un'].dropna()
     
     logging.info("Preprocessing SIPRI Arms Transfer Data")
     df.drop(df.shape[0]-1, inplace=True)
@@ -71,8 +73,8 @@ def preprocess_sipri(df, rolling_window=5, year_start=1992, year_end = 2022, cou
     df = df[df[YEAR_LABEL] >= year_start]
 
     #converting to STATE_en_UN (can do Alpha3_Code)
-    df = convert_country_df(df, ALTER_LABEL, standard_to_convert='STATE_en_UN', purge=True, print_convertions=False)
-    df = convert_country_df(df, EGO_LABEL, standard_to_convert='STATE_en_UN', purge=True, print_convertions=False)
+    df, purge_mask = convert_country_columns(df, [ALTER_LABEL, EGO_LABEL], standard_to_convert='STATE_en_UN')
+    df = df[~purge_mask]
 
     df_triple = df.groupby([YEAR_LABEL, ALTER_LABEL, EGO_LABEL]).sum()
 
@@ -86,6 +88,11 @@ def preprocess_sipri(df, rolling_window=5, year_start=1992, year_end = 2022, cou
     
     df_triple = pd.DataFrame(df_triple[VALUE_LABEL])
     
+    if sparse:
+        triple = SparseTriple.from_frame(df_triple.rename_axis(['year', 'alter', 'ego']), int(df[YEAR_LABEL].min()), int(df[YEAR_LABEL].max()), value=VALUE_LABEL)
+        triple = triple.rolling_mean(rolling_window).normalize()
+        logging.info(f"Done preprocessing SIPRI Arms Transfer Data: {triple}")
+        return df, triple
   
     # filling an empty year*country*country dataframe with zeroes
     #options = product(df['odat'].unique(),countries_all, countries_all)
@@ -112,7 +119,11 @@ def preprocess_sipri(df, rolling_window=5, year_start=1992, year_end = 2022, cou
 
 
     
-def sipri_main(year_start=1992, rolling_window=5, res_range_start=2, res_range_end=20, one_year_hegemony_threshold=5, min_clients_for_top=3, centrality_threshold=0.5, community_detection='louvian'):
+def sipri_main(year_start=1992, rolling_window=5, res_range_start=2, res_range_end=20, one_year_hegemony_threshold=5, min_clients_for_top=3, centrality_threshold=0.5, community_detection='louvian', checkpoint_dir=None):
+    # analysis (networkx, plotting) is imported on first run, importing the source module stays light
+    from analysis.network_analysis import get_networks
+    from analysis.community import detect_local_communities
+    from analysis.hegemony import get_hegemony_scores, get_hegemony_top, visualize_hegemony
     comm_name = 'weapon_trade'
     
     df = load_sipri()  # Loading the data
@@ -122,7 +133,7 @@ def sipri_main(year_start=1992, rolling_window=5, res_range_start=2, res_range_e
     networks = get_networks(df_triple, countries_all, year_start, year_end)  # getting netowrks
     resolution_range = list(map(lambda x: x/10, list(range(res_range_start, res_range_end))))
     logging.debug(f"Resolution range is {resolution_range}")
-    communities = detect_local_communities(networks, df_triple, countries_all, year_start, year_end, resolution_range, centrality_threshold=centrality_threshold, community_detection=community_detection)
+    communities = detect_local_communities(networks, df_triple, countries_all, year_start, year_end, resolution_range, centrality_threshold=centrality_threshold, community_detection=community_detection, checkpoint_dir=checkpoint_dir)
     hegemony_df = get_hegemony_scores(communities, resolution_range, year_start, year_end, countries_all, comm_name=comm_name)
     all_time_threshold = (year_end - year_start) * min_clients_for_top
     hegemony_top = get_hegemony_top(hegemony_df, comm_name, one_year_threshold=one_year_hegemony_threshold, all_time_threshold=all_time_threshold)
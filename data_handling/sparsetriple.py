@@ -0,0 +1,192 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+
+import sys
+sys.path.append("..")
+
+from utils.utils import get_system_member_mask, get_country_index, to_compact_triple
+from data_handling.preprocessing import get_rolling_mean, TRIPLE_LABELS
+
+
+class SparseTriple():
+    """
+    Sparse (COO) year*alter*ego table of a dyadic source: only the nonzero values are kept, with system membership as a mask.
+
+    ...
+
+    Attributes
+    ----------
+    years : range
+        Years of the table
+    country_index : pd.Index
+        Countries of the codes (system members of the period and countries of the data)
+    members : np.ndarray
+        Boolean mask [year, country] of system members. Dyads between members of a year are the zero-padded grid of the dense tables
+        (see utils.utils.get_empty_country_df), they are not stored
+    year_codes : np.ndarray
+        Year position of every value
+    alter_codes : np.ndarray
+        Alter code of every value
+    ego_codes : np.ndarray
+        Ego code of every value
+    values : np.ndarray
+        Nonzero values, sorted by alter, ego and year
+
+    Memory and the rolling mean scale with the number of nonzero values (and their dyads), not with the number of countries squared.
+    The table is densified on demand with to_frame(nonzero=False) or to_array().
+    """
+    def __init__(self, years, country_index, members, year_codes, alter_codes, ego_codes, values):
+        self.years = years
+        self.country_index = country_index
+        self.members = members
+        values = np.asarray(values)
+        nonzero = (values != 0) & ~np.isnan(values)
+        order = np.lexsort((year_codes[nonzero], ego_codes[nonzero], alter_codes[nonzero]))
+        self.year_codes = np.asarray(year_codes)[nonzero][order]
+        self.alter_codes = np.asarray(alter_codes)[nonzero][order]
+        self.ego_codes = np.asarray(ego_codes)[nonzero][order]
+        self.values = values[nonzero][order]
+
+    def __repr__(self):
+        repr = f'SparseTriple ({self.years.start} - {self.years.stop - 1}): {len(self.values)} nonzero values, {len(self.country_index)} countries'
+        return repr
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def from_frame(cls, df_triple: pd.DataFrame, year_start: int = None, year_end: int = None, members=None, value: str = 'value'):
+        """Returns the nonzero values of a year*alter*ego table as a SparseTriple
+
+        Parameters
+        ------------
+            df_triple: pd.DataFrame
+                Table with year, alter and ego (index levels or columns) and the value column, zeroes and NaN are dropped
+            year_start: int or None
+                First year, the first year of the data if None
+            year_end: int or None
+                Last year, the last year of the data if None
+            members: tuple or None
+                (country_index, mask [year, country]) of the grid, system membership of the years if None (see utils.utils.get_system_member_mask)
+            value: str
+                Value column. Default: 'value'
+        Return
+        -----------
+            triple : SparseTriple
+        """
+        df = df_triple.reset_index() if 'year' not in df_triple.columns else df_triple
+        df = df[df[value].notna() & (df[value] != 0)]
+        years = df['year'].to_numpy(dtype=int)
+        year_start = int(years.min()) if year_start is None else year_start
+        year_end = int(years.max()) if year_end is None else year_end
+        in_years = (years >= year_start) & (years <= year_end)
+        if not in_years.all():
+            logging.warning(f"Dropping {(~in_years).sum()} values outside of {year_start} - {year_end}")
+            df, years = df[in_years], years[in_years]
+        alters = df['alter'].to_numpy(dtype=object)
+        egos = df['ego'].to_numpy(dtype=object)
+        member_index, member_mask = get_system_member_mask(year_start, year_end) if members is None else members
+        # countries of the data outside of the membership are kept (as the dense tables keep them), they are never members
+        country_index = member_index
+        if not (country_index.get_indexer(alters) >= 0).all() or not (country_index.get_indexer(egos) >= 0).all():
+            country_index = get_country_index(list(member_index) + list(alters) + list(egos))
+        mask = np.zeros((year_end - year_start + 1, len(country_index)), dtype=bool)
+        mask[:, country_index.get_indexer(member_index)] = member_mask
+        return cls(range(year_start, year_end + 1), country_index, mask, years - year_start,
+                   country_index.get_indexer(alters), country_index.get_indexer(egos), df[value].to_numpy(dtype=float))
+
+    def _replace_values(self, year_codes, alter_codes, ego_codes, values):
+        return SparseTriple(self.years, self.country_index, self.members, year_codes, alter_codes, ego_codes, values)
+
+    def get_grid(self, alter_codes, ego_codes):
+        """Returns the boolean grid [dyad, year] of dyads: years both countries are members or the dyad has a value"""
+        grid = self.members[:, alter_codes].T & self.members[:, ego_codes].T & (alter_codes != ego_codes)[:, None]
+        dyads = np.searchsorted(alter_codes.astype(np.int64) * len(self.country_index) + ego_codes, self.alter_codes.astype(np.int64) * len(self.country_index) + self.ego_codes)
+        known = dyads < len(alter_codes)
+        known[known] = (alter_codes[dyads[known]] == self.alter_codes[known]) & (ego_codes[dyads[known]] == self.ego_codes[known])
+        grid[dyads[known], self.year_codes[known]] = True
+        return grid
+
+    def rolling_mean(self, window: int):
+        """Rolling mean over the years of every dyad, the same as the rolling mean of the zero-padded dense table
+        (groupby(dyad).rolling(window, min_periods=1).mean() over the rows of the grid, see data_handling.preprocessing.get_rolling_mean).
+
+        Only dyads with values are expanded over the years, sums and row counts of the window are exact."""
+        codes, first = np.unique(self.alter_codes.astype(np.int64) * len(self.country_index) + self.ego_codes, return_index=True)
+        alter_codes, ego_codes = self.alter_codes[first], self.ego_codes[first]
+        dyads = np.repeat(np.arange(len(codes)), np.diff(np.r_[first, len(self.values)]))
+        grid = self.get_grid(alter_codes, ego_codes)
+        series = np.zeros(grid.shape)
+        series[dyads, self.year_codes] = self.values
+        rows, year_codes = np.nonzero(grid)
+        values = get_rolling_mean(series[rows, year_codes], rows, window)
+        return self._replace_values(year_codes, alter_codes[rows], ego_codes[rows], values)
+
+    def normalize(self):
+        """Returns the table divided by the maximum value"""
+        return self._replace_values(self.year_codes, self.alter_codes, self.ego_codes, self.values / self.values.max())
+
+    def members_only(self):
+        """Returns the values of dyads between system members of the year"""
+        member = self.members[self.year_codes, self.alter_codes] & self.members[self.year_codes, self.ego_codes]
+        return self._replace_values(self.year_codes[member], self.alter_codes[member], self.ego_codes[member], self.values[member])
+
+    def filter_dyads(self, mask: np.ndarray):
+        """Returns the values where mask (boolean array over the values) is True"""
+        return self._replace_values(self.year_codes[mask], self.alter_codes[mask], self.ego_codes[mask], self.values[mask])
+
+    def to_frame(self, nonzero: bool = True, compact: bool = False):
+        """Returns the table as a year*alter*ego table with the value column (as returned by preprocessing, see analysis.network_analysis.get_networks)
+
+        If not nonzero, the table is densified to the zero-padded grid: dyads between members of every year and dyads with values.
+        If compact, countries are the shared categorical, years int16 and values float32 (see utils.utils.to_compact_triple)"""
+        year_codes, alter_codes, ego_codes, values = self.year_codes, self.alter_codes, self.ego_codes, self.values
+        if not nonzero:
+            grid_years, grid_alters, grid_egos = np.nonzero(self.members[:, :, None] & self.members[:, None, :] & ~np.eye(len(self.country_index), dtype=bool))
+            n = len(self.country_index)
+            keys = (year_codes.astype(np.int64) * n + alter_codes) * n + ego_codes
+            grid_keys = (grid_years.astype(np.int64) * n + grid_alters) * n + grid_egos
+            padding = ~np.isin(grid_keys, keys)
+            year_codes = np.concatenate([year_codes, grid_years[padding]])
+            alter_codes = np.concatenate([alter_codes, grid_alters[padding]])
+            ego_codes = np.concatenate([ego_codes, grid_egos[padding]])
+            values = np.concatenate([values, np.zeros(padding.sum())])
+        df_triple = pd.DataFrame({
+            'year': np.asarray(self.years)[year_codes],
+            'alter': self.country_index[alter_codes],
+            'ego': self.country_index[ego_codes],
+            'value': values,
+        })
+        if compact:
+            df_triple = to_compact_triple(df_triple)
+        return df_triple.set_index(TRIPLE_LABELS).sort_index()
+
+    def to_array(self, dtype=float):
+        """Returns the table as a dense array [year, ego, alter] over country_index (as analysis.hegemony and data_handling.dyadstore.DyadStore)"""
+        array = np.zeros((len(self.years), len(self.country_index), len(self.country_index)), dtype=dtype)
+        array[self.year_codes, self.ego_codes, self.alter_codes] = self.values
+        return array
+
+    def to_parquet(self, path: str):
+        """Saves the table to a directory of Parquet files: values.parquet (countries as categoricals keeping the country index)
+        and members.parquet (the membership mask, years by rows and countries by columns)"""
+        os.makedirs(path, exist_ok=True)
+        pd.DataFrame({
+            'year': np.asarray(self.years)[self.year_codes],
+            'alter': pd.Categorical.from_codes(self.alter_codes, categories=self.country_index),
+            'ego': pd.Categorical.from_codes(self.ego_codes, categories=self.country_index),
+            'value': self.values,
+        }).to_parquet(os.path.join(path, 'values.parquet'), index=False)
+        pd.DataFrame(self.members, index=pd.Index(self.years, name='year'), columns=list(self.country_index)).to_parquet(os.path.join(path, 'members.parquet'))
+
+    @classmethod
+    def read_parquet(cls, path: str):
+        """Loads a table saved with to_parquet"""
+        members = pd.read_parquet(os.path.join(path, 'members.parquet'))
+        values = pd.read_parquet(os.path.join(path, 'values.parquet'))
+        country_index = pd.Index(members.columns, name='country')
+        years = range(int(members.index[0]), int(members.index[-1]) + 1)
+        return cls(years, country_index, members.to_numpy(dtype=bool), values['year'].to_numpy(dtype=int) - years.start,
+                   country_index.get_indexer(values['alter'].astype(object)), country_index.get_indexer(values['ego'].astype(object)), values['value'].to_numpy(dtype=float))
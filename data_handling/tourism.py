@@ -7,7 +7,7 @@ import sys
 sys.path.append("..")
 
 from utils.utils import get_all_countries, get_empty_country_df, test_df
-from utils.countryconverter import convert_country_df
+from utils.countryconverter import convert_country_df, convert_country_columns
 
 
 tourism_PATH = "../data/raw/tourism/unwto-all-data-download_2022.xlsx"
@@ -79,8 +79,8 @@ def preprocess_tourism(df, year_start=1985, year_end=2022, rolling_window=5, nor
     df = df[df[YEAR_LABEL].astype(int) >= year_start]
     df = df[df[YEAR_LABEL].astype(int) <= year_end]
     
-    df = convert_country_df(df, ALTER_LABEL, standard_to_convert='STATE_en_UN', purge=True)
-    df = convert_country_df(df, EGO_LABEL, standard_to_convert='STATE_en_UN', purge=True)
+    df, purge_mask = convert_country_columns(df, [ALTER_LABEL, EGO_LABEL], standard_to_convert='STATE_en_UN')
+    df = df[~purge_mask]
     
     countries_all = get_all_countries()
     df_triple = df.groupby([YEAR_LABEL, ALTER_LABEL, EGO_LABEL]).sum()
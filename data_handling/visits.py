@@ -5,8 +5,7 @@ from os import listdir
 import sys
 sys.path.append("..")
 
-from utils.utils import get_all_countries, get_empty_country_df, test_df
-from utils.countryconverter import convert_country_df
+from data_handling.preprocessing import SourceSpec, preprocess_source
 
 
 visits_PATH = "../data/raw/visits/Diplometrics_COLT_Travel_Dataset_Primary-HOGS-1990-2024_20250317.xlsx"
@@ -41,48 +40,9 @@ def load_visits():
     logging.info("Loaded Visits COLT Database")
     return df
 
-def preprocess_visits(df, year_start=1985, year_end=2022, rolling_window=5, test_data=True, normalize=True):
-    #def preprocessed_visits(df, year_start, rolling_window=5):
-    logging.info("Preprocessing visits data")  # basic preprocessing already done
-    source_name = preprocess_visits.__name__.split('_')[1]
-    
-    EGO_LABEL = 'CountryVisitedISO'
-    ALTER_LABEL = 'LeaderCountryISO'
-    YEAR_LABEL = 'TripYear'
-    VALUE_LABEL = 'value'
-    #removing old data
-    df = df[df[YEAR_LABEL].astype(int) >= year_start]
-    
-    df = convert_country_df(df, EGO_LABEL, standard_to_convert='STATE_en_UN', purge=True)
-    df = convert_country_df(df, ALTER_LABEL, standard_to_convert='STATE_en_UN', purge=True)
-    
-    countries_all = get_all_countries()
-    df_triple = df.groupby([YEAR_LABEL, EGO_LABEL, ALTER_LABEL]).sum()
-    df_triple = df_triple[df_triple[VALUE_LABEL]!=0]
-    
-    df_triple = pd.DataFrame(df_triple[VALUE_LABEL])
-    
-    if test_data:
-        test_df(df_triple.reset_index(), source_name, year_start=year_start, year_end=year_end, alter_label=ALTER_LABEL, ego_label=EGO_LABEL, year_label=YEAR_LABEL, value_label=VALUE_LABEL) 
-        
-    # filling an empty year*country*country dataframe with zeroes
-    
-    empty_df=get_empty_country_df(years=df[YEAR_LABEL].unique(), countries_all=countries_all, names=[YEAR_LABEL, EGO_LABEL, ALTER_LABEL])
+VISITS_SPEC = SourceSpec('visits', ego_label='CountryVisitedISO', alter_label='LeaderCountryISO', year_label='TripYear', value_label='value',
+                         title='visits data (COLT)', filter_year_end=False)
 
-    # merging the df with zero df
-    df_triple = empty_df.merge(df_triple,left_index=True, right_index=True, how='outer').fillna(0)
-    
-    # counting rolling average
-    df_triple = df_triple.reset_index().set_index(YEAR_LABEL).groupby([ALTER_LABEL, EGO_LABEL]).rolling(rolling_window, min_periods=1).mean()
-    
-    df_triple = df_triple.reset_index().set_index([YEAR_LABEL, ALTER_LABEL, EGO_LABEL])
-    
-    df_triple.index.names = ['year', 'alter', 'ego']
-    df_triple = df_triple.rename({VALUE_LABEL:'value'}, axis=1)
-    
-    # Normalization
-    if normalize:
-        df_triple['value'] = df_triple['value'] / df_triple['value'].max()
-    
-    logging.info("Done preprocessing visits data (COLT)")
-    return df, df_triple
\ No newline at end of file
+def preprocess_visits(df, year_start=1985, year_end=2022, rolling_window=5, test_data=True, normalize=True, cache_dir=None, compact=False):
+    """Preprocesses visits data, see data_handling.preprocessing.preprocess_source"""
+    return preprocess_source(df, VISITS_SPEC.replace(rolling_window=rolling_window, normalize=normalize), year_start, year_end, test_data=test_data, cache_dir=cache_dir, compact=compact)
@@ -5,6 +5,7 @@ from utils.countrymerger import *
 import pandas as pd
 import numpy as np
 import warnings
+from functools import lru_cache
 
 def swap_country_id(country_tag, id_to_replace, id_to_be_replaced_with):
     if str(country_tag) != str(id_to_replace):
@@ -13,7 +14,7 @@ def swap_country_id(country_tag, id_to_replace, id_to_be_replaced_with):
         return country_tag
     return str(id_to_be_replaced_with)
 
-def convert_country_df(data: pd.DataFrame, data_id_col: str, separator: str = None, standard_to_convert: str = "STATE_en_UN", warning = True, replace_missing=None, purge=False, numeric_type=None, print_convertions=True):
+def convert_country_df(data: pd.DataFrame, data_id_col: str, separator: str = None, standard_to_convert: str = "STATE_en_UN", warning = True, replace_missing=None, purge=False, numeric_type=None, print_convertions=True, compact=False):
     """ Function to convert a series of country ids to a different standard
 
     ---
@@ -25,52 +26,118 @@ def convert_country_df(data: pd.DataFrame, data_id_col: str, separator: str = No
         warning (bool): issue warnings when unable to idntify country id.
         replace_missing (str or None): what to replace missing values with.
         purge (bool): whether to remove unidentified country ids. Only works if replace_missing is None.
+        compact (bool): whether to return the column as the shared categorical (see get_country_dtype). Default is False.
 
     ---
     Returns:
         converted_country_series (Pandas.Series): country_series in a new format
+    
+    To convert several columns at once, or to split cells with several ids, see convert_country_columns.
     """
     replacement_dict = get_id_dict(data[data_id_col], separator, standard_to_convert, warning, replace_missing=replace_missing, numeric_type=numeric_type)
-    data_replaced = data.copy()
-    for i in replacement_dict.items():
-        if print_convertions: print(i[0], i[1])
-        data_replaced[data_id_col] = data_replaced[data_id_col].apply(lambda x: swap_country_id(x, i[0], i[1]))#str(x).replace(str(i[0]),str(i[1])))
+    if print_convertions:
+        for i in replacement_dict.items(): print(i[0], i[1])
+    data_replaced = data.assign(**{data_id_col: swap_country_ids(data[data_id_col], replacement_dict)})
     if purge:
         data_replaced[data_id_col] = data_replaced[data_id_col].replace('None', np.nan)
         if replace_missing is not None:
             warnings.warn('replace_missing is not None, purging not supported')
         data_replaced=data_replaced.dropna(subset=[data_id_col])
+    if compact:
+        data_replaced[data_id_col] = compact_countries(data_replaced[data_id_col])
     return data_replaced
 
+def convert_country_columns(data: pd.DataFrame, columns: list, separator: str = None, standard_to_convert: str = "STATE_en_UN", warning = True, replace_missing=None, numeric_type=None, print_convertions=False, compact=False):
+    """ Converts country ids of several columns to a different standard with one shared dictionary
+
+    ---
+    Parameters:
+        data (Pandas.DataFrame): Data with country identifiers
+        columns (list of str or str) : Country id column names
+        separator (str): separator of country identifiers in a cell, cells with several ids are split into rows (see explode_country_column). Default is None (no splitting).
+        standard_to_convert (str): standard to convert to, see convert_country_df. Default is STATE_en_UN.
+        warning (bool): issue warnings when unable to idntify country id.
+        replace_missing (str or None): what to replace unidentified ids with, None marks them in purge_mask.
+        numeric_type (str or None): 'cow' or 'iso' for numeric ids, see get_id_dict.
+        print_convertions (bool): whether to print the dictionary. Default is False.
+        compact (bool): whether to return the columns as the shared categorical (see get_country_dtype), ids of purged rows become NaN. Default is False.
+
+    ---
+    Returns:
+        data_converted (Pandas.DataFrame): data with converted columns (other columns are not copied)
+        purge_mask (Pandas.Series): True for rows with an unidentified or missing id in any of the columns, drop them with data_converted[~purge_mask]
+    """
+    if isinstance(columns, str): columns = [columns]
+    if separator is not None:
+        for column in columns:
+            data = explode_country_column(data, column, separator)
+    replacement_dict = get_id_dict(pd.concat([data[column] for column in columns], ignore_index=True), None, standard_to_convert, warning, replace_missing=replace_missing, numeric_type=numeric_type)
+    if print_convertions:
+        for i in replacement_dict.items(): print(i[0], i[1])
+    converted = {column: swap_country_ids(data[column], replacement_dict) for column in columns}
+    purge_mask = np.zeros(len(data), dtype=bool)
+    for column in columns:
+        purge_mask |= (converted[column].isna() | (converted[column] == 'None')).to_numpy()
+    if compact:
+        converted = {column: converted[column].where(~purge_mask) for column in columns}
+        country_dtype = get_country_dtype(pd.unique(pd.concat(converted.values()).dropna()))
+        converted = {column: converted[column].astype(country_dtype) for column in columns}
+    return data.assign(**converted), pd.Series(purge_mask, index=data.index)
+
+def explode_country_column(data: pd.DataFrame, column: str, separator: str):
+    """Splits cells with several country ids joined by separator into rows (ids are stripped, other columns are repeated)"""
+    data = data.assign(**{column: data[column].str.split(separator)}).explode(column)
+    data[column] = data[column].str.strip()
+    return data
+
+def swap_country_ids(country_series: pd.Series, replacement_dict: dict):
+    """Replaces country ids of a series using a dict from get_id_dict (the vectorized swap_country_id)
+
+    Ids are matched as strings and replaced with the string of the new id, ids not in the dict are kept as is.
+    Only unique ids are looked up."""
+    # factorizing strings keeps 190 and 190.0 apart, as str() does in swap_country_id
+    codes, uniques = pd.factorize(country_series.astype(str))
+    # the last items are for missing values (code -1), they are kept as they are
+    found = np.array([country in replacement_dict for country in uniques] + [False])
+    replacements = np.array([str(replacement_dict[country]) if country in replacement_dict else None for country in uniques] + [None], dtype=object)
+    values = np.where(found[codes], replacements[codes], country_series.to_numpy(dtype=object))
+    return pd.Series(values, index=country_series.index, name=country_series.name)
+
+
+@lru_cache(maxsize=None)
+def _get_country_categories():
+    """Returns sorted STATE_en_UN names of the key table"""
+    countries = set(loadKeyDf(load_extra=True)['STATE_en_UN'].dropna().astype(str))
+    countries.add('State of Palestine')  # added to system membership by utils.utils.get_system_members
+    return tuple(sorted(countries))
+
+def get_country_dtype(countries=()):
+    """Returns the shared categorical dtype of country names: STATE_en_UN names of the key table (sorted), so codes are the same in every source
+
+    Countries which are not in the key table (e.g. kept unidentified ids) are appended after them with a warning"""
+    categories = _get_country_categories()
+    unseen = sorted(set(countries) - set(categories))
+    if len(unseen) > 0:
+        warnings.warn(f"Countries outside of the key table get codes after the shared ones: {unseen}")
+    return pd.CategoricalDtype(list(categories) + unseen)
+
+def compact_countries(country_series: pd.Series):
+    """Converts a series of country names to the shared categorical dtype (see get_country_dtype)"""
+    return country_series.astype(get_country_dtype(country_series.dropna().unique()))
+
 
 def get_id_set(country_series: pd.Series, separator: str = None):
     """Returns a set of countries from a series of country ids (possibly with separators)
     """
-    def _add_to_country_list(country_list, country_ids, separator):
-        if pd.isna(country_ids): return None
-        country_ids = str(country_ids)
-        #print(country_ids)
-        if separator is None:
-            country_list += [country_ids]#.strip()]
-        elif separator in country_ids:
-            #print([country_id.strip() for country_id in country_ids.split(separator)])
-            #country_list += [country_id.strip() for country_id in country_ids.split(separator)]
-            country_list += [country_id for country_id in country_ids.split(separator)]
-        else:
-            #print(country_ids.strip())
-            country_list += [country_ids]#.strip()]
-    country_list = list()
-    country_series.apply(lambda x: _add_to_country_list(country_list, x, separator))
-    #print(country_list)
-    country_set = set(country_list)
+    country_series = country_series.dropna().astype(str)
+    if separator is not None:
+        country_series = country_series.str.split(separator).explode()
+    country_set = set(country_series)
     return country_set
 
-def get_id_dict(country_series: pd.Series, separator: str, standard_to_convert: str = "STATE_en_UN", warning = True, replace_missing='keep', numeric_type=None):
-    """Returns a dict of old country ids and new ones
-    from a series of country ids (possibly with separators)
-    """
-    country_set = get_id_set(country_series, separator)
-
+@lru_cache(maxsize=None)
+def _get_id_lookup(standard_to_convert: str = "STATE_en_UN", numeric_type=None):
+    """Returns converted ids by every lowercase string id of the key table (the first row with the id, as in a row-major search)"""
     keys_df = loadKeyDf(load_extra=True)
     if numeric_type == 'iso':
         keys_df = keys_df[[standard_to_convert, 'ISO_Code', 'ISO_GIS']]
@@ -82,22 +149,30 @@ def get_id_dict(country_series: pd.Series, separator: str, standard_to_convert:
     else:
         raise ValueError(f"Expected numeric_type to be None, 'cow' or 'iso', got {numeric_type} instead")
     converting_x = keys_df.columns.get_loc(standard_to_convert)
-    keys = keys_df.values
-    keys_lower = keys_df.applymap(lambda s: s.lower() if type(s) == str else s)
+    keys = keys_df.to_numpy(dtype=object)
+    rows, columns = np.nonzero(np.vectorize(lambda s: type(s) == str, otypes=[bool])(keys)) if keys.size > 0 else (np.array([], dtype=int),) * 2
+    long_df = pd.DataFrame({'id': [keys[row, column].lower() for row, column in zip(rows, columns)], 'row': rows})
+    long_df = long_df.drop_duplicates('id', keep='first')  # np.nonzero is row-major, the first occurrence is in the first row
+    return pd.Series(keys[long_df['row'].to_numpy(), converting_x], index=pd.Index(long_df['id'], dtype=object))
+
+def get_id_dict(country_series: pd.Series, separator: str, standard_to_convert: str = "STATE_en_UN", warning = True, replace_missing='keep', numeric_type=None):
+    """Returns a dict of old country ids and new ones
+    from a series of country ids (possibly with separators)
+    """
+    country_set = get_id_set(country_series, separator)
+    lookup = _get_id_lookup(standard_to_convert, numeric_type)
+    countries = sorted(country_set)
+    positions = lookup.index.get_indexer([country.lower().strip() for country in countries]) if len(countries) > 0 else np.array([], dtype=int)
     conversion_dict = {}
     
-    for country in country_set:
-        country_lower = country.lower()
-        try:
-            i = np.where(keys_lower == country_lower.strip())[0][0]
-            country_converted = keys[i, converting_x]
-            #print(country, country_converted)
-            conversion_dict[country] = country_converted
-        except IndexError:
+    for country, position in zip(countries, positions):
+        if position >= 0:
+            conversion_dict[country] = lookup.iloc[position]
+        else:
             if replace_missing == 'keep':
                 if warning: warnings.warn(f"Unknown identifier {country}, keeping as is")
                 conversion_dict[country] = country  # keeping country as is
             else:
                 if warning: warnings.warn(f"Unknown identifier {country}, replacing with {replace_missing}")
                 conversion_dict[country] = replace_missing
-    return conversion_dict
\ No newline at end of file
+    return conversion_dict
@@ -3,7 +3,10 @@
 # Version 1.2
 # Early Access
 
+import logging
+import numpy as np
 import pandas as pd
+from functools import lru_cache
 from urllib.error import URLError
 
 MIXED_STANDARDS = {
@@ -35,30 +38,125 @@ key_columns = ['STATE_ru', 'STATE_ru_alt','STATE_en_UN', 'STATE_en_WorldBank',
                    'COW_Country_Code','Alpha3_Code']
 
 # Загружает таблицу со значениями разнообразных ключей из гугл таблиц. Если нет интернета, то загружает локально
+# Таблица загружается один раз за сессию, вызывающим возвращается копия
 def loadKeyDf(load_extra=False):
+    return _loadKeyDfCached(load_extra).copy()
+
+@lru_cache(maxsize=None)
+def _loadKeyDfCached(load_extra=False):
     if load_extra:
         try:
             df = pd.read_csv(URL_TO_KEY_DF, dtype = {'ISO_Code': str, 'ISO_GIS': str})
             extra = pd.read_csv(URL_TO_EXTRA_DF)
         except URLError: #Failed to download online, trying locally
-            df = pd.read_csv(PATH_TO_KEY_DF, dtype = {'ISO_Code': str, 'ISO_GIS': str})
-            extra = pd.read_csv(PATH_TO_EXTRA_DF)
+            df = pd.read_csv(PATH_TO_KEY_DF_LOCAL, dtype = {'ISO_Code': str, 'ISO_GIS': str})
+            extra = pd.read_csv(PATH_TO_EXTRA_DF_LOCAL)
         df = pd.concat([df, extra])
     else:
         try:
             df = pd.read_csv(URL_TO_KEY_DF, dtype = {'ISO_Code': str, 'ISO_GIS': str})
         except URLError: #Failed to download online, trying locally
-            df = pd.read_csv(PATH_TO_KEY_DF, dtype = {'ISO_Code': str, 'ISO_GIS': str})
+            df = pd.read_csv(PATH_TO_KEY_DF_LOCAL, dtype = {'ISO_Code': str, 'ISO_GIS': str})
     return df
 
+
+class StandardIndex():
+    """
+    Membership index of country ids in the standards of key_df, for identifying the standard of a whole column at once.
+
+    ...
+
+    Attributes
+    ----------
+    standards : list
+        Standards (key_df columns) in the order of preference
+    masks : pd.Series
+        Bitmask of the standards every id belongs to (bit i is standards[i]), indexed by ids as strings
+    slave_ids : dict
+        Set of ids of every slave standard of MIXED_STANDARDS (compared as they are, not as strings)
+    """
+    def __init__(self, key_df: pd.DataFrame, standards: list = key_columns):
+        self.standards = [standard for standard in standards if standard in key_df.columns]
+        long_df = pd.DataFrame({
+            'id': np.concatenate([key_df[standard].values.astype(str) for standard in self.standards]),
+            'bit': np.repeat([1 << i for i in range(len(self.standards))], len(key_df)),
+        }).drop_duplicates()
+        self.masks = long_df.groupby('id')['bit'].sum()  # bits are distinct after drop_duplicates, so the sum is a bitwise or
+        self.slave_ids = {slave: set(key_df[slave])
+                          for mixed_standard in MIXED_STANDARDS.values() for slave in mixed_standard['slaves'] if slave in key_df.columns}
+
+    def __repr__(self):
+        repr = f'StandardIndex of {len(self.masks)} ids in {len(self.standards)} standards'
+        return repr
+
+    def _get_masks(self, ids):
+        return self.masks.reindex(ids.astype(str)).fillna(0).to_numpy(dtype=np.int64)
+
+    def get_scores(self, series: pd.Series):
+        """Returns the share of unique values of series found in every standard"""
+        ids = pd.Series(pd.unique(series))
+        masks = self._get_masks(ids)
+        scores = [np.mean((masks >> i) & 1) if len(ids) > 0 else 1.0 for i in range(len(self.standards))]
+        return pd.Series(scores, index=self.standards)
+
+    def identify(self, series: pd.Series):
+        """Returns the standard all values of series belong to
+
+        The first standard (in the order of standards) containing all values is returned. Otherwise, a mixed standard
+        (see MIXED_STANDARDS) is returned if every value is in its master or one of its slaves (the last such one in the order
+        of masters), 'unidentified' if none matches"""
+        ids = pd.Series(pd.unique(series))
+        masks = self._get_masks(ids)
+        common = np.bitwise_and.reduce(masks, initial=(1 << len(self.standards)) - 1)
+        for i, standard in enumerate(self.standards):
+            if common >> i & 1:
+                return standard
+        identification = 'unidentified'
+        for i, standard in enumerate(self.standards):
+            for mixed_standard, mixed in MIXED_STANDARDS.items():
+                if mixed['master'] != standard: continue
+                passing = ((masks >> i) & 1).astype(bool)
+                for slave in mixed['slaves']:
+                    if slave in self.slave_ids: passing |= np.fromiter((country in self.slave_ids[slave] for country in ids), dtype=bool, count=len(ids))
+                if passing.all():
+                    identification = mixed_standard
+        return identification
+
+@lru_cache(maxsize=None)
+def getStandardIndex(load_extra=False):
+    """Returns the StandardIndex of the key table, built once per session"""
+    return StandardIndex(_loadKeyDfCached(load_extra))
+
+@lru_cache(maxsize=None)
+def getAliasRows(load_extra=False):
+    """Returns the flattened key table: row position of every id (of any standard) in the key table, indexed by the ids
+
+    An id found in several rows refers to the first of them"""
+    key_df = _loadKeyDfCached(load_extra)
+    long_df = pd.DataFrame({
+        'id': key_df.to_numpy(dtype=object).ravel(),
+        'row': np.repeat(np.arange(len(key_df)), key_df.shape[1]),
+    })
+    long_df = long_df[long_df['id'].notna()].drop_duplicates('id', keep='first')
+    return pd.Series(long_df['row'].to_numpy(), index=pd.Index(long_df['id'], dtype=object))
+
+# Для каждого значения series возвращает позицию строки в key_df (-1 для неузнанных), сравнивая только уникальные значения
+def _getAliasPositions(series, load_extra=False):
+    codes, uniques = pd.factorize(pd.Series(series), use_na_sentinel=True)
+    unique_positions = getAliasRows(load_extra).reindex(pd.Index(uniques, dtype=object)).fillna(-1).to_numpy(dtype=np.int64)
+    return np.where(codes >= 0, unique_positions[codes], -1)
+
+# Проверяет, соответствует ли каждое значение series хотя бы одному из стандартов
+def isKnownCountry(series, load_extra=False):
+    return pd.Series(_getAliasPositions(series, load_extra) >= 0, index=getattr(series, 'index', None))
+
 # Проверяет, соответствует ли название страны хотя бы одному из стандартов 
-def checkCountry(countryname, key_df, return_none = 'wrong'):
-    #print(key_df)
-    
-    #print(key_df.eq(countryname).any())
-    
-    if any(key_df.eq(countryname).any()):
-        #print(f'Removing {countryname}')
+def checkCountry(countryname, key_df=None, return_none = 'wrong'):
+    if key_df is None:
+        known = bool(isKnownCountry(pd.Series([countryname])).iloc[0])
+    else:
+        known = any(key_df.eq(countryname).any())
+    if known:
         if return_none == 'wrong': return None
         if return_none == 'correct': return countryname
     else:
@@ -66,24 +164,32 @@ def checkCountry(countryname, key_df, return_none = 'wrong'):
         if return_none == 'correct': return None #возвращает названия для неузнанных и None для узнанных
         
 # Удаляет страны, которые не входят в key_df
+# (как и раньше через checkCountry с return_none='wrong', отбрасываются строки с узнанными значениями)
 def removeExtraCountriesAndTerritories(df, column_name, inplace=False):
     if inplace:
         df_copy = df
     else:
         df_copy = df.copy()
-    key_df = loadKeyDf()
-    df_copy[column_name]=df_copy[column_name].apply(lambda x: checkCountry(x, key_df, return_none='wrong'))
+    df_copy[column_name] = df_copy[column_name].where(~isKnownCountry(df_copy[column_name]))
     df_copy.dropna(subset = [column_name], inplace=True)
     if not inplace:
         return df_copy
 
 # по dataframe и колонке пишет, каких стран нет в табличке с ключами
+# (как и раньше через checkCountry с return_none='correct', возвращаются узнанные значения)
 def validateCountries(df, column_name):
-    key_df = loadKeyDf()
-    validated = df[column_name].apply(lambda x: checkCountry(x, key_df, return_none='correct'))
+    validated = df[column_name].where(isKnownCountry(df[column_name]))
     non_validated = validated.dropna().values
     return non_validated 
 
+# переводит все значения series (в любом стандарте) в стандарт convert_to
+def convertCountrySeries(series, convert_to, load_extra=False):
+    positions = _getAliasPositions(series, load_extra)
+    if (positions < 0).any():
+        raise KeyError(f"Unknown country ids: {list(pd.unique(pd.Series(series)[positions < 0]))}")
+    converted = _loadKeyDfCached(load_extra)[convert_to].to_numpy()[positions]
+    return pd.Series(converted, index=getattr(series, 'index', None), name=getattr(series, 'name', None))
+
 # Основаная функция: объединяет два датафрейма
 def mergeData (
     master_df_original : pd.DataFrame, 
@@ -99,50 +205,10 @@ def mergeData (
     slave_year_col = None
 ) -> pd.DataFrame:
     
-    # Отдельная функция, чтобы проверить страну на соответствие смешанным форматам
-    def compareWithMixedStandard(country, key_df, identification, passing, standard):
-        for mixed_standard in MIXED_STANDARDS:
-            if standard == MIXED_STANDARDS[mixed_standard]['master']:
-                for standard_additional in MIXED_STANDARDS[mixed_standard]['slaves']:
-                    print(f'{country} is compared with standard {standard_additional}')#, standard, )
-                    #print(f'Result is {str(country) in key_df[standard_name_en].values.astype(str)}')
-                    if country in key_df[standard_additional].values:
-                        passing = True
-                        break
-                if passing: 
-                    identification = mixed_standard
-                else:
-                    identification = 'unidentified'
-        return passing, identification
-    
-    # Проверяет, соответствует ли series определенному стандарту
-    def compareWithStandard(series_test, key_df, standard, skip_mixed=False):
-        identification = 'unidentified'
-        passing = True
-        for country in series_test:
-            print(f'{country} is compared with standard {standard}')#, standard, )
-            #print(f'Result is {str(country) in key_df[standard].values.astype(str)}')
-            if str(country) not in key_df[standard].values.astype(str):
-                passing = False
-                #English names in different forms
-                if not skip_mixed:
-                    passing, identification = compareWithMixedStandard(country, key_df, identification, passing, standard)
-            if not passing: break
-        if passing and identification not in MIXED_STANDARDS:
-            identification = standard
-        return identification
-    
-    # определяет стандарт series
+    # определяет стандарт series (см. StandardIndex.identify)
     def identifyKey(series_test: pd.Series, key_columns, key_df, show_error=True):
-        identification = 'unidentified'
-        for standard in key_columns:
-            identification_temp = compareWithStandard(series_test, key_df, standard)
-            if identification_temp != 'unidentified':
-                identification = identification_temp
-            if identification != 'unidentified':
-                print('identification is ', identification)
-                if identification not in MIXED_STANDARDS:
-                    return identification
+        identification = standard_index.identify(series_test)
+        logging.debug(f'identification is {identification}')
         if show_error:
             assert identification != 'unidentified', f'Failed to match data with any known sets of country ids in:\n {series_test}'
         return identification
@@ -190,27 +256,13 @@ def mergeData (
             df = df.rename(converter_dict)
         return df
     
-    #переводит название одной страны из одного стандарта в другой
-    def convertCountryname(countryname, convert_to, key_df):#, key_columns, key_df):
-        #print('OLD')
-        #print(countryname)
-        new_countryname = key_df[key_df.eq(countryname).any(1)][convert_to].values[0]
-        #print('NEW')
-        #print(new_countryname)
-        return new_countryname
-#        df = pd.DataFrame([countryname], columns = ['column'])
- #       convert_from = identifyKey(df['column'], key_columns, key_df, 'column')
-  #      new_countryname = convertStandard(df, 'column', convert_from, convert_to, key_df)
-   #     return new_countryname
-    
     # переводит смешанные стандарты в единый
     def convertMixedToSingleStandard(standard, df, column_key, key_df):
         assert standard in MIXED_STANDARDS, f'Unsupported mixed standard {standard}'
         single_standard_series = getColumnOrIndex(df, column_key)
-        display(single_standard_series)
-        single_standard_series = single_standard_series.apply(lambda x: convertCountryname(x, MIXED_STANDARDS[standard]['master'], key_df))
-        print('AFTER')
-        display(single_standard_series)
+        logging.debug(f'Converting {standard} to {MIXED_STANDARDS[standard]["master"]}:\n{single_standard_series}')
+        single_standard_series = convertCountrySeries(single_standard_series, MIXED_STANDARDS[standard]['master'])
+        logging.debug(f'AFTER\n{single_standard_series}')
         return single_standard_series
     
     # получает колонку или индекс в виде series
@@ -266,6 +318,7 @@ def mergeData (
 
     master_on_index = master_key_col == '_index'
     key_df = loadKeyDf()
+    standard_index = getStandardIndex()
     
     # Getting master key column and identifying stanrdard
     master_key_series = getColumnOrIndex(master_df, master_key_col)
@@ -0,0 +1,272 @@
+import sys
+sys.path.append("..")
+
+import os
+import logging
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.utils import get_system_members, GREAT_POWERS
+
+TESTING_PATH = "../data/testing"
+TEST_PLOTS_PATH = "../output/test_plots"
+
+
+class DiagnosticRecord():
+    """
+    Lightweight data quality record of a preprocessed source, collected during preprocessing and analysed later in report_diagnostics.
+
+    ...
+
+    Attributes
+    ----------
+    source_name : str
+        Name of the source
+    year_start : int
+        First year the source is expected to cover
+    year_end : int
+        Last year the source is expected to cover
+    dyads : pd.DataFrame
+        Nonzero dyads of the source with year, ego and alter columns (countries as categoricals)
+    ego_year_values : pd.Series
+        Sum of values by ego and year, for the plots
+    top_egos : list
+        Egos of the topnum strongest dyads of every year, for the plots
+    topnum : int
+        Number of strongest dyads per year whose egos are plotted
+    """
+    def __init__(self, df_triple, source_name, year_start, year_end, alter_label='alter', ego_label='ego', year_label='year', value_label='value', topnum=3):
+        df = df_triple.reset_index() if year_label not in df_triple.columns else df_triple
+        df = df[df[value_label].notna() & (df[value_label] != 0)]
+        self.source_name = source_name
+        self.year_start = year_start
+        self.year_end = year_end
+        self.dyads = pd.DataFrame({
+            'year': df[year_label].astype(int).to_numpy(),
+            'ego': pd.Categorical(df[ego_label]),
+            'alter': pd.Categorical(df[alter_label]),
+        })
+        self.ego_year_values = df.groupby([ego_label, year_label])[value_label].sum().rename_axis(['ego', 'year'])
+        self.topnum = topnum
+        self.top_egos = sorted(set(df.sort_values(value_label, ascending=False, kind='stable').groupby(year_label).head(topnum)[ego_label]))
+
+    def __repr__(self):
+        repr = f'DiagnosticRecord of {self.source_name} ({self.year_start} - {self.year_end}): {len(self.dyads)} nonzero dyads'
+        return repr
+
+
+class DiagnosticsCollector():
+    """
+    Collection of diagnostic records by source name (a repeated record of a source replaces the previous one)
+
+    If deferred, utils.utils.test_df only adds records to the collector instead of testing sources at once
+    (a pipeline opts in with DIAGNOSTICS.deferred = True and calls report_diagnostics after preprocessing)
+    """
+    def __init__(self, deferred: bool = False):
+        self.records = dict()
+        self.deferred = deferred
+
+    def __repr__(self):
+        repr = f'DiagnosticsCollector of {list(self.records)}'
+        return repr
+
+    def add(self, record: DiagnosticRecord):
+        self.records[record.source_name] = record
+        logging.info(f"Recorded diagnostics for {record.source_name}")
+
+    def clear(self):
+        self.records = dict()
+
+
+DIAGNOSTICS = DiagnosticsCollector()  # default collector used by utils.utils.test_df, not deferred unless a pipeline opts in
+
+
+class CoverageMasks():
+    """
+    Boolean coverage masks of several sources against system membership.
+
+    ...
+
+    Attributes
+    ----------
+    sources : list
+        Source names
+    years : np.ndarray
+        Years covered by the masks
+    country_index : pd.Index
+        Fixed index of system member countries (mask positions)
+    membership : np.ndarray
+        Boolean mask [year, ego, alter] of dyads between system members
+    expected : np.ndarray
+        Boolean mask [source, year], years each source is expected to cover
+    present : np.ndarray
+        Boolean mask [source, year, ego, alter] of nonzero dyads of each source (system members only)
+    great : np.ndarray
+        Boolean mask [country] of great powers
+    extra : dict
+        Source name -> set of countries of the source which are not system members
+    """
+    def __init__(self, records: list, sm: pd.DataFrame):
+        year_start = min(record.year_start for record in records)
+        year_end = max(record.year_end for record in records)
+        self.sources = [record.source_name for record in records]
+        self.years = np.arange(year_start, year_end + 1)
+        self.country_index = pd.Index(sorted(set(sm['ego']) | set(sm['alter'])), name='country')
+        n = len(self.country_index)
+        self.great = self.country_index.isin(GREAT_POWERS)
+
+        sm = sm[(sm['year'] >= year_start) & (sm['year'] <= year_end)]
+        self.membership = np.zeros((len(self.years), n, n), dtype=bool)
+        self.membership[sm['year'].to_numpy() - year_start, self.country_index.get_indexer(sm['ego']), self.country_index.get_indexer(sm['alter'])] = True
+
+        self.expected = (self.years >= np.array([[record.year_start] for record in records])) & (self.years <= np.array([[record.year_end] for record in records]))
+        self.present = np.zeros((len(records), len(self.years), n, n), dtype=bool)
+        self.extra = dict()
+        for s, record in enumerate(records):
+            dyads = record.dyads
+            egos = self.country_index.get_indexer(dyads['ego'].astype(object))
+            alters = self.country_index.get_indexer(dyads['alter'].astype(object))
+            years = dyads['year'].to_numpy() - year_start
+            known = (egos >= 0) & (alters >= 0) & (years >= 0) & (years < len(self.years))
+            self.present[s, years[known], egos[known], alters[known]] = True
+            self.extra[record.source_name] = (set(dyads['ego'].unique()) | set(dyads['alter'].unique())) - set(self.country_index)
+
+    def __repr__(self):
+        repr = f'CoverageMasks of {len(self.sources)} sources, {len(self.years)} years, {len(self.country_index)} countries'
+        return repr
+
+    def get_table(self):
+        """Returns coverage of all sources as one table
+
+        Return
+        -----------
+            coverage_df : pd.DataFrame
+                Indexed by source, scope and key, with expected (system member dyads), covered (of them nonzero in the source)
+                and coverage (covered / expected) columns. Scopes:
+                'all' and 'great' (dyads with a great power) for the whole period (key is empty),
+                'year' and 'great_year' by year, 'ego' and 'alter' by country (great powers can be selected with the 'great' column)
+        """
+        expected = self.membership[None] & self.expected[:, :, None, None]  # [source, year, ego, alter]
+        covered = self.present & expected
+        great_pairs = self.great[:, None] | self.great[None, :]
+        matrices = {
+            'year': (expected.sum(axis=(2, 3)), covered.sum(axis=(2, 3)), self.years),
+            'great_year': ((expected & great_pairs).sum(axis=(2, 3)), (covered & great_pairs).sum(axis=(2, 3)), self.years),
+            'ego': (expected.sum(axis=(1, 3)), covered.sum(axis=(1, 3)), self.country_index),
+            'alter': (expected.sum(axis=(1, 2)), covered.sum(axis=(1, 2)), self.country_index),
+        }
+        matrices['all'] = (matrices['year'][0].sum(axis=1, keepdims=True), matrices['year'][1].sum(axis=1, keepdims=True), [''])
+        matrices['great'] = (matrices['great_year'][0].sum(axis=1, keepdims=True), matrices['great_year'][1].sum(axis=1, keepdims=True), [''])
+        tables = []
+        for scope in ['all', 'great', 'year', 'great_year', 'ego', 'alter']:
+            expected_counts, covered_counts, keys = matrices[scope]
+            tables += pd.DataFrame({
+                'source': np.repeat(self.sources, len(keys)),
+                'scope': scope,
+                'key': np.tile(np.asarray(keys, dtype=object), len(self.sources)),
+                'expected': expected_counts.ravel(),
+                'covered': covered_counts.ravel(),
+            }),
+        coverage_df = pd.concat(tables, ignore_index=True)
+        coverage_df['coverage'] = coverage_df['covered'] / coverage_df['expected'].where(coverage_df['expected'] > 0)
+        coverage_df['great'] = coverage_df['scope'].isin(['ego', 'alter']) & coverage_df['key'].isin(GREAT_POWERS)
+        return coverage_df.set_index(['source', 'scope', 'key'])
+
+    def get_summary(self, coverage_df: pd.DataFrame = None):
+        """Returns the coverage summary (the figures of utils.utils.test_df), one row per source"""
+        if coverage_df is None:
+            coverage_df = self.get_table()
+        table = coverage_df.reset_index()
+        is_expected = table['expected'] > 0
+        is_missing = is_expected & (table['covered'] == 0)
+        def count(mask, scope, great=None):
+            mask = mask & (table['scope'] == scope)
+            if great is not None:
+                mask = mask & (table['great'] == great)
+            return table[mask].groupby('source').size().reindex(self.sources, fill_value=0)
+        totals = coverage_df.xs('all', level='scope').droplevel('key')
+        totals_great = coverage_df.xs('great', level='scope').droplevel('key')
+        summary_df = pd.DataFrame({
+            'Missing egos': count(is_missing, 'ego'),
+            'Missing great egos': count(is_missing, 'ego', True),
+            'Missing alters': count(is_missing, 'alter'),
+            'Missing great alters': count(is_missing, 'alter', True),
+            'Missing years': count(is_missing, 'year'),
+            'Missing yearly dyads': totals['expected'] - totals['covered'],
+            'Missing yearly great dyads': totals_great['expected'] - totals_great['covered'],
+            'Extra countries': pd.Series({source: len(self.extra[source]) for source in self.sources}),
+            'Egos percent': 1 - count(is_missing, 'ego') / count(is_expected, 'ego'),
+            'Alters percent': 1 - count(is_missing, 'alter') / count(is_expected, 'alter'),
+            'Yearly dyads percent': totals['coverage'],
+            'Yearly great dyads percent': totals_great['coverage'],
+        }, index=pd.Index(self.sources, name='Source name'))
+        return summary_df
+
+def _init_plot_worker():
+    import matplotlib
+    matplotlib.use('Agg')  # non-interactive backend, worker processes never show figures
+
+def _plot_source(ego_year_values, top_egos, source_name, plot_dir, topnum):
+    """Draws values of the top egos by year (a process pool task, the same plot as utils.utils.visualise_test)"""
+    from matplotlib import pyplot as plt
+    grouped_data = ego_year_values[ego_year_values.index.get_level_values('ego').isin(top_egos)]
+    fig, ax = plt.subplots(figsize=(12, 8))
+    for country, country_data in grouped_data.groupby(level='ego'):
+        ax.plot(country_data.index.get_level_values('year'), country_data.values, label=country)
+    ax.set_xlabel("Год")
+    ax.set_ylabel(source_name)
+    ax.legend(title=f"Топ-{topnum} стран")
+    ax.set_title(f"Топ-10 стран по {source_name}")
+    path = os.path.join(plot_dir, f"test_{source_name}.png")
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+def report_diagnostics(collector: DiagnosticsCollector = None, testing_path: str = TESTING_PATH, plot_dir: str = TEST_PLOTS_PATH, plot: bool = True, n_jobs: int = None):
+    """Report stage of the diagnostics collected during preprocessing
+
+    Coverage of all sources is counted at once with boolean masks against one system membership table (see CoverageMasks),
+    the consolidated table is saved to testing_path/coverage.csv. Plots of all sources are rendered in a process pool with the Agg backend.
+
+    Parameters
+    ------------
+        collector: DiagnosticsCollector or None
+            Records to report, the default collector DIAGNOSTICS if None
+        testing_path: str
+            Directory for the coverage table
+        plot_dir: str
+            Directory for the plots
+        plot: bool
+            Whether to render the plots. Default: True
+        n_jobs: int or None
+            Number of plotting processes, None for the number of processors
+    Return
+    -----------
+        results_df : pd.DataFrame
+            Coverage summary, one row per source (see CoverageMasks.get_summary)
+    """
+    if collector is None:
+        collector = DIAGNOSTICS
+    records = list(collector.records.values())
+    if len(records) == 0:
+        logging.info("No diagnostics to report")
+        return pd.DataFrame()
+    logging.info(f"Reporting diagnostics for {len(records)} sources")
+    sm = get_system_members(min(record.year_start for record in records), max(record.year_end for record in records))
+
+    masks = CoverageMasks(records, sm)
+    coverage_df = masks.get_table()
+    coverage_df.to_csv(os.path.join(testing_path, 'coverage.csv'))
+    results_df = masks.get_summary(coverage_df)
+    logging.info(results_df)
+    for source_name, extra in masks.extra.items():
+        if len(extra) > 0: logging.info(f"Extra countries in {source_name}: {extra}")
+
+    if plot:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_plot_worker) as executor:
+            futures = [executor.submit(_plot_source, record.ego_year_values, record.top_egos, record.source_name, plot_dir, record.topnum) for record in records]
+            for future in futures:
+                logging.info(f"Saved {future.result()}")
+    logging.info("Diagnostics report done")
+    return results_df
@@ -4,22 +4,67 @@
 # In[7]:
 
 
+import os
+import logging
 import pandas as pd
 import geopandas
 import matplotlib.colors as clr
 import matplotlib.patches as ptch
 import numpy as np
 
+from functools import lru_cache
 from matplotlib import cm
 from pathlib import Path
 from matplotlib import pyplot as plt
 
-#загрузка базовых данных
-gdf = geopandas.read_file("/geoshapes/v22_2608.shp")
-gdf = gdf.set_index('STATE_en_U')
+GEOSHAPES_PATH = "/geoshapes/v22_2608.shp"
+GEOSHAPES_CACHE_DIR = "../data/cache"
+GEOSHAPES_INDEX = 'STATE_en_U'
+DEFAULT_SIMPLIFY_TOLERANCE = 0.05  # degrees, invisible at world map scale
+
+#загрузка базовых данных (лениво, при первом использовании)
+@lru_cache(maxsize=None)
+def get_geodataframe(simplify_tolerance=DEFAULT_SIMPLIFY_TOLERANCE, use_cache=True):
+    """Returns the world shapes GeoDataFrame indexed by country (STATE_en_UN)
+
+    Shapes are read once per process. Simplified shapes are cached in a GeoParquet file in GEOSHAPES_CACHE_DIR,
+    which is rebuilt when the shapefile is newer. Borders are simplified as a coverage (shared borders stay shared)
+    if geopandas supports it, otherwise each shape is simplified preserving its topology.
+    The returned GeoDataFrame is shared, copy it before modifying.
+
+    Parameters
+    ------------
+        simplify_tolerance: float or None
+            Simplification tolerance in shape coordinates (degrees), None to keep the original shapes
+        use_cache: bool
+            Whether to read and write the GeoParquet cache. Default: True
+    """
+    cache_path = os.path.join(GEOSHAPES_CACHE_DIR, f"{Path(GEOSHAPES_PATH).stem}_{simplify_tolerance}.parquet")
+    if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(GEOSHAPES_PATH):
+        return geopandas.read_parquet(cache_path)
+    logging.info(f"Loading shapes from {GEOSHAPES_PATH}")
+    gdf = geopandas.read_file(GEOSHAPES_PATH)
+    gdf = gdf.set_index(GEOSHAPES_INDEX)
+    if simplify_tolerance is not None:
+        if hasattr(gdf.geometry, 'simplify_coverage'):
+            gdf.geometry = gdf.geometry.simplify_coverage(simplify_tolerance)
+        else:
+            gdf.geometry = gdf.geometry.simplify(simplify_tolerance, preserve_topology=True)
+    if use_cache:
+        Path(GEOSHAPES_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+        gdf.to_parquet(f"{cache_path}.tmp")
+        os.replace(f"{cache_path}.tmp", cache_path)
+    return gdf
+
+def _get_country_values(gdf, df, columnnames, country_subset=None):
+    # aligning df values to the shapes in one step, countries missing in df stay empty
+    values = df[columnnames].reindex(gdf.index)
+    if country_subset is not None:
+        values.loc[~gdf.index.isin(country_subset)] = np.nan
+    return values
 
 # Loads a column into a world shapefile, keeping non-existant values empty
-def importShapefile(df, columnname = None, *, columnnames = None, country_subset = None, savepathname = None):
+def importShapefile(df, columnname = None, *, columnnames = None, country_subset = None, savepathname = None, simplify_tolerance = None):
     
     # Can both handle lists of columnnames or single a single columnname
     if columnnames is None:
@@ -28,8 +73,6 @@ def importShapefile(df, columnname = None, *, columnnames = None, country_subset
     else:
         assert columnname is None, 'Cannot specify both "columnname" and "columnnames"'
     
-    if country_subset is None:
-        country_subset = gdf.index.values
    
     if savepathname is None:
         savepathname = f'{columnname}_shapefile/{columnname}'
@@ -37,36 +80,19 @@ def importShapefile(df, columnname = None, *, columnnames = None, country_subset
 
     
     
+    gdf = get_geodataframe(simplify_tolerance).copy()
     df_indexed = df #.set_index('STATE_en_UN')
+    values = _get_country_values(gdf, df_indexed, columnnames, country_subset)
     for columnname in columnnames:
-        gdf[columnname] = np.nan
-        for country in country_subset:
-            # copying value by value from a df to a gdf
-            gdf.loc[country, columnname] = df_indexed.loc[country, columnname]
+        gdf[columnname] = values[columnname].to_numpy()
         print(f'Writing {columnname} to shapefile')
 
     gdf.to_file(f"{savepathname}.shp")
     print(f'Saved {savepathname}.shp, {savepathname}.dbf, {savepathname}.cpg, {savepathname}.prj, {savepathname}.shx')
     
-def drawMap(df, stat = 'cluster', savename = 'basic', addlegend = False, addclusterlegend = False, colormap = 'viridis', lang = 'en'):
-    
-    if savename == 'basic':
-        savename = stat + df_working_column + 'map.png'
-    
-    df_indexed = df #.set_index('STATE_en_UN')
-
-    gdf[stat] = np.nan
-    for country in gdf.index.values:
-        gdf.loc[country, stat] = df_indexed.loc[country, stat]
-    #присоединение новых данных
-    #gdf['df_working_column'] = np.nan
-    #for country in gdf.index.values:
-    #    #gdf[df_working_column][country] = getCountryStat(country, df_working, stat)
-    #    gdf.loc[country,'df_working_column'] = getCountryStat(country, df_working, stat)
-    
-    #from matplotlib import cm
-    #viridis = cm.get_cmap('plasma', 8)
-
+def _get_colormap(colormap):
+    # returns a matplotlib colormap and the list of its colors (None for named colormaps)
+    colors = None
     if colormap == 'viridis':
         cmap = 'viridis'
     elif colormap == '5 clusters':
@@ -97,29 +123,10 @@ def drawMap(df, stat = 'cluster', savename = 'basic', addlegend = False, addclus
     else:
         colors = colormap # ['#EEDAF2', '#3B4CC0', '#F2AAB4', '#B30423', '#8CB1FF']
         cmap = clr.LinearSegmentedColormap.from_list(name = 'customcmap', colors=colors)
-        
-    #from mpl_toolkits.axes_grid1 import make_axes_locatable
-  
-    #рисование карты
-    fig, axs = plt.subplots(1, 2, dpi=400, figsize=(10, 4), gridspec_kw = {'width_ratios':[3,1]})
-
+    return cmap, colors
 
-    #divider = make_axes_locatable(ax)
-    #cax = divider.append_axes("right", size="5%", pad=0.1)
-    
-    geomap = gdf.plot(
-        column=stat,
-        missing_kwds={'color': 'lightgrey'}, 
-        ax = axs[0],
-        cmap = cmap,
-      #  color = ['72FF51', 'FFBD32', '636FFC', 'FC303B', 'FFFF3B'],
-      #  cmap = 'Set1',
-        legend=addlegend,
-        legend_kwds={'label': "Shareof Population",
-                        'orientation': "horizontal"}
-    )
-    
-    
+def _add_legend(ax, colormap, colors, lang):
+    # adds a categorical legend for the custom colormaps
     if colormap == '5 clusters':
         from matplotlib import cm
         #viridis = cm.get_cmap(cmap, n_clusters)
@@ -146,7 +153,7 @@ def drawMap(df, stat = 'cluster', savename = 'basic', addlegend = False, addclus
                     'Sympathetic with Russia',
                     'Aligned with Russia',
             ]
-        axs[1].legend(custom_patches, custom_labels)
+        ax.legend(custom_patches, custom_labels)
     if colormap == 'voting' or colormap == 'voting_clusters' or colormap == 'voting_clusters_reverse':
         from matplotlib import cm
         #viridis = cm.get_cmap(cmap, n_clusters)
@@ -167,7 +174,7 @@ def drawMap(df, stat = 'cluster', savename = 'basic', addlegend = False, addclus
                 'Abstention or no vote',
                 'In favour',
             ]
-        axs[1].legend(custom_patches, custom_labels)
+        ax.legend(custom_patches, custom_labels)
     if colormap == 'sanctions' or colormap == 'sanctions_clusters':
         from matplotlib import cm
         #viridis = cm.get_cmap(cmap, n_clusters)
@@ -190,13 +197,91 @@ def drawMap(df, stat = 'cluster', savename = 'basic', addlegend = False, addclus
                 'Sanctions',
             ]
             title = "Imposition of Sanctions on Russia"
-        axs[1].legend(custom_patches, custom_labels)
+        ax.legend(custom_patches, custom_labels)
+
+def _plot_map(gdf, values, savename, addlegend, colormap, lang, show):
+    cmap, colors = _get_colormap(colormap)
+        
+    #from mpl_toolkits.axes_grid1 import make_axes_locatable
+  
+    #рисование карты
+    fig, axs = plt.subplots(1, 2, dpi=400, figsize=(10, 4), gridspec_kw = {'width_ratios':[3,1]})
 
+
+    #divider = make_axes_locatable(ax)
+    #cax = divider.append_axes("right", size="5%", pad=0.1)
+    
+    geomap = gdf.plot(
+        column=np.asarray(values),
+        missing_kwds={'color': 'lightgrey'}, 
+        ax = axs[0],
+        cmap = cmap,
+      #  color = ['72FF51', 'FFBD32', '636FFC', 'FC303B', 'FFFF3B'],
+      #  cmap = 'Set1',
+        legend=addlegend,
+        legend_kwds={'label': "Shareof Population",
+                        'orientation': "horizontal"}
+    )
+    
+    _add_legend(axs[1], colormap, colors, lang)
     
     #axs[0].set_title(savename)
     geomap.set_axis_off()
     axs[1].set_axis_off()
     
     plt.savefig(savename, facecolor='#FFFFFF', dpi=300)
-    plt.show()
+    if show:
+        plt.show()
+    plt.close(fig)
 
+def drawMap(df, stat = 'cluster', savename = 'basic', addlegend = False, addclusterlegend = False, colormap = 'viridis', lang = 'en', show = True):
+    
+    if savename == 'basic':
+        savename = stat + 'map.png'
+    
+    df_indexed = df #.set_index('STATE_en_UN')
+    gdf = get_geodataframe()
+    #присоединение новых данных
+    values = _get_country_values(gdf, df_indexed, [stat])[stat]
+    _plot_map(gdf, values, savename, addlegend, colormap, lang, show)
+
+def drawMaps(df, stats, years = None, year_column = 'year', savename = '{stat}_{year}_map.png', addlegend = False, colormap = 'viridis', lang = 'en', show = False):
+    """Draws maps for many stats (and years) in one call, shapes are loaded and values are aligned only once
+
+    Parameters
+    ------------
+        df: pd.DataFrame
+            Data indexed by country (STATE_en_UN). If years is set, df should have a year_column (column or index level)
+            and one row per country and year
+        stats: list
+            Columns to draw
+        years: iterable or None
+            Years to draw a map for, None if df has no years
+        year_column: str
+            Name of the year column or index level. Default: 'year'
+        savename: str
+            Template of the file names with {stat} and {year} fields. Default: '{stat}_{year}_map.png'
+        show: bool
+            Whether to show the maps (in a notebook). Default: False, figures are only saved and closed
+    Return
+    -----------
+        savenames : list
+            Paths of the saved maps
+    """
+    gdf = get_geodataframe()
+    if years is None:
+        values = _get_country_values(gdf, df, stats)
+        maps = [(stat, None, values[stat]) for stat in stats]
+    else:
+        df = df.reset_index(year_column) if year_column in df.index.names else df
+        wide = df[df[year_column].isin(list(years))].pivot(columns=year_column, values=stats)  # (stat, year) columns, one row per country
+        values = wide.reindex(gdf.index)
+        maps = [(stat, year, values[(stat, year)] if (stat, year) in values.columns else pd.Series(np.nan, index=gdf.index))
+                for stat in stats for year in years]
+    savenames = []
+    for stat, year, stat_values in maps:
+        map_savename = savename.format(stat=stat, year=year)
+        logging.debug(f"Drawing {map_savename}")
+        _plot_map(gdf, stat_values, map_savename, addlegend, colormap, lang, show)
+        savenames += map_savename,
+    return savenames
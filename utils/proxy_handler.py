@@ -1,12 +1,18 @@
 from datetime import datetime
+import asyncio
+import time
 headers = {'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/101.0.5005.134 YaBrowser/22.7.1.828 (beta) Yowser/2.5 Safari/537.36', "Referer": "http://example.com"}
 import threading
-from queue import Queue
 DEFAULT_TEST_URL = 'https://www.researchgate.net/'
+DEFAULT_CONCURRENCY = 50  # proxies tested at once
+DEFAULT_REGISTRY_PATH = '../data/cache/proxies.sqlite'
 from time import sleep
 from lxml import html as lxmlhtml
 
+import os
 import random
+import logging
+import sqlite3
 import requests
 import pandas as pd
 
@@ -81,55 +87,293 @@ class Proxy():
         if verbose: print(self.tests)
         return self
 
+    async def test_async(self, session, test_url=DEFAULT_TEST_URL, headers=DEFAULT_HEADERS, timeout=10, verbose=True):
+        """Asynchronous version of test, the request goes through a shared aiohttp.ClientSession (see probe_proxies)"""
+        import aiohttp
+        check_result = None
+        response_time = None
+        start = time.perf_counter()
+        try:
+            async with session.get(test_url, headers=headers, proxy=self.http, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                await response.read()
+                check_result = response.status
+                response_time = time.perf_counter() - start
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            check_result = f'ERROR: {ex!r}'
+        if check_result == 200:
+            self.status = 'OK'
+        elif self.status == 'untested':
+            self.status = 'BAD'
+        pr_test = ProxyTest(self.ip, test_url, check_result, test_time=datetime.now(), response_time=response_time)
+        self.tests.append(pr_test)
+        if verbose: print(f'Tested {self.full} {check_result}')
+        return self
+
+class ProxyRegistry():
+    """
+    Persistent store of proxies and their test results (SQLite), handing out proxies by their health.
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+        Path to the SQLite database
+    window : int
+        Number of last tests of a proxy its health score is counted from
+    stale_after : float
+        Seconds after which the last test of a proxy is outdated and the proxy is retested on refresh
+
+    Health score of a proxy is the share of successful tests among its last window tests
+    divided by (1 + mean response time of the successful ones), untested proxies score 0.
+    """
+    def __init__(self, path: str = DEFAULT_REGISTRY_PATH, window: int = 10, stale_after: float = 3600):
+        self.path = path
+        self.window = window
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS proxies (ip TEXT, port TEXT, proxy_class TEXT, PRIMARY KEY (ip, port))")
+            connection.execute("CREATE TABLE IF NOT EXISTS tests (ip TEXT, port TEXT, url TEXT, result TEXT, ok INTEGER, test_time REAL, response_time REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS tests_proxy ON tests (ip, port, test_time)")
+
+    def __repr__(self):
+        repr = f'ProxyRegistry at {self.path}'
+        return repr
+
+    def _connect(self):
+        # a connection per call, so that the registry can be used from the background refresh thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, proxies: list):
+        """Adds proxies (Proxy objects) to the registry, known ones are kept"""
+        with self._lock, self._connect() as connection:
+            connection.executemany("INSERT OR IGNORE INTO proxies VALUES (?, ?, ?)", [(proxy.ip, str(proxy.port), proxy.proxy_class) for proxy in proxies])
+
+    def record(self, proxies: list):
+        """Saves the last test of every proxy (see Proxy.test and Proxy.test_async), adding unknown proxies"""
+        proxies = [proxy for proxy in proxies if len(proxy.tests) > 0]
+        self.add(proxies)
+        rows = list()
+        for proxy in proxies:
+            test = proxy.tests[-1]
+            rows += (proxy.ip, str(proxy.port), test.url, str(test.result), int(test.result == 200), test.test_time.timestamp(), test.response_time),
+        with self._lock, self._connect() as connection:
+            connection.executemany("INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        logging.debug(f"Recorded {len(rows)} proxy tests")
+
+    def get_proxies(self):
+        """Returns all registered proxies as Proxy objects"""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT ip, port, proxy_class FROM proxies").fetchall()
+        return [Proxy(ip, port, proxy_class) for ip, port, proxy_class in rows]
+
+    def get_scores(self):
+        """Returns health of all registered proxies
+
+        Return
+        -----------
+            scores_df : pd.DataFrame
+                Indexed by ip and port, with n_tests, success_rate, response_time (mean of successful tests),
+                last_test (timestamp, NaN if never tested) and score columns
+        """
+        with self._connect() as connection:
+            proxies_df = pd.read_sql("SELECT ip, port FROM proxies", connection)
+            tests_df = pd.read_sql("SELECT * FROM (SELECT ip, port, ok, test_time, response_time, "
+                                   "ROW_NUMBER() OVER (PARTITION BY ip, port ORDER BY test_time DESC) AS n FROM tests) WHERE n <= ?",
+                                   connection, params=(self.window,))
+        tests_df['response_time'] = tests_df['response_time'].where(tests_df['ok'] == 1)
+        scores_df = tests_df.groupby(['ip', 'port']).agg(n_tests=('ok', 'size'), success_rate=('ok', 'mean'), response_time=('response_time', 'mean'), last_test=('test_time', 'max'))
+        scores_df = scores_df.reindex(pd.MultiIndex.from_frame(proxies_df))
+        scores_df['n_tests'] = scores_df['n_tests'].fillna(0).astype(int)
+        scores_df['score'] = (scores_df['success_rate'] / (1 + scores_df['response_time'].fillna(0))).fillna(0)
+        return scores_df
+
+    def get_stale(self):
+        """Returns proxies which were never tested or whose last test is older than stale_after"""
+        scores_df = self.get_scores()
+        stale = ~(scores_df['last_test'] >= time.time() - self.stale_after)
+        return [Proxy(ip, port) for ip, port in scores_df.index[stale]]
+
+    def get_proxy(self, exclude=None):
+        """Returns a proxy chosen at random with probability proportional to its health score, None if no proxy is healthy
+
+        exclude is a collection of proxies (Proxy.full strings) not to hand out, e.g. the ones in use"""
+        scores = self.get_scores()['score']
+        scores = scores[scores > 0]
+        if exclude is not None:
+            scores = scores[[f'{ip}:{port}' not in exclude for ip, port in scores.index]]
+        if len(scores) == 0:
+            return None
+        ip, port = random.choices(list(scores.index), weights=scores.to_numpy())[0]
+        return Proxy(ip, port, status='OK')
+
+    def refresh(self, test_url=DEFAULT_TEST_URL, discover=False, background=True, concurrency=DEFAULT_CONCURRENCY, timeout=10):
+        """Retests stale proxies and records the results
+
+        Parameters
+        ------------
+            test_url: str
+                Url to request through every proxy
+            discover: bool
+                Whether to download the proxy list (see get_proxy_list) and register new anonymous proxies first
+            background: bool
+                Whether to test in a daemon thread and return at once (a refresh already running is not repeated)
+            concurrency: int
+                Maximal number of proxies tested at once
+            timeout: float
+                Timeout of one proxy test in seconds
+        Return
+        -----------
+            thread : threading.Thread or None
+                The background thread, None if the refresh was done synchronously
+        """
+        def run():
+            if discover:
+                anon_proxies = filter_anon_proxies(get_proxy_list())
+                self.add([Proxy(*get_ip_port_from_row(row), 'anon') for _, row in anon_proxies.iterrows()])
+            stale = self.get_stale()
+            logging.info(f"Retesting {len(stale)} stale proxies")
+            if len(stale) > 0:
+                self.record(check_proxies(stale, test_url=test_url, concurrency=concurrency, timeout=timeout, verbose=False))
+        if not background:
+            run()
+            return None
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return self._refresh_thread
+        self._refresh_thread = threading.Thread(target=run, daemon=True)
+        self._refresh_thread.start()
+        return self._refresh_thread
+
+
 # gets a list of free proxies from https://free-proxy-list.net/ tests every one in test_url and spits out the fastest
-def get_ok_proxy(test_url=DEFAULT_TEST_URL):
+def get_ok_proxy(test_url=DEFAULT_TEST_URL, registry=None):
+    """Returns the proxy dict of a working proxy
+
+    Without a registry, the proxy list is downloaded and tested and the fastest proxy is returned.
+    With a ProxyRegistry, a proxy is handed out by weighted rotation of the stored health scores
+    and stale proxies are retested in the background (the list is downloaded and tested at once only if no proxy is healthy,
+    raises RuntimeError if still no proxy is healthy)."""
+    if registry is not None:
+        proxy = registry.get_proxy()
+        if proxy is None:
+            registry.refresh(test_url, discover=True, background=False)
+            proxy = registry.get_proxy()
+            if proxy is None:
+                raise RuntimeError(f"No working proxy found to access {test_url}")
+        else:
+            registry.refresh(test_url, background=True)
+        return proxy.proxy_dict
     print(f"Getting fastest proxy to access {test_url}")
     ok_proxies, fastest_proxy = get_ok_proxies(test_url)
     return fastest_proxy.proxy_dict        
 
 
 
-def get_ok_proxies(test_url=DEFAULT_TEST_URL, verbose=True):
-    proxies = get_proxy_list()
-    anon_proxies = filter_anon_proxies(proxies)
-    print(f"There are {len(anon_proxies)} anon proxies available")
-    queue = Queue()
-    threads_list = list()
-    
-    def test_proxy(ip, port, proxy_class, test_url):
-        proxy = Proxy(ip, port, proxy_class)
-        proxy.test(test_url, verbose=verbose)
-        return proxy
-    
-    for index, row in anon_proxies.iterrows():
-        ip, port = get_ip_port_from_row(row)
-        thr = threading.Thread(target=lambda q: q.put(test_proxy(ip, port, 'anon', test_url)), args=(queue,))
-        thr.start()
-        threads_list.append(thr)
-    for t in threads_list:
-        t.join()
-    
-    fastest_proxy = None
-    fastest_time = 11
-    ok_proxies = list()
-    while not queue.empty():
-        proxy = queue.get()
-        if proxy.status == 'OK':
-            if verbose: print(proxy)
-            if verbose: print(proxy.tests[-1])
-            if proxy.tests[-1].response_time < fastest_time: 
-                fastest_proxy = proxy
-                fastest_time = proxy.tests[-1].response_time
-            ok_proxies += proxy,
-        last_proxy=proxy
-        #if test_proxy(proxy, port, test_url):
-        #    print("success")
-        #    return formulate_proxy_dict(row)
+def get_ok_proxies(test_url=DEFAULT_TEST_URL, verbose=True, proxies=None, concurrency=DEFAULT_CONCURRENCY, timeout=10, max_ok=None):
+    """Tests proxies asynchronously and returns the working ones and the fastest of them
+
+    Parameters
+    ------------
+        test_url: str
+            Url to request through every proxy
+        verbose: bool
+            Whether to print test results
+        proxies: list or pd.DataFrame or None
+            Proxies to test, a list of Proxy or a table as from get_proxy_list (anonymous ones are used),
+            None to download the list from free-proxy-list.net
+        concurrency: int
+            Maximal number of proxies tested at once. Default: DEFAULT_CONCURRENCY
+        timeout: float
+            Timeout of one proxy test in seconds. Default: 10
+        max_ok: int or None
+            Stop testing once this many working proxies are found, None to test all
+    Return
+    -----------
+        ok_proxies : list
+            Working proxies (Proxy objects)
+        fastest_proxy : Proxy or None
+            Fastest working proxy, the last tested one if none works
+    """
+    if proxies is None:
+        proxies = get_proxy_list()
+    if isinstance(proxies, pd.DataFrame):
+        anon_proxies = filter_anon_proxies(proxies)
+        print(f"There are {len(anon_proxies)} anon proxies available")
+        proxies = [Proxy(*get_ip_port_from_row(row), 'anon') for _, row in anon_proxies.iterrows()]
+    tested = check_proxies(proxies, test_url=test_url, concurrency=concurrency, timeout=timeout, max_ok=max_ok, verbose=verbose)
+
+    ok_proxies = [proxy for proxy in tested if proxy.status == 'OK']
     if len(ok_proxies) < 1:
         print('NO WORKING PROXIES FOUND, returning non-working')
-        return list(), last_proxy
+        return list(), tested[-1] if len(tested) > 0 else None
+    fastest_proxy = min(ok_proxies, key=lambda proxy: proxy.tests[-1].response_time)
+    if verbose:
+        for proxy in ok_proxies: print(proxy, proxy.tests[-1])
     print(f"Fastest proxy to respond ({fastest_proxy.tests[-1].response_time} sec): {fastest_proxy.full}, total working {len(ok_proxies)} proxies")
-    return ok_proxies, fastest_proxy        
+    return ok_proxies, fastest_proxy
+
+async def probe_proxies(proxies: list, test_url=DEFAULT_TEST_URL, concurrency=DEFAULT_CONCURRENCY, timeout=10, max_ok=None, headers=Proxy.DEFAULT_HEADERS, verbose=True):
+    """Tests proxies concurrently over one connection pool
+
+    At most concurrency proxies are tested at once (the pool is limited to the same number of connections),
+    every test is limited by timeout. Once max_ok working proxies are found, the remaining tests are cancelled.
+
+    Return
+    -----------
+        tested : list
+            Proxies whose test finished, in order of completion
+    """
+    import aiohttp  # pip install aiohttp
+    semaphore = asyncio.Semaphore(concurrency)
+    tested = list()
+
+    async def probe(proxy):
+        async with semaphore:
+            return await proxy.test_async(session, test_url, headers=headers, timeout=timeout, verbose=verbose)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [asyncio.ensure_future(probe(proxy)) for proxy in proxies]
+        try:
+            n_ok = 0
+            for next_done in asyncio.as_completed(tasks):
+                proxy = await next_done
+                tested += proxy,
+                if proxy.status == 'OK': n_ok += 1
+                if max_ok is not None and n_ok >= max_ok:
+                    logging.debug(f"Found {n_ok} working proxies, cancelling the remaining tests")
+                    break
+        finally:
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return tested
+
+def check_proxies(proxies: list, test_url=DEFAULT_TEST_URL, concurrency=DEFAULT_CONCURRENCY, timeout=10, max_ok=None, verbose=True):
+    """Synchronous wrapper of probe_proxies (also works inside Jupyter, where an event loop is already running)"""
+    return _run_async(probe_proxies(proxies, test_url=test_url, concurrency=concurrency, timeout=timeout, max_ok=max_ok, verbose=verbose))
+
+def _run_async(coroutine):
+    """Runs a coroutine to completion, in a separate thread if the current thread already runs an event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    result = dict()
+    def run():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as e:
+            result['error'] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if 'error' in result: raise result['error']
+    return result['value']
 
 def test_proxy(proxy_ip, proxy_port, test_url=DEFAULT_TEST_URL):
     # Добавить Multithreading
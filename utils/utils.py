@@ -1,17 +1,18 @@
 import pandas as pd
 import numpy as np
-from matplotlib import pyplot as plt
 import logging
 from itertools import product, permutations
 import warnings
+from functools import lru_cache
 
 
 
-from data_handling import gsheet_handler
-from utils.countryconverter import convert_country_df
+from utils.countryconverter import convert_country_df, get_country_dtype
 
 GREAT_POWERS = {"China, People's Republic of", "France", "Germany", "India", "Russian Federation", "United Kingdom of Great Britain and Northern Ireland", "United States"}
 YEAR_MAX_SUPPORTED = 2030
+COMPACT_YEAR_DTYPE = np.int16
+COMPACT_VALUE_DTYPE = np.float32
 
 def get_all_countries(processed_df=None, ego_column = 'seller', alter_column = 'buyer'):
     """Returns a set of all countries, both ego and alter
@@ -32,6 +33,7 @@ def get_all_countries(processed_df=None, ego_column = 'seller', alter_column = '
     """
     logging.debug("getting all countries for df")
     if processed_df is None:
+        from data_handling import gsheet_handler
         country_df = gsheet_handler.read_gsheet(tablename='country_data', sheetname='countryids', skiprows=0)['state_en_un'].dropna()
         return set(country_df)
     if alter_column is not None:
@@ -46,6 +48,21 @@ def get_all_countries(processed_df=None, ego_column = 'seller', alter_column = '
     logging.info(f"there are {len(countries_all)} unique countries, {len(ego_all)} - ego, {len(alter_all)} - alter")
     return countries_all
 
+def get_country_index(countries):
+    """Returns a fixed (sorted) index of countries, used to encode countries as integer codes
+
+    Parameters
+    ------------
+        countries: iterable
+            Countries to index (duplicates are dropped)
+
+    Return
+    -----------
+        country_index: pd.Index
+            Sorted index of unique countries, position in the index is the country code
+    """
+    return pd.Index(sorted(set(countries)), name='country')
+
 def _get_empty_country_df(years, countries_all, names):
     # LEGACY
     # filling an empty year*country*country dataframe with no values
@@ -55,16 +72,50 @@ def _get_empty_country_df(years, countries_all, names):
     empty_df = pd.DataFrame(index=index)
     return empty_df
 
-def get_empty_country_df(years, countries_all=None, names=['year', 'alter', 'ego']):
+def get_empty_country_df(years, countries_all=None, names=['year', 'alter', 'ego'], compact=False):
     # filling an empty year*country*country dataframe with no values
     sm = get_system_members(min(years), max(years))
+    if compact:
+        sm = to_compact_triple(sm)
     sm.set_index(['year', 'alter', 'ego'], drop=True, inplace=True)
     sm.index.names=names
     #index = pd.MultiIndex.from_tuples(sm.values, names=names)
     #empty_df = pd.DataFrame(index=index)
     return sm#empty_df
 
+def to_compact_triple(df_triple, country_labels=['alter', 'ego'], year_label='year', value_labels=['value'], country_dtype=None):
+    """Returns a triple with compact dtypes: countries as the shared categorical (stable integer codes), int16 years and float32 values
+
+    Parameters
+    ------------
+        df_triple: pd.DataFrame
+            Dyadic data, labels can be columns or index levels
+        country_labels: list
+            Country columns (or index levels)
+        year_label: str
+            Year column (or index level)
+        value_labels: list
+            Value columns, missing ones are skipped
+        country_dtype: pd.CategoricalDtype or None
+            Dtype of the countries, None for utils.countryconverter.get_country_dtype
+    Return
+    -----------
+        df_compact : pd.DataFrame
+            df_triple with compact dtypes (and the same index levels)
+    """
+    index_names = [name for name in df_triple.index.names if name is not None]
+    df = df_triple.reset_index() if len(index_names) > 0 else df_triple.copy()
+    if country_dtype is None:
+        country_dtype = get_country_dtype(pd.unique(pd.concat([df[label] for label in country_labels]).dropna()))
+    dtypes = {label: country_dtype for label in country_labels}
+    dtypes[year_label] = COMPACT_YEAR_DTYPE
+    dtypes.update({label: COMPACT_VALUE_DTYPE for label in value_labels if label in df.columns})
+    df = df.astype(dtypes)
+    return df.set_index(index_names) if len(index_names) > 0 else df
+
+@lru_cache(maxsize=None)
 def _get_system_members_base():
+    """Reads and converts COW system membership once, on first use (callers copy the result)"""
     sm = pd.read_csv('../data/raw/system_membership/system2016.csv')  #  Manually fixed Andorra's inexistance in 1962-1993
     sm = convert_country_df(sm, 'ccode', numeric_type='cow', warning=False, print_convertions=False)
     sm = sm.replace('None', np.nan).dropna()
@@ -81,7 +132,7 @@ def _get_system_members_base():
 def get_system_members(year_start, year_end, great_only=False):
     if year_end > YEAR_MAX_SUPPORTED: 
         raise NotImplementedError(f"cannot process {year_end}, max is {YEAR_MAX_SUPPORTED}")
-    _sm = sm.copy()
+    _sm = _get_system_members_base().copy()
     # Adding Palestine
     palestine_values = [['State of Palestine', y] for y in range (year_start, year_end+1)]
     palestine_df = pd.DataFrame(palestine_values, columns=['ego', 'year'])
@@ -100,7 +151,40 @@ def get_system_members(year_start, year_end, great_only=False):
     #sm.apply(lambda x:get_dyad_dict(x['ego'], x['year'], ),axis=1)
     return sm_dyad
 
+def get_system_member_mask(year_start, year_end, country_index=None):
+    """Returns system membership as a boolean mask [year, country], dyads of get_system_members are the pairs of distinct members of a year
+
+    Parameters
+    ------------
+        year_start: int
+            First year
+        year_end: int
+            Last year
+        country_index: pd.Index or None
+            Countries of the mask columns, None for the index of all members of the period (see get_country_index).
+            Members outside of country_index are dropped
+    Return
+    -----------
+        country_index : pd.Index
+            Countries of the mask columns
+        mask : np.ndarray
+            Boolean array [year - year_start, country]
+    """
+    if year_end > YEAR_MAX_SUPPORTED: 
+        raise NotImplementedError(f"cannot process {year_end}, max is {YEAR_MAX_SUPPORTED}")
+    sm = _get_system_members_base()
+    sm = sm[(sm['year']>=year_start) & (sm['year']<=year_end)]
+    egos = np.concatenate([sm['ego'].to_numpy(dtype=object), np.full(year_end - year_start + 1, 'State of Palestine', dtype=object)])
+    years = np.concatenate([sm['year'].to_numpy(dtype=int), np.arange(year_start, year_end + 1)])
+    if country_index is None:
+        country_index = get_country_index(egos)
+    codes = country_index.get_indexer(egos)
+    mask = np.zeros((year_end - year_start + 1, len(country_index)), dtype=bool)
+    mask[years[codes >= 0] - year_start, codes[codes >= 0]] = True
+    return country_index, mask
+
 def visualise_test(df_triple, dataname='test', alter_label='alter', ego_label='ego', year_label='year', value_label='value', topnum=3):
+    from matplotlib import pyplot as plt
     # Выбираем данные за последние 30 лет
     years_to_plot = range(df_triple[year_label].min(), df_triple[year_label].max() + 1)
     
@@ -143,7 +227,16 @@ def visualise_test(df_triple, dataname='test', alter_label='alter', ego_label='e
     logging.info("saving figure")
     plt.savefig(f"../output/test_plots/test_{dataname}.png")
 
-def test_df(df_triple, source_name, year_start, year_end, alter_label='alter', ego_label='ego', year_label='year', value_label='value'):
+def test_df(df_triple, source_name, year_start, year_end, alter_label='alter', ego_label='ego', year_label='year', value_label='value', deferred=False):
+    """Tests coverage of a source against system membership
+
+    By default the source is tested and plotted at once. If deferred (or if the default collector is deferred, see utils.diagnostics.DiagnosticsCollector),
+    only a lightweight record is collected, coverage and plots of all sources are computed later by utils.diagnostics.report_diagnostics.
+    """
+    from utils.diagnostics import DIAGNOSTICS, DiagnosticRecord
+    if deferred or DIAGNOSTICS.deferred:
+        DIAGNOSTICS.add(DiagnosticRecord(df_triple, source_name, year_start, year_end, alter_label, ego_label, year_label, value_label))
+        return
     logging.info("Testing initiated")
     sm = get_system_members(year_start, year_end)
     sm_great = get_system_members(year_start, year_end, great_only=True)
@@ -203,4 +296,3 @@ def get_percent_df(processed_df, year=None, EGO_LABEL='ego', YEAR_LABEL='year',
     percent_df.set_index(['alter','ego'], inplace=True)
     return percent_df.fillna(0)
 
-sm = _get_system_members_base()